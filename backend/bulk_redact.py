@@ -0,0 +1,202 @@
+# bulk_redact.py
+"""
+Offline PII redaction for JSONL archives and plain log files.
+
+    python backend/bulk_redact.py chats.jsonl -o chats.redacted.jsonl --fields prompt,response
+
+The input is streamed in bounded batches of lines that a process pool
+redacts in parallel; output order matches input order. Every string and
+number value (or only those under ``--fields``) goes through the same
+scan_pii/mask_spans path as the online mask_pii, so results are identical;
+masked numbers become strings. Lines that are not JSON objects or arrays are
+masked as plain text. Lines without PII are written back unchanged.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+
+from detect_pii import mask_spans, scan_pii
+
+# Lines are handed to workers in batches of roughly this many bytes.
+DEFAULT_CHUNK_BYTES = 4 * 1024 * 1024
+# Batches queued per worker; bounds memory no matter how large the input is.
+BATCHES_PER_WORKER = 2
+
+_NOT_JSON = object()
+
+
+def _redact_value(value, counts: Counter, fields, selected: bool):
+    if isinstance(value, str):
+        if not selected:
+            return value
+        spans = scan_pii(value)
+        if not spans:
+            return value
+        counts.update(span.category for span in spans)
+        return mask_spans(value, spans)
+    if isinstance(value, dict):
+        return {
+            k: _redact_value(v, counts, fields, selected or (fields is not None and k in fields))
+            for k, v in value.items()
+        }
+    if isinstance(value, list):
+        return [_redact_value(v, counts, fields, selected) for v in value]
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and selected:
+        # A card or phone number stored as a JSON number; masking makes it a string.
+        text = json.dumps(value)
+        spans = scan_pii(text)
+        if spans:
+            counts.update(span.category for span in spans)
+            return mask_spans(text, spans)
+    return value
+
+
+def redact_line(line: bytes, fields=None):
+    """
+    Redact one line and return (redacted line, Counter of categories).
+    ``fields`` limits JSON redaction to values under those keys (at any depth).
+    """
+    counts = Counter()
+    text = line.decode("utf-8", errors="surrogateescape")
+    body = text.rstrip("\r\n")
+    ending = text[len(body):]
+    if not body.strip():
+        return line, counts
+    try:
+        record = json.loads(body)
+    except ValueError:
+        record = _NOT_JSON
+    if not isinstance(record, (dict, list)):
+        # A bare number or string is masked as text, exactly like mask_pii would.
+        record = _NOT_JSON
+
+    if record is _NOT_JSON:
+        spans = scan_pii(body)
+        if not spans:
+            return line, counts
+        counts.update(span.category for span in spans)
+        redacted = mask_spans(body, spans)
+    else:
+        masked = _redact_value(record, counts, fields, fields is None)
+        if not counts:
+            return line, counts
+        redacted = json.dumps(masked, ensure_ascii=False)
+    return (redacted + ending).encode("utf-8", errors="surrogateescape"), counts
+
+
+def _redact_batch(lines: list, fields):
+    counts = Counter()
+    redacted_lines = 0
+    out = []
+    for line in lines:
+        redacted, line_counts = redact_line(line, fields)
+        if line_counts:
+            redacted_lines += 1
+            counts.update(line_counts)
+        out.append(redacted)
+    return b"".join(out), counts, redacted_lines
+
+
+def _batches(stream, chunk_bytes: int):
+    batch = []
+    size = 0
+    for line in stream:
+        batch.append(line)
+        size += len(line)
+        if size >= chunk_bytes:
+            yield batch, size
+            batch = []
+            size = 0
+    if batch:
+        yield batch, size
+
+
+def redact_stream(source, sink, fields=None, workers: int = None, chunk_bytes: int = DEFAULT_CHUNK_BYTES) -> dict:
+    """
+    Redact the binary line stream ``source`` into ``sink`` and return a
+    report with line/byte totals, per-category counts and throughput.
+    ``workers=1`` runs inline without a process pool.
+    """
+    workers = workers or os.cpu_count() or 1
+    fields = frozenset(fields) if fields else None
+    counts = Counter()
+    report = {"lines": 0, "redacted_lines": 0, "bytes": 0}
+    started = time.perf_counter()
+
+    def collect(result):
+        data, batch_counts, redacted_lines = result
+        sink.write(data)
+        counts.update(batch_counts)
+        report["redacted_lines"] += redacted_lines
+
+    if workers == 1:
+        for batch, size in _batches(source, chunk_bytes):
+            report["lines"] += len(batch)
+            report["bytes"] += size
+            collect(_redact_batch(batch, fields))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            for batch, size in _batches(source, chunk_bytes):
+                report["lines"] += len(batch)
+                report["bytes"] += size
+                pending.append(pool.submit(_redact_batch, batch, fields))
+                while len(pending) >= workers * BATCHES_PER_WORKER:
+                    collect(pending.popleft().result())
+            while pending:
+                collect(pending.popleft().result())
+
+    elapsed = time.perf_counter() - started
+    report["seconds"] = round(elapsed, 3)
+    report["mb_per_s"] = round(report["bytes"] / (1024 * 1024) / elapsed, 2) if elapsed else 0.0
+    report["counts"] = dict(counts.most_common())
+    return report
+
+
+def redact_file(input_path: str, output_path: str, fields=None, workers: int = None, chunk_bytes: int = DEFAULT_CHUNK_BYTES) -> dict:
+    """
+    Redact ``input_path`` into ``output_path``; see redact_stream.
+    """
+    with open(input_path, "rb") as source, open(output_path, "wb") as sink:
+        return redact_stream(source, sink, fields, workers, chunk_bytes)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mask PII in JSONL or plain-text log files.")
+    parser.add_argument("input", help="input file, or - for stdin")
+    parser.add_argument("-o", "--output", default="-", help="output file, or - for stdout (default)")
+    parser.add_argument("--fields", help="comma-separated JSON keys to redact (default: every string value)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--chunk-mb", type=float, default=DEFAULT_CHUNK_BYTES / (1024 * 1024), help="batch size in MB")
+    parser.add_argument("--counts", help="also write the report (with per-category counts) to this JSON file")
+    args = parser.parse_args(argv)
+
+    fields = [f.strip() for f in args.fields.split(",") if f.strip()] if args.fields else None
+    source = sys.stdin.buffer if args.input == "-" else open(args.input, "rb")
+    sink = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    try:
+        report = redact_stream(source, sink, fields, args.workers, int(args.chunk_mb * 1024 * 1024))
+    finally:
+        if source is not sys.stdin.buffer:
+            source.close()
+        if sink is not sys.stdout.buffer:
+            sink.close()
+
+    if args.counts:
+        with open(args.counts, "w") as f:
+            json.dump(report, f, indent=2)
+    print(
+        f"Redacted {report['redacted_lines']}/{report['lines']} lines, "
+        f"{report['bytes'] / (1024 * 1024):.1f} MB in {report['seconds']}s ({report['mb_per_s']} MB/s)",
+        file=sys.stderr,
+    )
+    for category, count in report["counts"].items():
+        print(f"  {category}: {count}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
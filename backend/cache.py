@@ -0,0 +1,184 @@
+# cache.py
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Defaults for every cache; each can be overridden through the environment.
+# PROMPT_CACHE_DB enables the shared on-disk tier (off by default because it
+# persists LLM output, which may echo the user's prompt).
+CACHE_ENABLED = os.getenv("PROMPT_CACHE_DISABLED", "") == ""
+CACHE_MAX_ENTRIES = int(os.getenv("PROMPT_CACHE_MAX_ENTRIES", "2048"))
+CACHE_TTL = float(os.getenv("PROMPT_CACHE_TTL", "3600"))
+CACHE_DB_PATH = os.getenv("PROMPT_CACHE_DB", "")
+CACHE_DB_MAX_ROWS = int(os.getenv("PROMPT_CACHE_DB_MAX_ROWS", "100000"))
+
+_caches = {}
+
+
+def normalize_prompt(text: str) -> str:
+    """
+    Collapse runs of whitespace so retyped or re-pasted prompts share a key.
+    """
+    return " ".join(text.split())
+
+
+class MemoryTier:
+    """
+    Bounded in-process LRU with a per-entry TTL.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteTier:
+    """
+    On-disk tier that several uvicorn workers can share. Values are stored as
+    JSON; expired rows are skipped on read and pruned periodically on write.
+    """
+
+    def __init__(self, path: str, ttl: float, max_rows: int = CACHE_DB_MAX_ROWS):
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM cache WHERE key = ? AND expires >= ?", (key, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time() + self.ttl),
+            )
+            self._writes += 1
+            if self._writes % 500 == 0:
+                self._prune()
+            self._conn.commit()
+
+    def _prune(self):
+        self._conn.execute("DELETE FROM cache WHERE expires < ?", (time.time(),))
+        self._conn.execute(
+            "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY expires DESC LIMIT -1 OFFSET ?)",
+            (self.max_rows,),
+        )
+
+
+class ResultCache:
+    """
+    Two-level cache for LLM results: an in-memory LRU in front of an optional
+    SQLite tier. Disk hits are promoted into memory.
+    """
+
+    def __init__(self, name: str, max_entries: int = CACHE_MAX_ENTRIES, ttl: float = CACHE_TTL, db_path: str = CACHE_DB_PATH):
+        self.name = name
+        self.memory = MemoryTier(max_entries, ttl)
+        self.disk = SQLiteTier(db_path, ttl) if db_path else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.disk_errors = 0
+
+    def make_key(self, model: str, version, *parts: str) -> str:
+        """
+        Build a key from the model, the prompt version and the normalized text
+        that is sent to the provider. Only the hash is kept.
+        """
+        raw = "\x1f".join([self.name, model, str(version)] + [normalize_prompt(p) for p in parts])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    async def get(self, key: str):
+        if not CACHE_ENABLED:
+            return None
+        value = self.memory.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        if self.disk is not None:
+            try:
+                value = await asyncio.to_thread(self.disk.get, key)
+            except sqlite3.Error as e:
+                # A locked or corrupt database must not fail the request: treat it as a miss.
+                self.disk_errors += 1
+                print(f"Cache read error ({self.name}): {e}")
+                value = None
+            if value is not None:
+                self.disk_hits += 1
+                self.memory.set(key, value)
+                return value
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value):
+        if not CACHE_ENABLED:
+            return
+        self.memory.set(key, value)
+        if self.disk is not None:
+            try:
+                await asyncio.to_thread(self.disk.set, key, value)
+            except sqlite3.Error as e:
+                self.disk_errors += 1
+                print(f"Cache write error ({self.name}): {e}")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "disk_errors": self.disk_errors,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            "entries": len(self.memory),
+        }
+
+
+def get_cache(name: str) -> ResultCache:
+    """
+    Return the process-wide cache registered under ``name``.
+    """
+    if name not in _caches:
+        _caches[name] = ResultCache(name)
+    return _caches[name]
+
+
+def cache_stats() -> dict:
+    return {name: cache.stats() for name, cache in _caches.items()}
@@ -0,0 +1,92 @@
+# cancellation.py
+import asyncio
+from collections import OrderedDict
+
+from fastapi import Request
+
+# Sessions whose latest generation is remembered. Oldest are dropped first.
+MAX_SESSIONS = 10000
+
+# session_id -> (latest generation, set of tasks running for it)
+_sessions = OrderedDict()
+
+stats = {"superseded": 0, "disconnected": 0}
+
+
+class Superseded(Exception):
+    """Raised when a newer generation from the same session replaced the request."""
+
+
+class ClientDisconnected(Exception):
+    """Raised when the client went away before the work finished."""
+
+
+def _register(session_id: str, generation: int, task: asyncio.Task) -> bool:
+    """
+    Record ``task`` as the work for ``generation`` of ``session_id``. Older
+    generations still running are cancelled. Returns False if a newer
+    generation has already been seen, i.e. this request arrived stale.
+    """
+    entry = _sessions.get(session_id)
+    tasks = set()
+    if entry is not None:
+        latest, running = entry
+        if generation < latest:
+            return False
+        if generation == latest:
+            tasks = running
+        else:
+            for stale in running:
+                stale.cancel()
+    tasks.add(task)
+    task.add_done_callback(tasks.discard)
+    _sessions[session_id] = (generation, tasks)
+    _sessions.move_to_end(session_id)
+    while len(_sessions) > MAX_SESSIONS:
+        _sessions.popitem(last=False)
+    return True
+
+
+async def _wait_for_disconnect(request: Request):
+    # The body has already been read, so the next ASGI message is the disconnect.
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def run_cancellable(request: Request, coro, session_id: str = None, generation: int = None):
+    """
+    Await ``coro`` and cancel it if the client disconnects or, when a session
+    id and generation are given, once a newer generation from that session
+    arrives. Cancellation reaches provider calls and their retry sleeps.
+
+    Raises Superseded or ClientDisconnected when the work was abandoned.
+    """
+    task = asyncio.ensure_future(coro)
+    if session_id is not None and generation is not None:
+        if not _register(session_id, generation, task):
+            task.cancel()
+            stats["superseded"] += 1
+            raise Superseded()
+    watcher = asyncio.ensure_future(_wait_for_disconnect(request))
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        watcher.cancel()
+
+    if not task.done():
+        task.cancel()
+        stats["disconnected"] += 1
+        raise ClientDisconnected()
+    if task.cancelled():
+        stats["superseded"] += 1
+        raise Superseded()
+    return task.result()
+
+
+def cancellation_stats() -> dict:
+    return dict(stats)
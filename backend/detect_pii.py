@@ -1,4 +1,51 @@
+# detect_pii.py
+"""
+Regex-based PII detection and masking for prompts.
+
+PATTERNS bounds some repetitions that the original patterns left unbounded,
+so that no pattern can cost quadratic time on adversarial text. What gets
+masked differs only past these limits:
+
+- an email domain is at most 255 characters before a top-level domain of at
+  most 63 letters; a longer one is not masked;
+- a credential value (password, keys, username) is matched for at most 512
+  characters, and a longer one is judged and masked by its first 512. An
+  ASCII value that long never has the distinct characters the credential
+  filter asks for, so it was not masked before either;
+- an amount followed by "$" has at most five ",ddd" groups, and at most 32
+  leading digits unless they start a run of digits; in a longer one only the
+  last five groups and the "$" are masked;
+- an email local part that does not start a run of its characters is at
+  most 64 characters (one that does is matched whole).
+"""
+import asyncio
+import bisect
+import logging
+import os
 import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, NamedTuple, Optional
+
+from metrics import stage
+
+logger = logging.getLogger(__name__)
+
+try:
+    import re._parser as _sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse as _sre_parse
+
+try:
+    import re2
+except ImportError:
+    re2 = None
+
+# Engine that finds where matches can start: "re" (default), "re2" for RE2's
+# linear-time search (needs the google-re2 package) or "auto" to use RE2 when
+# installed. With RE2, every pattern treats \w and \b as ASCII-only, so spans
+# next to non-ASCII letters can differ slightly from the default engine.
+REGEX_ENGINE = os.getenv("PII_REGEX_ENGINE", "re").lower()
 
 PATTERNS = {
     "bank_account_number": r"\b\d{10,12}\b",
@@ -13,14 +60,19 @@ PATTERNS = {
         r"\b(?:(?:5[0678]\d\d|6304|6390|67\d\d)\d{8,15})\b",        # Maestro
         r"\b(?:\d{4}[-\s]?\d{4}[-\s]?\d{4}[-\s]?\d{4})\b",          # Generic 16-digit pattern
     ],
+    # Repetitions that a failed match would rescan from every later start
+    # position are bounded (domains, credential values, thousands groups).
+    # Amounts and email local parts take a whole run only from the run's
+    # first character and are bounded elsewhere, so the scan stays linear on
+    # long digit runs or label-heavy pastes.
     "money": [
         r'\{\$?\d+(?:\.\d{2})?\$?\}',
-        r'(?:\$\s?\d+(?:,\d{3})*(?:\.\d{2})?|\d+(?:,\d{3})*(?:\.\d{2})?\s?\$)'
+        r'(?:\$\s?\d+(?:,\d{3})*(?:\.\d{2})?|(?:(?<!\d)\d+|\d{1,32})(?:,\d{3}){0,5}(?:\.\d{2})?\s?\$)'
     ],
     "ssn_tin": r"\b\d{3}-\d{2}-\d{4}\b",
     "ein": r"\b\d{2}-\d{7}\b",
     "passport_number": r"\b[A-Z]{1}\d{7}\b",
-    "email_address": r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b",
+    "email_address": r"\b(?:(?<![\w.%+-])[A-Za-z0-9._%+-]+|[A-Za-z0-9._%+-]{1,64})@[A-Za-z0-9.-]{1,255}\.[A-Za-z]{2,63}\b",
     "phone_number": [
         r"\+?\b(?:1[-.\s]?)?(?:\(?[2-9]\d{2}\)?[-.\s]?)?[2-9]\d{2}[-.\s]?\d{4}\b",
         r"\b\d{10}\b",
@@ -31,91 +83,966 @@ PATTERNS = {
     "home_address": r"\b\d{1,9},\s[\w\s]+,\s[\w\s]+,\s[A-Z]{2}\s\d{5}(?:-\d{4})?\b",
     "race": r"\b(?:White|Black|Asian|Native American|Pacific Islander|Multiracial|Biracial)\b",
     "ethnicity": r"\b(?:Hispanic|Latino|Latinx|African American|Caucasian|Arab|Jewish|Slavic|Celtic|Germanic|Scandinavian|Mediterranean|Ashkenazi|Sephardic)\b",
-    "password": r"(?i)(password)\s*[:=]\s*['\"]?([^\s'\";]+)['\"]?",
-    "access_key": r"(?i)(access[-_\s]*key)\s*[:=]\s*['\"]?([A-Z0-9]{16,})['\"]?",
-    "secret_key": r"(?i)(secret[-_\s]*key)\s*[:=]\s*['\"]?([\w/\+=_-]{8,})['\"]?",
-    "api_key": r"(?i)(api[-_\s]*key)\s*[:=]\s*['\"]?(sk-[A-Za-z0-9-_]{16,})['\"]?",
+    "password": r"(?i)(password)\s*[:=]\s*['\"]?([^\s'\";]{1,512})['\"]?",
+    "access_key": r"(?i)(access[-_\s]*key)\s*[:=]\s*['\"]?([A-Z0-9]{16,512})['\"]?",
+    "secret_key": r"(?i)(secret[-_\s]*key)\s*[:=]\s*['\"]?([\w/\+=_-]{8,512})['\"]?",
+    "api_key": r"(?i)(api[-_\s]*key)\s*[:=]\s*['\"]?(sk-[A-Za-z0-9-_]{16,512})['\"]?",
     # Standalone AWS keys.
     "aws_access_key": r"\bAKIA[0-9A-Z]{16}\b",
     "aws_secret_key": r"\b[0-9a-zA-Z/+=]{40}\b",
     # Generic credentials detection.
-    "generic_credentials": r"(?i)(user|login|username)\s*[:=]\s*['\"]?([^\s'\";]+)['\"]?"
+    "generic_credentials": r"(?i)(user|login|username)\s*[:=]\s*['\"]?([^\s'\";]{1,512})['\"]?"
 }
 
 
-compiled_patterns = {}
-for key, pattern in PATTERNS.items():
-    if isinstance(pattern, list):
-        compiled_patterns[key] = [re.compile(p, re.IGNORECASE) for p in pattern]
-    else:
-        compiled_patterns[key] = re.compile(pattern, re.IGNORECASE)
+# Cheap necessary condition for each category: a match can only start where its
+# anchor matches. The scanner tests the anchors before trying any full pattern,
+# so most positions in ordinary prose are rejected after a character or two.
+# A category without an anchor disables this prefilter (correct, just slower).
+ANCHORS = {
+    "bank_account_number": r"\d",
+    "bank_routing_number": r"\d",
+    "credit_card_number": r"\d",
+    "money": r"[{$\d]",
+    "ssn_tin": r"\d",
+    "ein": r"\d",
+    "passport_number": r"[a-z]\d",
+    "email_address": r"\b(?:(?<![\w.%+-])[\w.%+-]+|[\w.%+-]{1,64})@",
+    "phone_number": r"[+(\d]",
+    "dates_of_birth": r"\d",
+    "home_address": r"\d",
+    "race": r"\b(?:white|black|asian|native|pacific|multiracial|biracial)",
+    "ethnicity": r"\b(?:hispanic|latin|african|caucasian|arab|jewish|slavic|celtic|germanic|scandinavian|mediterranean|ashkenazi|sephardic)",
+    "password": r"password",
+    "access_key": r"access",
+    "secret_key": r"secret",
+    "api_key": r"api",
+    "aws_access_key": r"akia",
+    "aws_secret_key": r"\b[0-9a-z/+=]{40}",
+    "generic_credentials": r"user|login",
+}
 
 
+CREDENTIAL_KEYS = {"access_key", "secret_key", "api_key", "password", "generic_credentials"}
+
+# Every credential match starts with one of these.
+_CREDENTIAL_LABEL = re.compile(r"password|access|secret|api|user|login", re.IGNORECASE)
+# A credential match cut short at any point after its label.
+_CREDENTIAL_PREFIX = re.compile(
+    r"(?:password|access[-_\s]*key|secret[-_\s]*key|api[-_\s]*key|user(?:name)?|login)\s*[:=]\s*['\"]?[^\s'\";]*",
+    re.IGNORECASE,
+)
+# How far before a match its credential label is looked for.
+_LABEL_REACH = 64
+# Characters a mask can run together with into a longer email address, AWS
+# secret or credential value, and the characters a credential value takes.
+_JOINING = re.compile(r"[\w@/+=%.-]*")
+_VALUE_RUN = re.compile(r"[^\s'\";]*")
+# The two ends of a street address; a mask between them can complete one.
+_ADDRESS_HEAD = re.compile(r"\b\d{1,9},\s")
+_ADDRESS_TAIL = re.compile(r",\s[A-Z]{2}\s\d{5}(?:-\d{4})?\b", re.IGNORECASE)
+
 GENERIC_LABELS = {"api key", "access key", "secret key", "password", "username", "user", "login"}
 
+
+class PiiSpan(NamedTuple):
+    category: str
+    start: int
+    end: int
+
+
+def _pattern_list(pattern) -> list:
+    return pattern if isinstance(pattern, list) else [pattern]
+
+
+# Every pattern is also compiled on its own: these are the passes mask_pii
+# used to make, which the scanner replays where masks can interact.
+compiled_patterns = {
+    key: [re.compile(p, re.IGNORECASE) for p in _pattern_list(pattern)]
+    for key, pattern in PATTERNS.items()
+}
+
+# All patterns folded into one alternation, in PATTERNS order and behind the
+# anchor prefilter, so the text is walked once. Each alternative gets a named
+# group "p<i>"; _ALTERNATIVES[i] holds its category and standalone pattern.
+_ALTERNATIVES = []
+_parts = []
+_plain_parts = []  # the same without capturing groups
+for key, patterns in compiled_patterns.items():
+    for p in patterns:
+        name = f"p{len(_ALTERNATIVES)}"
+        # The whole matcher is case-insensitive; inline global flags are only
+        # legal at the very start of an expression so they are stripped here.
+        body = p.pattern[4:] if p.pattern.startswith("(?i)") else p.pattern
+        _parts.append(f"(?P<{name}>{body})")
+        _plain_parts.append(re.sub(r"(?<!\\)\((?!\?)", "(?:", body))
+        _ALTERNATIVES.append((key, p))
+_anchor_gate = ""
+if all(key in ANCHORS for key in PATTERNS):
+    _anchors = list(dict.fromkeys(ANCHORS[key] for key in PATTERNS))
+    _anchor_gate = "(?=" + "|".join(_anchors) + ")"
+
+
+def _re2_pattern(pattern: str):
+    # RE2 has no lookarounds. It does not need the anchor gate, and dropping
+    # the run-start lookbehinds only lets it find more candidates. The
+    # pattern is compiled as Latin-1 bytes and matched against
+    # _subject(text): the google-re2 wrapper re-encodes a str argument on
+    # every call, which made each search cost as much as the whole text.
+    pattern = re.sub(r"\(\?<![^()]*\)", "", pattern)
+    options = re2.Options()
+    options.encoding = re2.Options.Encoding.LATIN1
+    # The combined matcher's DFA thrashes (and falls back to the NFA) in
+    # RE2's default 8 MB.
+    options.max_mem = 32 << 20
+    return re2.compile(("(?i)" + pattern).encode("latin-1"), options)
+
+
+def _ascii_pattern(p: re.Pattern) -> re.Pattern:
+    # ``p`` for a Latin-1 subject, with ASCII \w and \b as RE2 has them.
+    return re.compile(p.pattern.encode("latin-1"), p.flags & ~re.UNICODE)
+
+
+# With RE2 the combined matcher only locates candidates: one search without
+# capturing groups finds the next position where some pattern, lookbehinds
+# aside, can match. Only there is the re matcher tried, anchored, for the
+# alternative and its end. Capturing groups cost RE2 about 10 us per search
+# and each call through its wrapper a few more, which scans of match-dense
+# text (a run of "$1") pay once per match.
+_locator = None
+if REGEX_ENGINE in ("re2", "auto") and re2 is not None:
+    try:
+        _locator = _re2_pattern("(?:" + "|".join(_plain_parts) + ")")
+    except Exception as e:
+        logger.warning("RE2 could not compile the PII patterns, using re: %s", e)
+elif REGEX_ENGINE == "re2":
+    logger.warning("PII_REGEX_ENGINE=re2 but google-re2 is not installed, using re")
+ACTIVE_ENGINE = "re" if _locator is None else "re2"
+combined_pattern = re.compile(_anchor_gate + "(?:" + "|".join(_parts) + ")", re.IGNORECASE)
+del _parts, _plain_parts
+# The alternative each "p<i>" group number stands for. A match's lastindex is
+# its alternative's group, which encloses the rest.
+_GROUP_ALTERNATIVE = {number: int(name[1:]) for name, number in combined_pattern.groupindex.items()}
+
+# With RE2 on, every pattern matches the Latin-1 subject, so every match in a
+# scan follows the same (ASCII) rules for \w and \b.
+if ACTIVE_ENGINE == "re2":
+    combined_pattern = _ascii_pattern(combined_pattern)
+    _ALTERNATIVES = [(key, _ascii_pattern(p)) for key, p in _ALTERNATIVES]
+    _CREDENTIAL_LABEL, _CREDENTIAL_PREFIX, _ADDRESS_HEAD, _ADDRESS_TAIL, _JOINING, _VALUE_RUN = (
+        _ascii_pattern(p)
+        for p in (_CREDENTIAL_LABEL, _CREDENTIAL_PREFIX, _ADDRESS_HEAD, _ADDRESS_TAIL, _JOINING, _VALUE_RUN)
+    )
+
+
+def _subject(text: str):
+    """
+    What the active engine's patterns match against: the text itself for
+    re, or one byte per character for RE2, with the characters Latin-1 has
+    no byte for (never ASCII word characters or spaces) replaced by "?".
+    Offsets are the same either way.
+    """
+    if ACTIVE_ENGINE == "re":
+        return text
+    return text.encode("latin-1", "replace")
+
+
+def _is_weak_credential(value: str) -> bool:
+    """
+    Return True for credential values that look like labels or filler
+    (too short, a generic label, or too few distinct characters).
+    """
+    value_clean = value.strip().lower()
+    if len(value_clean) < 10 or value_clean in GENERIC_LABELS:
+        return True
+    if len(set(value_clean)) <= 1:
+        return True
+    if (len(set(value_clean)) / len(value_clean)) < 0.3:
+        return True
+    return False
+
+
+def _credential_value(text: str, match, inner_groups: int) -> str:
+    # Same rule as the per-pattern matcher used: the second capture group holds
+    # the value when present, otherwise the whole match. Taken from ``text``,
+    # since an RE2 match is on its Latin-1 subject.
+    group = 2 if inner_groups >= 2 and match.start(2) >= 0 else 0
+    return text[match.start(group):match.end(group)]
+
+
+def _accept(key: str, text: str, match, inner_groups: int) -> bool:
+    if key not in CREDENTIAL_KEYS:
+        return True
+    return not _is_weak_credential(_credential_value(text, match, inner_groups))
+
+
+# Matches with less than two margins of text between them are masked
+# together, and a stretch of text is replayed with a margin either side of
+# its matches, so the passes see there what they saw over the whole text.
+_REPLAY_MARGIN = 16
+
+
+class _Timeout(Exception):
+    """The deadline passed before the scan could settle the next piece."""
+
+
+class _Piece(NamedTuple):
+    """
+    A stretch ``[lo, hi)`` of the text that the per-pattern passes mask the
+    same on its own as within the whole text, and the spans they mask in it.
+    """
+    lo: int
+    hi: int
+    spans: tuple
+
+
+def _shifted(piece: _Piece, shift: int) -> _Piece:
+    spans = tuple(PiiSpan(span.category, span.start + shift, span.end + shift) for span in piece.spans)
+    return _Piece(piece.lo + shift, piece.hi + shift, spans)
+
+
+def _joining_start(subject, start: int, low: int) -> int:
+    # Start of the run of _JOINING characters that ends at ``start``, not before ``low``.
+    step = 16
+    while True:
+        begin = max(low, start - step)
+        run = _JOINING.match(subject[begin:start][::-1]).end()
+        if run < start - begin or begin == low:
+            return start - run
+        step *= 4
+
+
+def _is_word(subject, i: int) -> bool:
+    # Whether \w matches at ``i``: "XXXX" is made of word characters, so a
+    # mask leaves \b and lookbehinds next to it as they were when the masked
+    # text starts and ends with one. str.isalnum is Unicode like re's \w,
+    # bytes.isalnum ASCII like RE2's.
+    c = subject[i:i + 1]
+    return c.isalnum() or c in ("_", b"_")
+
+
+def _label_start(text: str, subject, start: int) -> Optional[int]:
+    # Start of a credential label whose value would take in ``start``.
+    low = max(0, start - _LABEL_REACH)
+    if text.find(":", low, start) < 0 and text.find("=", low, start) < 0:
+        return None
+    for m in _CREDENTIAL_LABEL.finditer(subject, low, start):
+        if _CREDENTIAL_PREFIX.fullmatch(subject, m.start(), start):
+            return m.start()
+    return None
+
+
+class _Next:
+    """
+    First match of ``pattern`` in ``text[:endpos]`` at or after a position,
+    for positions that never decrease.
+    """
+    __slots__ = ("pattern", "text", "endpos", "pos", "match")
+
+    def __init__(self, pattern, text: str, endpos: int):
+        self.pattern, self.text, self.endpos = pattern, text, endpos
+        self.pos = None
+        self.match = None
+
+    def at(self, pos: int):
+        if self.pos is None or pos < self.pos or (self.match is not None and self.match.start() < pos):
+            self.pos = pos
+            self.match = self.pattern.search(self.text, pos, self.endpos)
+        return self.match
+
+
+class _Cluster:
+    """
+    Matches close enough to change each other's masking, and the stretch
+    ``[lo, hi)`` that masking them can reach. Each match is (start, end,
+    index, lo, hi), with its own reach. ``value_end`` is where the value of
+    a credential in it stops once masks have taken out the whitespace in its
+    way, or -1. ``spans`` are the spans when every match is masked as found,
+    or None when the stretch must be replayed. That holds when no mask can
+    run into anything and each match either starts after the last one
+    masked, or lies inside it and is for the same or a later pattern, whose
+    pass then finds it masked.
+    """
+    __slots__ = ("lo", "hi", "matches", "value_end", "spans", "_last")
+
+    def __init__(self, match: tuple):
+        self.lo, self.hi, self.matches = match[3], match[4], []
+        self.value_end = -1
+        self.spans, self._last = [], None
+        self.add(match)
+
+    def add(self, match: tuple):
+        start, end, index, lo, hi = match
+        self.lo, self.hi = min(self.lo, lo), max(self.hi, hi)
+        self.matches.append(match)
+        if self.spans is None:
+            return
+        last = self._last
+        if last is not None and end <= last[1] and index >= last[0]:
+            return
+        key = _ALTERNATIVES[index][0]
+        if (last is not None and start < last[1]) or (lo, hi) != (start, end) or key in CREDENTIAL_KEYS:
+            self.spans = None
+            return
+        self.spans.append(PiiSpan(key, start, end))
+        self._last = (index, end)
+
+    def absorb(self, other: "_Cluster"):
+        self.value_end = max(self.value_end, other.value_end)
+        if other.spans is None:
+            self.spans = None
+        for match in other.matches:
+            self.add(match)
+
+
+def _apply_masks(masked: str, masks: list, found: list, key: str, origin: int) -> tuple:
+    """
+    Replace each ``(a, b)`` of ``found`` in ``masked`` with "XXXX". ``masks``
+    holds the earlier masks as (start in ``masked``, original start, original
+    end, category); a mask that a new one overlaps is swallowed by it.
+    Returns the new text and masks.
+    """
+    parts, updated = [], []
+    pos = 0
+    shrink = 0  # how much shorter the new text is before ``pos``
+    offset = origin  # original offset minus offset in ``masked`` after masks[:i]
+    i = 0
+    for a, b in found:
+        while i < len(masks) and masks[i][0] + 4 <= a:
+            start, o_start, o_end, category = masks[i]
+            updated.append((start - shrink, o_start, o_end, category))
+            offset += o_end - o_start - 4
+            i += 1
+        o_a = masks[i][1] if i < len(masks) and masks[i][0] < a else a + offset
+        o_b = None
+        while i < len(masks) and masks[i][0] < b:
+            start, o_start, o_end, _ = masks[i]
+            offset += o_end - o_start - 4
+            o_b = o_end if start + 4 >= b else None
+            i += 1
+        if o_b is None:
+            o_b = b + offset
+        parts += [masked[pos:a], "XXXX"]
+        updated.append((a - shrink, o_a, o_b, key))
+        shrink += b - a - 4
+        pos = b
+    for start, o_start, o_end, category in masks[i:]:
+        updated.append((start - shrink, o_start, o_end, category))
+    parts.append(masked[pos:])
+    return "".join(parts), updated
+
+
+def _replay(text: str, lo: int, hi: int, endpos: int, deadline: Optional[float] = None) -> List[PiiSpan]:
+    """
+    The per-pattern passes mask_pii used to make, over ``text[lo:hi]``: each
+    pattern in PATTERNS order masks what it matches in the text the earlier
+    ones left, so a mask can break, join or extend later matches. Returns the
+    final masks as PiiSpan tuples in original offsets, a mask that swallowed
+    earlier ones spanning them all. The characters just outside the stretch
+    are only context.
+    """
+    origin = max(0, lo - _CONTEXT)
+    masked = text[origin:min(endpos, hi + _CONTEXT)]
+    after = min(endpos, hi + _CONTEXT) - hi
+    masks = []
+    for key, p in _ALTERNATIVES:
+        if deadline is not None and time.time() >= deadline:
+            raise _Timeout
+        limit = len(masked) - after
+        found = []
+        for m in p.finditer(_subject(masked), lo - origin):
+            if m.start() >= limit:
+                break
+            if m.end() > m.start() and _accept(key, masked, m, p.groups):
+                found.append(m.span())
+        if found:
+            masked, masks = _apply_masks(masked, masks, found, key, origin)
+    return [PiiSpan(category, start, end) for _, start, end, category in masks]
+
+
+class _Scanner:
+    """
+    Splits ``text[pos:endpos]`` into pieces, left to right, with one pass of
+    the combined matcher. ``pos`` must be 0 or where a piece of a scan from
+    the start of the text ended. Raises _Timeout once the wall-clock
+    ``deadline`` passes. With ``first``, the first piece known to mask
+    anything is yielded as soon as it is found, with one of its spans.
+    """
+
+    def __init__(self, text: str, pos: int, endpos: int, deadline: Optional[float] = None, first: bool = False):
+        self.text = text
+        self.subject = _subject(text)
+        self.pos = pos
+        self.endpos = endpos
+        self.deadline = deadline
+        self.first = first
+        self._heads = _Next(_ADDRESS_HEAD, self.subject, endpos)
+        self._tails = _Next(_ADDRESS_TAIL, self.subject, endpos)
+
+    def _check(self):
+        if self.deadline is not None and time.time() >= self.deadline:
+            raise _Timeout
+
+    def _matches(self):
+        # (start, end, index) for every position where some pattern matches,
+        # with the first alternative that does. When that is a credential the
+        # ones after it can match further, but only over its value run.
+        subject, pos, endpos = self.subject, self.pos, self.endpos
+        while True:
+            if _locator is None:
+                m = combined_pattern.search(subject, pos, endpos)
+            else:
+                # No pattern matches before the candidate, so an anchored
+                # match there is the one search would find.
+                candidate = _locator.search(subject, pos, endpos)
+                m = candidate and combined_pattern.match(subject, candidate.start(), endpos)
+                if candidate is not None and m is None:
+                    pos = candidate.start() + 1
+                    continue
+            if m is None:
+                return
+            yield m.start(), m.end(), _GROUP_ALTERNATIVE[m.lastindex]
+            pos = m.start() + 1
+
+    def _reach(self, start: int, end: int, index: int, cluster: Optional[_Cluster]) -> tuple:
+        """
+        How far masking the match at ``[start, end)`` can reach: over the
+        characters a mask runs together with, back to a credential label
+        it would complete or along the value of one in ``cluster`` that
+        it is part of, across a street address around it, and to the
+        neighbouring characters when it changes the word boundaries there.
+        Returns (lo, hi, value_end) with value_end as for _Cluster.
+        """
+        text, subject, endpos = self.text, self.subject, self.endpos
+        credential = _ALTERNATIVES[index][0] in CREDENTIAL_KEYS
+        # When the cluster is replayed anyway and starts WINDOW_OVERLAP
+        # before the match, only how far it reaches right counts.
+        replayed = (
+            cluster is not None and cluster.spans is None
+            and cluster.lo <= start - WINDOW_OVERLAP and start < cluster.hi + 2 * _REPLAY_MARGIN
+        )
+        lo = start if replayed else _joining_start(subject, start, max(self.pos, start - WINDOW_OVERLAP))
+        # A credential's value run is taken in anyway; its label only moves lo.
+        label = None if replayed and credential else _label_start(text, subject, start)
+        if label is not None and not replayed:
+            # The completed credential's mask runs together with what is before it.
+            lo = min(lo, _joining_start(subject, label, max(self.pos, label - WINDOW_OVERLAP)))
+        hi = value_end = end
+        if label is not None or credential or (cluster is not None and start <= cluster.value_end):
+            # The value, and a closing quote after it.
+            hi = value_end = _VALUE_RUN.match(subject, end, min(endpos, end + WINDOW_OVERLAP)).end()
+            if hi < endpos and text[hi] in "'\"":
+                hi += 1
+        else:
+            value_end = -1
+        run = _JOINING.match(subject, hi, min(endpos, hi + WINDOW_OVERLAP)).end()
+        while run > hi and text[run - 1] in ".%-":
+            run -= 1
+        hi = run
+        tail = self._tails.at(start)
+        if tail is not None and tail.start() < start + WINDOW_OVERLAP:
+            head = self._heads.at(max(0, start - WINDOW_OVERLAP))
+            if head is not None and head.start() <= start:
+                lo, hi = min(lo, head.start()), max(hi, tail.end())
+        if not _is_word(subject, start) and start > 0 and not subject[start - 1:start].isspace():
+            lo = min(lo, start - 1)
+        last, after = subject[end - 1:end], subject[end:end + 1]
+        if end < endpos and not after.isspace() and (not _is_word(subject, end - 1) or last.isdigit() and after.isdigit()):
+            hi = max(hi, end + 1)
+        return max(lo, self.pos), hi, value_end
+
+    def _clusters(self):
+        cluster = None
+        for start, end, index in self._matches():
+            self._check()
+            lo, hi, value_end = self._reach(start, end, index, cluster)
+            match = (start, end, index, lo, hi)
+            if cluster is not None and lo < cluster.hi + 2 * _REPLAY_MARGIN:
+                cluster.add(match)
+            else:
+                if cluster is not None:
+                    yield cluster
+                cluster = _Cluster(match)
+            cluster.value_end = max(cluster.value_end, value_end)
+        if cluster is not None:
+            yield cluster
+
+    def _spans(self, cluster: _Cluster, lo: int, hi: int) -> List[PiiSpan]:
+        if self.first:
+            for start, end, index, _, _ in cluster.matches:
+                if _ALTERNATIVES[index][0] not in CREDENTIAL_KEYS:
+                    return [PiiSpan(_ALTERNATIVES[index][0], start, end)]
+        if cluster.spans is not None:
+            return cluster.spans
+        return _replay(self.text, lo, hi, self.endpos, self.deadline)
+
+    def pieces(self):
+        """
+        Yield each piece once the text after it can no longer change it. A
+        cluster is replayed with a margin either side; when a mask comes
+        within _CONTEXT of either end, the stretch is widened (or joined
+        with its neighbour) and replayed again.
+        """
+        clusters = self._clusters()
+        following = next(clusters, None)
+        held = None  # (cluster, piece) until the next piece is settled
+        floor = self.pos
+        while following is not None:
+            cluster, following = following, next(clusters, None)
+            step = _REPLAY_MARGIN
+            while True:
+                if held is not None and cluster.lo - _REPLAY_MARGIN < held[1].hi:
+                    held[0].absorb(cluster)
+                    cluster, held = held[0], None
+                    continue
+                lo = max(held[1].hi if held else floor, cluster.lo - _REPLAY_MARGIN)
+                hi = min(self.endpos, cluster.hi + _REPLAY_MARGIN)
+                if following is not None and following.lo - _REPLAY_MARGIN < hi:
+                    cluster.absorb(following)
+                    following = next(clusters, None)
+                    continue
+                spans = self._spans(cluster, lo, hi)
+                if spans and spans[-1].end > hi - _CONTEXT and hi < self.endpos:
+                    cluster.hi += step
+                elif spans and spans[0].start < lo + _CONTEXT and lo > floor:
+                    cluster.lo -= step
+                else:
+                    break
+                step *= 2
+            piece = _Piece(lo, hi, tuple(spans))
+            if self.first and spans:
+                yield piece
+                return
+            if held is not None:
+                yield held[1]
+                floor = held[1].hi
+            held = (cluster, piece)
+        if held is not None:
+            yield held[1]
+
+
+def iter_pii_spans(text: str):
+    """
+    Yield the spans mask_pii masks, left to right.
+
+    The result is what masking one pattern at a time in PATTERNS order
+    gives, each pass seeing the masks of the ones before it; a mask that
+    swallowed earlier ones is one span. The text is walked once with the
+    combined matcher, and only the stretches around matches that can
+    affect each other are replayed pattern by pattern.
+    """
+    for piece in _Scanner(text, 0, len(text)).pieces():
+        yield from piece.spans
+
+
+def scan_pii(text: str) -> List[PiiSpan]:
+    """
+    Return every PII span found in the text.
+    """
+    return list(iter_pii_spans(text))
+
+
 def contains_pii(text: str) -> bool:
     """
     Check if the given text contains any PII based solely on regex matching.
     """
-    for key, pattern in compiled_patterns.items():
-        if isinstance(pattern, list):
-            for p in pattern:
-                m = p.search(text)
-                if m:
-                    if key in {"access_key", "secret_key", "api_key", "password", "generic_credentials"}:
-                        value = m.group(2) if (m.lastindex and m.lastindex >= 2) else m.group(0)
-                        value_clean = value.strip().lower()
-                        if len(value_clean) < 10 or value_clean in GENERIC_LABELS:
-                            continue
-                        if len(set(value_clean)) <= 1:
-                            continue
-                        if (len(set(value_clean)) / len(value_clean)) < 0.3:
-                            continue
-                    return True
-        else:
-            m = pattern.search(text)
-            if m:
-                if key in {"access_key", "secret_key", "api_key", "password", "generic_credentials"}:
-                    value = m.group(2) if (m.lastindex and m.lastindex >= 2) else m.group(0)
-                    value_clean = value.strip().lower()
-                    if len(value_clean) < 10 or value_clean in GENERIC_LABELS:
-                        continue
-                    if len(set(value_clean)) <= 1:
-                        continue
-                    if (len(set(value_clean)) / len(value_clean)) < 0.3:
-                        continue
-                return True
-    return False
+    return any(piece.spans for piece in _Scanner(text, 0, len(text), first=True).pieces())
 
-def _mask_replacement(match, key: str) -> str:
+
+def mask_spans(text: str, spans: List[PiiSpan]) -> str:
     """
-    Helper function for regex replacement.
-    Applies the same filtering logic as in contains_pii.
+    Replace each span in the text with 'XXXX'. Spans must be sorted and non-overlapping.
     """
-    if key in {"access_key", "secret_key", "api_key", "password", "generic_credentials"}:
-        value = match.group(2) if (match.lastindex and match.lastindex >= 2) else match.group(0)
-        value_clean = value.strip().lower()
-        if len(value_clean) < 10 or value_clean in GENERIC_LABELS:
-            return match.group(0)
-        if len(set(value_clean)) <= 1:
-            return match.group(0)
-        if (len(set(value_clean)) / len(value_clean)) < 0.3:
-            return match.group(0)
-    return 'XXXX'
+    if not spans:
+        return text
+    parts = []
+    pos = 0
+    for span in spans:
+        parts.append(text[pos:span.start])
+        parts.append("XXXX")
+        pos = span.end
+    parts.append(text[pos:])
+    return "".join(parts)
+
 
-def mask_pii(text: str) -> str:
+def mask_pii(text: str, spans: Optional[List[PiiSpan]] = None) -> str:
     """
     Returns a version of the input text with any detected PII masked.
     Only regex-based detection is used in this implementation.
+    Pass ``spans`` from an earlier scan_pii call on the same text to skip rescanning.
     """
-    if not contains_pii(text):
-        return text
+    if spans is None:
+        spans = scan_pii(text)
+    return mask_spans(text, spans)
 
-    result = text
-    for key, pattern in compiled_patterns.items():
-        if isinstance(pattern, list):
-            for p in pattern:
-                result = p.sub(lambda m: _mask_replacement(m, key), result)
-        else:
-            result = pattern.sub(lambda m: _mask_replacement(m, key), result)
+
+def to_utf16_offsets(text: str, spans: List[PiiSpan]) -> List[PiiSpan]:
+    """
+    Convert code point offsets to UTF-16 code unit offsets, which is what
+    JavaScript string indices use.
+    """
+    if text.isascii():
+        return spans
+    positions = sorted({pos for span in spans for pos in (span.start, span.end)})
+    mapping = {}
+    units = 0
+    last = 0
+    for pos in positions:
+        units += sum(2 if ord(ch) > 0xFFFF else 1 for ch in text[last:pos])
+        mapping[pos] = units
+        last = pos
+    return [PiiSpan(span.category, mapping[span.start], mapping[span.end]) for span in spans]
+
+
+def spans_as_dicts(spans: List[PiiSpan]) -> List[dict]:
+    return [span._asdict() for span in spans]
+
+
+# Large inputs (whole documents pasted into the chat box) are split into
+# windows that a process pool scans in parallel, off the event loop.
+PARALLEL_SCAN_THRESHOLD = int(os.getenv("PII_PARALLEL_THRESHOLD", "65536"))
+PARALLEL_SCAN_WINDOW = int(os.getenv("PII_PARALLEL_WINDOW", "65536"))
+PARALLEL_SCAN_WORKERS = int(os.getenv("PII_SCAN_WORKERS", str(os.cpu_count() or 1)))
+# The unbounded patterns (addresses, emails, credentials, money) are assumed
+# to match at most this many characters when sizing the window overlap.
+UNBOUNDED_MATCH_CAP = int(os.getenv("PII_UNBOUNDED_MATCH_CAP", "1024"))
+# Characters around a window that \b needs to see.
+_CONTEXT = 8
+
+# Request handlers stop scanning after this much time (0 disables the limit)
+# and report how much of the text was covered. The clock is checked before
+# each match and each replayed pass.
+SCAN_BUDGET = float(os.getenv("PII_SCAN_BUDGET_MS", "250")) / 1000
+# Inputs (and live-session edits) up to this many characters are scanned on
+# the event loop. Adversarial text scans at up to 40us a character, so these
+# stay well inside the budget; anything longer goes to the process pool.
+INLINE_SCAN_LIMIT = int(os.getenv("PII_INLINE_SCAN_LIMIT", "2048"))
+
+# Each window is scanned this far past its end, so any match that starts
+# inside the window is seen whole.
+WINDOW_OVERLAP = max(
+    min(_sre_parse.parse(p.pattern, p.flags).getwidth()[1], UNBOUNDED_MATCH_CAP)
+    for patterns in compiled_patterns.values() for p in patterns
+) + _CONTEXT
+
+scan_stats = {"scans": 0, "offloaded": 0, "parallel": 0, "truncated": 0}
+
+_pool = None
+
+
+class ScanResult(NamedTuple):
+    """
+    Spans found in ``text[:scanned]``, and the pieces they were masked in
+    (rescan_edit takes those). ``truncated`` is True when the time budget
+    ran out first; nothing is known about the rest of the text.
+    """
+    spans: List[PiiSpan]
+    scanned: int
+    truncated: bool
+    pieces: List[_Piece] = []
+
+    @classmethod
+    def of(cls, pieces: List[_Piece], scanned: int, length: int) -> "ScanResult":
+        return cls([span for piece in pieces for span in piece.spans], scanned, scanned < length, pieces)
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=PARALLEL_SCAN_WORKERS)
+    return _pool
+
+
+async def warm_pool():
+    """
+    Start the scan worker processes now instead of on the first large paste.
+    """
+    pool = _get_pool()
+    await asyncio.gather(*(
+        asyncio.wrap_future(pool.submit(scan_pii, "")) for _ in range(PARALLEL_SCAN_WORKERS)
+    ))
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+def _scan_inline(text: str, deadline: Optional[float]) -> tuple:
+    """
+    Pieces of the whole text, and how far the scan got before ``deadline``.
+    """
+    pieces = []
+    try:
+        for piece in _Scanner(text, 0, len(text), deadline).pieces():
+            pieces.append(piece)
+    except _Timeout:
+        return pieces, pieces[-1].hi if pieces else 0
+    return pieces, len(text)
+
+
+def _scan_window(chunk: str, pos: int, stop: int, deadline: Optional[float], first: bool = False) -> tuple:
+    # Runs in a worker process: the pieces of ``chunk`` scanned from ``pos``
+    # that end by ``stop``, and how far the scan got before ``deadline``.
+    # ``first`` stops at the first piece that masks anything.
+    pieces = []
+    try:
+        for piece in _Scanner(chunk, pos, len(chunk), deadline, first).pieces():
+            if piece.hi > stop:
+                break
+            pieces.append(piece)
+            if first and piece.spans:
+                break
+    except _Timeout:
+        return pieces, pieces[-1].hi if pieces else pos
+    return pieces, stop
+
+
+def _windows(text: str):
+    """
+    Yield (start, stop, chunk_start, chunk) for each window of the text.
+    """
+    length = len(text)
+    for start in range(0, length, PARALLEL_SCAN_WINDOW):
+        stop = min(start + PARALLEL_SCAN_WINDOW, length)
+        chunk_start = max(0, start - _CONTEXT)
+        yield start, stop, chunk_start, text[chunk_start:stop + WINDOW_OVERLAP]
+
+
+def _submit_windows(text: str, deadline: Optional[float], first: bool = False) -> list:
+    loop = asyncio.get_running_loop()
+    pool = _get_pool()
+    return [
+        (start, stop, chunk_start, loop.run_in_executor(
+            pool, _scan_window, chunk, start - chunk_start, stop - chunk_start, deadline, first
+        ))
+        for start, stop, chunk_start, chunk in _windows(text)
+    ]
+
+
+def _merge(text: str, windows: list, deadline: Optional[float]) -> tuple:
+    """
+    Stitch per-window pieces into what one scan of the whole text returns,
+    and how far that got before ``deadline``. A window is scanned without
+    the pieces before it, which can change its first pieces, so the scan is
+    carried on inline from the last settled piece until it yields one of
+    the window's own pieces; the window's later pieces follow as they are.
+    The inline scan looks 2 * WINDOW_OVERLAP past the window, and further
+    when a piece comes within WINDOW_OVERLAP of where it stopped looking.
+    """
+    merged, pos = [], 0
+    length = len(text)
+    try:
+        for start, stop, pieces in windows:
+            own = {piece: i for i, piece in enumerate(pieces)}
+            end = min(length, stop + 2 * WINDOW_OVERLAP)
+            while pos < stop:
+                found, landed, settled = [], None, True
+                for piece in _Scanner(text, pos, end, deadline).pieces():
+                    if end < length and piece.hi > end - WINDOW_OVERLAP:
+                        settled = False
+                        break
+                    if piece in own:
+                        landed = own[piece]
+                        break
+                    if piece.lo >= stop:
+                        break
+                    found.append(piece)
+                    if piece.hi >= stop:
+                        break
+                if not settled:
+                    end = min(length, 2 * end - pos)
+                    continue
+                merged += found
+                if landed is not None:
+                    merged += pieces[landed:]
+                    pos = merged[-1].hi
+                else:
+                    pos = max(stop, found[-1].hi if found else 0)
+    except _Timeout:
+        pass
+    return merged, pos
+
+
+def rescan_edit(
+    text: str, pieces: List[_Piece], start: int, old_end: int, new_end: int,
+    budget: Optional[float] = SCAN_BUDGET,
+) -> ScanResult:
+    """
+    Update ``pieces``, the complete scan of the text before an edit, after
+    the edit replaced old characters [start, old_end) with
+    ``text[start:new_end]``. Pieces that end well before the edit are kept.
+    The scan restarts after them and stops once it is far enough past the
+    edit that it cannot have seen it, at one of the old pieces, shifted, or
+    at a point outside every piece of both scans; the old pieces after that
+    are shifted too. Matches are assumed to be no longer than
+    WINDOW_OVERLAP, as for the windowed scan. Limited to ``budget`` seconds
+    like scan_pii_async: when it runs out, the result is truncated after
+    the last piece settled.
+    """
+    return _rescan(text, pieces, start, old_end, new_end, _deadline(budget))
+
+
+def _rescan(text: str, pieces: List[_Piece], start: int, old_end: int, new_end: int, deadline: Optional[float]) -> ScanResult:
+    shift = new_end - old_end
+    length = len(text)
+    # How far an edit can change a piece: a match's reach, and the margins
+    # that keep pieces apart.
+    reach = WINDOW_OVERLAP + 2 * _REPLAY_MARGIN
+    kept = bisect.bisect_right(pieces, start - reach, key=lambda piece: piece.hi)
+    result = pieces[:kept]
+    pos = result[-1].hi if result else 0
+    # Text without PII before the edit need not be scanned again either.
+    if start - reach > pos and (kept == len(pieces) or pieces[kept].lo >= start - reach):
+        pos = start - reach
+    stop = min(length, new_end + reach)
+    # As in _merge: pieces within WINDOW_OVERLAP of where the scan stopped
+    # looking may change with the text after it, so it looks further.
+    end = min(length, stop + WINDOW_OVERLAP)
+    found = []
+    try:
+        while True:
+            found, landed, settled = [], None, True
+            for piece in _Scanner(text, pos, end, deadline).pieces():
+                if end < length and piece.hi > end - WINDOW_OVERLAP:
+                    settled = False
+                    break
+                if piece.lo >= stop:
+                    i = bisect.bisect_left(pieces, piece.lo - shift, key=lambda old: old.lo)
+                    if i < len(pieces) and _shifted(pieces[i], shift) == piece:
+                        landed = i
+                        break
+                found.append(piece)
+            if landed is None and settled:
+                if end == length:
+                    return ScanResult.of(result + found, length, length)
+                # Nothing masked between here and end - WINDOW_OVERLAP; done
+                # if no old piece covers that point or lies after it there.
+                frontier = max(stop, found[-1].hi if found else pos)
+                landed = bisect.bisect_left(pieces, frontier - shift, key=lambda old: old.lo)
+                if (landed and pieces[landed - 1].hi > frontier - shift) or (
+                    landed < len(pieces) and pieces[landed].lo + shift < end - WINDOW_OVERLAP
+                ):
+                    landed = None
+            if landed is not None:
+                tail = pieces[landed:] if shift == 0 else [_shifted(piece, shift) for piece in pieces[landed:]]
+                return ScanResult.of(result + found + tail, length, length)
+            end = min(length, 2 * end - pos)
+    except _Timeout:
+        scan_stats["truncated"] += 1
+        result += found
+        return ScanResult.of(result, result[-1].hi if result else 0, length)
+
+
+async def rescan_edit_async(
+    text: str, pieces: List[_Piece], start: int, old_end: int, new_end: int,
+    budget: Optional[float] = SCAN_BUDGET,
+) -> ScanResult:
+    """
+    rescan_edit for request handlers: texts up to INLINE_SCAN_LIMIT are
+    rescanned inline, longer ones in a pool worker, as by scan_pii_async.
+    """
+    with stage("pii_scan"):
+        deadline = _deadline(budget)
+        if len(text) <= INLINE_SCAN_LIMIT:
+            return _rescan(text, pieces, start, old_end, new_end, deadline)
+        scan_stats["offloaded"] += 1
+        return await asyncio.get_running_loop().run_in_executor(
+            _get_pool(), _rescan, text, pieces, start, old_end, new_end, deadline
+        )
+
+
+def _deadline(budget: Optional[float]) -> Optional[float]:
+    return time.time() + budget if budget else None
+
+
+async def scan_pii_async(text: str, budget: Optional[float] = SCAN_BUDGET) -> ScanResult:
+    """
+    scan_pii for request handlers, limited to ``budget`` seconds. Inputs up
+    to INLINE_SCAN_LIMIT are scanned inline, ones below
+    PARALLEL_SCAN_THRESHOLD in one pool worker, and longer ones in
+    overlapping windows across the pool. Within the covered prefix the
+    spans are the same either way.
+    """
+    with stage("pii_scan"):
+        return await _scan(text, budget)
+
+
+async def _scan(text: str, budget: Optional[float]) -> ScanResult:
+    scan_stats["scans"] += 1
+    deadline = _deadline(budget)
+    if len(text) <= INLINE_SCAN_LIMIT:
+        pieces, scanned = _scan_inline(text, deadline)
+    elif len(text) < PARALLEL_SCAN_THRESHOLD:
+        scan_stats["offloaded"] += 1
+        pieces, scanned = await asyncio.get_running_loop().run_in_executor(_get_pool(), _scan_inline, text, deadline)
+    else:
+        scan_stats["parallel"] += 1
+        submitted = _submit_windows(text, deadline)
+        results = await asyncio.gather(*(future for _, _, _, future in submitted))
+        windows = []
+        for (start, stop, chunk_start, _), (window_pieces, window_scanned) in zip(submitted, results):
+            window_scanned += chunk_start
+            windows.append((start, min(window_scanned, stop), [_shifted(piece, chunk_start) for piece in window_pieces]))
+            if window_scanned < stop:
+                # Later windows may be complete, but only a gapless prefix is reported.
+                break
+        pieces, scanned = await asyncio.get_running_loop().run_in_executor(None, _merge, text, windows, deadline)
+    result = ScanResult.of(pieces, scanned, len(text))
+    if result.truncated:
+        scan_stats["truncated"] += 1
     return result
+
+
+async def _window_found(start: int, stop: int, chunk_start: int, future) -> tuple:
+    pieces, scanned = await future
+    return any(piece.spans for piece in pieces), scanned + chunk_start >= stop
+
+
+async def contains_pii_async(text: str, budget: Optional[float] = SCAN_BUDGET) -> Optional[bool]:
+    """
+    contains_pii for request handlers; returns as soon as any window has a
+    match, or None if the budget ran out before any PII was found.
+    """
+    with stage("pii_scan"):
+        return await _contains(text, budget)
+
+
+async def _contains(text: str, budget: Optional[float]) -> Optional[bool]:
+    scan_stats["scans"] += 1
+    deadline = _deadline(budget)
+    if len(text) < PARALLEL_SCAN_THRESHOLD:
+        if len(text) <= INLINE_SCAN_LIMIT:
+            pieces, scanned = _scan_window(text, 0, len(text), deadline, first=True)
+        else:
+            scan_stats["offloaded"] += 1
+            pieces, scanned = await asyncio.get_running_loop().run_in_executor(
+                _get_pool(), _scan_window, text, 0, len(text), deadline, True
+            )
+        if any(piece.spans for piece in pieces):
+            return True
+        complete = scanned >= len(text)
+    else:
+        scan_stats["parallel"] += 1
+        submitted = _submit_windows(text, deadline, first=True)
+        futures = [future for _, _, _, future in submitted]
+        complete = True
+        try:
+            for result in asyncio.as_completed([_window_found(*window) for window in submitted]):
+                found, window_complete = await result
+                if found:
+                    return True
+                complete = complete and window_complete
+        finally:
+            for future in futures:
+                future.cancel()
+    if not complete:
+        scan_stats["truncated"] += 1
+        return None
+    return False
+
+
+def pii_scan_stats() -> dict:
+    return {**scan_stats, "engine": ACTIVE_ENGINE, "budget_ms": SCAN_BUDGET * 1000}
@@ -0,0 +1,206 @@
+# live_session.py
+"""
+/ws/session: the extension sends textbox edits as deltas instead of the whole
+text on every pause. The server keeps the text, rescans only the edited region
+for PII and pushes spans and quality scores back.
+
+Client -> server, one JSON object per message:
+    {"type": "reset", "text": ..., "generation": n}
+    {"type": "delta", "start": s, "end": e, "text": inserted, "length": l, "generation": n}
+  A delta replaces [start, end) of the current text; ``length`` is the length
+  of the text after the edit and catches lost or reordered messages. Both
+  accept "score" (default true), "speculate" and "summary_session_id" as in
+  /analyze.
+Server -> client:
+    {"generation": n, "pii": ..., "spans": [...], "truncated": ...}
+    {"generation": n, "score": {...}}   once the score is ready
+    {"generation": n, "resync": true}   the edit did not apply; send a reset
+Offsets count UTF-16 code units when the socket is opened with ?offsets=utf16.
+"""
+import asyncio
+import json
+import uuid
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+import speculation
+from detect_pii import INLINE_SCAN_LIMIT, rescan_edit_async, scan_pii_async, spans_as_dicts, to_utf16_offsets
+from prompt_score import rate_prompt_quality
+from resilience import REQUEST_DEADLINE, deadline
+
+stats = {
+    "sessions": 0,
+    "active": 0,
+    "resets": 0,
+    "deltas": 0,
+    "resyncs": 0,
+    "incremental_scans": 0,
+    "full_scans": 0,
+    "superseded_scores": 0,
+    # Characters uploaded vs. what full-text requests would have uploaded.
+    "chars_received": 0,
+    "chars_analyzed": 0,
+}
+
+
+def _utf16_length(text: str) -> int:
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _codepoint_offset(text: str, units: int) -> int:
+    # Raises ValueError when the offset is out of range or splits a surrogate pair.
+    if text.isascii():
+        if not 0 <= units <= len(text):
+            raise ValueError("offset out of range")
+        return units
+    encoded = text.encode("utf-16-le")
+    if not 0 <= units * 2 <= len(encoded):
+        raise ValueError("offset out of range")
+    return len(encoded[:units * 2].decode("utf-16-le"))
+
+
+class LiveSession:
+    """
+    The text of one connection and its PII spans, with the pieces of text
+    they were masked in (see detect_pii.rescan_edit). ``complete`` is False
+    when the last scan, full or incremental, ran out of time: the client is
+    told the spans are truncated, and the next edit rescans everything.
+    """
+
+    def __init__(self, utf16: bool = False):
+        self.utf16 = utf16
+        self.text = ""
+        self.spans = []
+        self.pieces = []
+        self.scanned = 0
+        self.complete = True
+
+    async def reset(self, text: str):
+        self.text = text
+        await self._full_scan()
+
+    async def apply(self, start: int, end: int, inserted: str, length: int) -> bool:
+        """
+        Apply one delta and update the spans. Returns False, leaving the text
+        unchanged, when the delta does not fit the text the server holds.
+        """
+        text = self.text
+        try:
+            if self.utf16:
+                start, end = _codepoint_offset(text, start), _codepoint_offset(text, end)
+        except ValueError:
+            return False
+        if not 0 <= start <= end <= len(text):
+            return False
+        new_text = text[:start] + inserted + text[end:]
+        if (_utf16_length(new_text) if self.utf16 else len(new_text)) != length:
+            return False
+        self.text = new_text
+        if self.complete and len(inserted) <= INLINE_SCAN_LIMIT:
+            stats["incremental_scans"] += 1
+            self._update(await rescan_edit_async(new_text, self.pieces, start, end, start + len(inserted)))
+        else:
+            await self._full_scan()
+        return True
+
+    async def _full_scan(self):
+        stats["full_scans"] += 1
+        self._update(await scan_pii_async(self.text))
+
+    def _update(self, scan):
+        self.spans, self.pieces = scan.spans, scan.pieces
+        self.scanned, self.complete = scan.scanned, not scan.truncated
+
+    def pii_message(self) -> dict:
+        spans = to_utf16_offsets(self.text, self.spans) if self.utf16 else self.spans
+        return {"pii": bool(spans), "spans": spans_as_dicts(spans), "truncated": not self.complete}
+
+    def prompt(self) -> str:
+        # Text the PII scan did not reach is never sent to a provider.
+        return self.text[:self.scanned]
+
+
+async def serve_session(websocket: WebSocket, offsets: str = "codepoint", session_id: str = None):
+    """
+    Run one accepted /ws/session connection until the client goes away.
+    """
+    session = LiveSession(offsets == "utf16")
+    session_id = session_id or uuid.uuid4().hex
+    send_lock = asyncio.Lock()
+    scoring = None
+
+    async def send(payload: dict):
+        async with send_lock:
+            await websocket.send_text(json.dumps(payload))
+
+    async def score(prompt: str, spans: list, generation, kind, summary_session_id):
+        try:
+            with deadline(REQUEST_DEADLINE):
+                result = await rate_prompt_quality(prompt, spans, session_id)
+            if kind:
+                speculation.on_score(kind, prompt, result, session_id, summary_session_id)
+            await send({"generation": generation, "score": result})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Live session scoring failed: {e}")
+
+    stats["sessions"] += 1
+    stats["active"] += 1
+    try:
+        while True:
+            try:
+                message = json.loads(await websocket.receive_text())
+                generation = message.get("generation")
+                kind = message.get("type")
+            except (ValueError, AttributeError):
+                continue
+            if scoring is not None and not scoring.done():
+                # Scores for text that has since been edited are never shown.
+                scoring.cancel()
+                stats["superseded_scores"] += 1
+            scoring = None
+
+            if kind == "reset":
+                text = message.get("text")
+                if not isinstance(text, str):
+                    continue
+                stats["resets"] += 1
+                stats["chars_received"] += len(text)
+                await session.reset(text)
+            elif kind == "delta":
+                stats["deltas"] += 1
+                try:
+                    inserted = message["text"]
+                    applied = isinstance(inserted, str) and await session.apply(
+                        int(message["start"]), int(message["end"]), inserted, int(message["length"])
+                    )
+                except (KeyError, TypeError, ValueError):
+                    applied = False
+                if not applied:
+                    stats["resyncs"] += 1
+                    await send({"generation": generation, "resync": True})
+                    continue
+                stats["chars_received"] += len(inserted)
+            else:
+                continue
+
+            stats["chars_analyzed"] += len(session.text)
+            await send({"generation": generation, **session.pii_message()})
+            if message.get("score", True) and session.text.strip():
+                scoring = asyncio.ensure_future(
+                    score(
+                        session.prompt(), session.spans, generation,
+                        message.get("speculate"), message.get("summary_session_id"),
+                    )
+                )
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if scoring is not None:
+            scoring.cancel()
+        stats["active"] -= 1
+
+
+def live_session_stats() -> dict:
+    return dict(stats)
@@ -0,0 +1,133 @@
+# local_classifier.py
+"""
+Keyword heuristic that suggests an LLM without calling one.
+
+The weights below are hand-picked, not fitted to labelled prompts, so the
+score it reports is a measure of how much one label's keywords dominate the
+others, not a calibrated probability. It only answers when one label clearly
+dominates; anything less clear-cut goes to the LLM classifier.
+"""
+import math
+import os
+import re
+from typing import Dict, List
+
+LABELS = ["ChatGPT", "Claude", "Gemini", "DeepSeek", "Perplexity", "Grok", "Meta AI"]
+
+# What each label is good at; used to phrase the reason string.
+STRENGTHS = {
+    "ChatGPT": "coding, logic and structured explanations",
+    "Claude": "creative writing and matching tone",
+    "Gemini": "multi-step reasoning and multimodal analysis",
+    "DeepSeek": "math-heavy and algorithmic problems",
+    "Perplexity": "research that benefits from up-to-date sources",
+    "Grok": "social and trending topics and document processing",
+    "Meta AI": "image prompts and general Q&A",
+}
+
+# Hand-picked keyword weights: feature (a 1-3 word phrase) -> {label: weight}.
+WEIGHTS = {
+    "ChatGPT": {
+        "code": 1.5, "python": 2.0, "javascript": 2.0, "typescript": 2.0, "java": 1.5, "c++": 2.0, "rust": 1.5,
+        "sql": 1.5, "debug": 2.0, "bug": 1.5, "error": 1.2, "exception": 1.5, "stack trace": 2.0, "function": 1.2,
+        "class": 0.8, "api": 1.0, "regex": 1.5, "refactor": 2.0, "unit test": 1.5, "compile": 1.5, "script": 1.2,
+        "explain": 0.6, "step by step": 1.0, "logic": 1.0, "react": 1.2, "docker": 1.2, "git": 1.2,
+    },
+    "Claude": {
+        "story": 2.0, "poem": 2.0, "essay": 1.5, "creative": 1.5, "tone": 1.5, "rewrite": 1.5, "rephrase": 1.5,
+        "email": 1.2, "letter": 1.2, "cover letter": 1.5, "blog": 1.2, "narrative": 1.5, "character": 1.2,
+        "novel": 1.5, "draft": 1.2, "polish": 1.2, "voice": 1.0, "empathetic": 2.0, "feel": 0.8, "feelings": 1.2,
+        "lyrics": 1.5, "speech": 1.2, "proofread": 1.5, "write": 0.5,
+    },
+    "Gemini": {
+        "analyze": 1.2, "analysis": 1.2, "compare": 0.8, "plan": 1.0, "strategy": 1.2, "multi-step": 2.0,
+        "trade-offs": 1.5, "tradeoffs": 1.5, "evaluate": 1.0, "image": 0.8, "video": 1.5, "diagram": 1.5,
+        "chart": 1.2, "spreadsheet": 1.5, "data": 0.8, "dataset": 1.2, "complex": 1.0, "multimodal": 2.0,
+        "architecture": 1.0, "roadmap": 1.2, "google": 1.0, "youtube": 1.5,
+    },
+    "DeepSeek": {
+        "math": 2.0, "equation": 2.0, "prove": 2.0, "proof": 2.0, "theorem": 2.0, "integral": 2.0,
+        "derivative": 2.0, "calculus": 2.0, "algebra": 2.0, "probability": 1.5, "matrix": 1.5, "algorithm": 1.5,
+        "complexity": 1.2, "big o": 2.0, "leetcode": 2.0, "dynamic programming": 2.0, "recursion": 1.2,
+        "optimize": 0.8, "calculate": 1.2, "solve": 1.0, "geometry": 1.5, "statistics": 0.6,
+    },
+    "Perplexity": {
+        "latest": 1.5, "news": 2.0, "research": 1.5, "sources": 2.0, "source": 1.2, "cite": 2.0,
+        "citations": 2.0, "references": 1.5, "current": 1.0, "today": 1.2, "recent": 1.2, "2024": 1.0,
+        "2025": 1.2, "2026": 1.2, "statistics": 1.0, "study": 1.0, "studies": 1.5, "search": 1.2, "find": 0.8,
+        "prices": 1.2, "market": 1.0, "who won": 2.0, "what happened": 1.5, "look up": 1.5,
+    },
+    "Grok": {
+        "twitter": 2.0, "tweet": 2.0, "x.com": 2.0, "trending": 2.0, "viral": 1.5, "meme": 2.0, "memes": 2.0,
+        "social": 1.0, "reddit": 1.5, "roast": 2.0, "funny": 1.2, "joke": 1.2, "sarcastic": 1.5,
+        "pdf": 1.2, "document": 1.0, "documents": 1.2, "elon": 1.5, "hot take": 2.0, "opinion": 1.0,
+    },
+    "Meta AI": {
+        "generate an image": 2.5, "an image": 1.0, "picture": 1.5, "photo": 1.5, "draw": 1.5, "illustration": 1.5,
+        "logo": 1.2, "instagram": 2.0, "whatsapp": 2.0, "facebook": 2.0, "caption": 1.5, "quick question": 1.5,
+        "trivia": 1.5, "fun fact": 1.5, "recipe": 1.2, "imagine": 1.2, "sticker": 2.0, "avatar": 1.5,
+    },
+}
+
+# Older prompts count less: the i-th most recent prompt is weighted RECENCY_DECAY ** i.
+RECENCY_DECAY = float(os.getenv("LOCAL_CLASSIFIER_DECAY", "0.7"))
+# Below this share of the softmax over keyword scores for the top label, the
+# LLM is asked instead. A tuning knob for how dominant the top label must be.
+MIN_SHARE = float(os.getenv("LOCAL_CLASSIFIER_MIN_SHARE", "0.6"))
+# Sharpness of the softmax over label scores.
+TEMPERATURE = 0.5
+
+_TOKEN = re.compile(r"[a-z0-9][a-z0-9+#.\-]*")
+_LABEL_INDEX = {label: i for i, label in enumerate(LABELS)}
+
+# Inverted index: feature -> list of (label index, weight).
+_FEATURES = {}
+for _label, _weights in WEIGHTS.items():
+    for _feature, _weight in _weights.items():
+        _FEATURES.setdefault(_feature, []).append((_LABEL_INDEX[_label], _weight))
+del _label, _weights, _feature, _weight
+
+
+def extract_features(prompt: str) -> set:
+    """
+    Unigrams, bigrams and trigrams of the prompt that have keyword weights.
+    """
+    tokens = [t.rstrip(".") for t in _TOKEN.findall(prompt.lower())]
+    grams = set(tokens)
+    grams.update(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+    grams.update(f"{a} {b} {c}" for a, b, c in zip(tokens, tokens[1:], tokens[2:]))
+    return grams & _FEATURES.keys()
+
+
+def classify_locally(prompts: List[str]) -> Dict:
+    """
+    Score all prompts against every label in one pass and return the best
+    label, its softmax share of the keyword scores and a reason built from
+    the top features.
+    ``prompts`` is most recent first, as sent by the extension.
+    """
+    scores = [0.0] * len(LABELS)
+    contributions = [{} for _ in LABELS]
+    for i, prompt in enumerate(prompts):
+        recency = RECENCY_DECAY ** i
+        for feature in extract_features(prompt):
+            for label_index, weight in _FEATURES[feature]:
+                value = weight * recency
+                scores[label_index] += value
+                contributions[label_index][feature] = contributions[label_index].get(feature, 0.0) + value
+
+    best = max(range(len(LABELS)), key=scores.__getitem__)
+    if scores[best] == 0.0:
+        return {"suggested_llm": "Unknown", "reason": "No strong signal in recent prompts.", "share": 0.0}
+
+    top = max(scores)
+    exps = [math.exp((s - top) / TEMPERATURE) for s in scores]
+    share = exps[best] / sum(exps)
+
+    label = LABELS[best]
+    top_features = sorted(contributions[best], key=contributions[best].get, reverse=True)[:3]
+    reason = (
+        f"Recent prompts mention {', '.join(repr(f) for f in top_features)}, "
+        f"which fits {label}'s strength in {STRENGTHS[label]}."
+    )
+    return {"suggested_llm": label, "reason": reason, "share": round(share, 3)}
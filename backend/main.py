@@ -1,16 +1,59 @@
-from fastapi import FastAPI
-from prompt_templates_short import suggest_prompt_templates
-from prompt_score import rate_prompt_quality
-from prompt_classifier import classify_llm_for_prompts  
-from prompt_template_desc import enhance_prompt_with_groq
-from summary_gen import generate_summary
-from detect_pii import contains_pii
-from pydantic import BaseModel
-from typing import List
+import asyncio
+from contextlib import asynccontextmanager
+import json
+import os
+from fastapi import FastAPI, Request, WebSocket
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from prompt_templates_short import DEFAULT_NUM_TEMPLATES, MAX_TEMPLATES, rank_templates, suggest_prompt_templates
+from prompt_score import BATCH_MAX_REQUEST_PROMPTS, batch_scoring_stats, local_scorer_stats, rate_prompt_quality, rate_prompt_quality_batch
+from near_duplicate import near_duplicate_stats
+from prompt_classifier import classifier_stats, classify_llm_for_prompts
+from prompt_template_desc import enhance_prompt_with_groq, stream_enhanced_prompt
+from summary_gen import generate_summary, update_session_summary
+from detect_pii import contains_pii_async, pii_scan_stats, scan_pii_async, shutdown_pool, spans_as_dicts, to_utf16_offsets, warm_pool
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
 from fastapi.middleware.cors import CORSMiddleware
+import providers
+from cache import cache_stats
+from cancellation import ClientDisconnected, Superseded, cancellation_stats, run_cancellable
+import metrics
+from resilience import DeadlineMiddleware, resilience_stats
+from routing import routing_stats
+from scheduler import background, scheduler_stats
+from singleflight import flight_stats
+import speculation
+from live_session import live_session_stats, serve_session
 
-app = FastAPI()
 
+# Also start the PII scan workers at startup (PII_POOL_WARMUP=1).
+WARM_PII_POOL = os.getenv("PII_POOL_WARMUP", "0") == "1"
+
+
+async def warm_up():
+    """
+    Background warm-up after startup; requests are served meanwhile.
+    """
+    if WARM_PII_POOL:
+        try:
+            await warm_pool()
+        except Exception as e:
+            print(f"PII pool warm-up failed: {e}")
+    await providers.warm_up()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    warming = asyncio.ensure_future(warm_up())
+    yield
+    warming.cancel()
+    await providers.aclose()
+    shutdown_pool()
+
+app = FastAPI(lifespan=lifespan)
+
+app.add_middleware(DeadlineMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -22,38 +65,148 @@ app.add_middleware(
 class PromptRequest(BaseModel):
     prompt: str
 
+class TemplatesRequest(PromptRequest):
+    num_templates: int = Field(DEFAULT_NUM_TEMPLATES, ge=1, le=MAX_TEMPLATES)
+    rank: bool = False  # order by the local scorer, best first
+
+class ScoreRequest(PromptRequest):
+    # Optional: a newer generation from the same session cancels older scoring work.
+    session_id: Optional[str] = None
+    generation: Optional[int] = None
+    # Opt-in: pre-generate this kind of template when the prompt scores low or medium.
+    speculate: Optional[Literal["short", "descriptive"]] = None
+    # The chat whose summary descriptive templates will be requested with.
+    summary_session_id: Optional[str] = None
+
 class PromptListRequest(BaseModel):  
     prompts: List[str]
 
+class ScoreBatchRequest(BaseModel):
+    prompts: List[str] = Field(..., max_length=BATCH_MAX_REQUEST_PROMPTS)
+
 class PiiRequest(BaseModel):           
     text: str
+    spans: bool = False  # also return [{category, start, end}] for each match
+    offsets: Literal["codepoint", "utf16"] = "codepoint"
+
+class AnalyzeRequest(ScoreRequest):
+    score: bool = True
+    offsets: Literal["codepoint", "utf16"] = "codepoint"
 
 class SummaryRequest(BaseModel):
-    prompts: List[str]
+    prompts: List[str] = []
+    # Incremental mode: send only the newest prompt and the session it belongs to.
+    prompt: Optional[str] = None
+    session_id: Optional[str] = None
 
 class TemplateRequest(BaseModel):
     prompt: str
     summary: str = ""  
+    session_id: Optional[str] = None
 
 @app.post("/suggest-templates")
-async def suggest_templates(request: PromptRequest):
-    suggestions = suggest_prompt_templates(request.prompt)
+async def suggest_templates(request: TemplatesRequest):
+    suggestions = None
+    if request.num_templates == speculation.SHORT_NUM_TEMPLATES:
+        suggestions = await speculation.claim("short", request.prompt)
+    if suggestions is None:
+        suggestions = await suggest_prompt_templates(request.prompt, request.num_templates, request.rank)
+    elif request.rank:
+        suggestions = rank_templates(suggestions)
     return {"templates": suggestions}
 
 @app.post("/prompt-score")
-async def get_prompt_score(request: PromptRequest):
-    score = rate_prompt_quality(request.prompt)
-    return {"score": score}
+async def get_prompt_score(request: ScoreRequest, http_request: Request):
+    scan = await scan_pii_async(request.prompt)
+    # Text the PII scan did not reach is never sent to a provider.
+    prompt = request.prompt[:scan.scanned]
+    try:
+        score = await run_cancellable(
+            http_request, rate_prompt_quality(prompt, scan.spans, request.session_id),
+            request.session_id, request.generation,
+        )
+    except Superseded:
+        return JSONResponse({"superseded": True}, status_code=409)
+    except ClientDisconnected:
+        return Response(status_code=499)
+    if request.speculate:
+        speculation.on_score(request.speculate, prompt, score, request.session_id, request.summary_session_id)
+    return {"score": score, "truncated": scan.truncated}
+
+@app.get("/prompt-score/stats")
+async def get_prompt_score_stats():
+    return {**local_scorer_stats(), "near_duplicate": near_duplicate_stats(), "batch": batch_scoring_stats()}
+
+# Bulk grading: many prompts packed into a few provider requests.
+@app.post("/prompt-score/batch")
+async def get_prompt_scores(request: ScoreBatchRequest):
+    return {"scores": await rate_prompt_quality_batch(request.prompts)}
 
 @app.post("/prompt_classifier") 
 async def suggest_llm_model(request: PromptListRequest):
-    result = classify_llm_for_prompts(request.prompts)
+    # Nobody waits on the suggestion, so it yields provider capacity to keystroke work.
+    with background():
+        result = await classify_llm_for_prompts(request.prompts)
     return result
 
+@app.get("/prompt_classifier/stats")
+async def get_classifier_stats():
+    return classifier_stats()
+
 @app.post("/detect-pii")              
 async def detect_pii_route(request: PiiRequest):
-    found = contains_pii(request.text)
-    return {"pii": found}
+    # "truncated" means the scan ran out of time before reaching the end of the text.
+    if not request.spans:
+        found = await contains_pii_async(request.text)
+        return {"pii": bool(found), "truncated": found is None}
+    scan = await scan_pii_async(request.text)
+    spans = scan.spans
+    if request.offsets == "utf16":
+        spans = to_utf16_offsets(request.text, spans)
+    return {"pii": bool(spans), "spans": spans_as_dicts(spans), "truncated": scan.truncated}
+
+@app.get("/detect-pii/stats")
+async def get_detect_pii_stats():
+    return pii_scan_stats()
+
+# Per-keystroke check. Streams NDJSON: the PII result first, then the quality
+# score once the provider answers. Both reuse the same PII scan.
+@app.post("/analyze")
+async def analyze(request: AnalyzeRequest, http_request: Request):
+    scan = await scan_pii_async(request.prompt)
+    prompt = request.prompt[:scan.scanned]
+    spans = scan.spans
+
+    async def lines():
+        reported = to_utf16_offsets(request.prompt, spans) if request.offsets == "utf16" else spans
+        yield json.dumps({"pii": bool(spans), "spans": spans_as_dicts(reported), "truncated": scan.truncated}) + "\n"
+        if request.score:
+            try:
+                score = await run_cancellable(
+                    http_request, rate_prompt_quality(prompt, spans, request.session_id),
+                    request.session_id, request.generation,
+                )
+            except Superseded:
+                yield json.dumps({"superseded": True}) + "\n"
+                return
+            except ClientDisconnected:
+                return
+            if request.speculate:
+                speculation.on_score(request.speculate, prompt, score, request.session_id, request.summary_session_id)
+            yield json.dumps({"score": score}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+# Same results as /analyze, but the client sends edits as deltas over one
+# connection and the server rescans only the edited region.
+@app.websocket("/ws/session")
+async def ws_session(websocket: WebSocket, offsets: Literal["codepoint", "utf16"] = "codepoint", session_id: Optional[str] = None):
+    await websocket.accept()
+    await serve_session(websocket, offsets, session_id)
+
+@app.get("/ws/session/stats")
+async def get_ws_session_stats():
+    return live_session_stats()
 
 # @app.post("/suggest-templates-descriptive")
 # async def suggest_templates(request: PromptRequest):
@@ -63,10 +216,76 @@ async def detect_pii_route(request: PiiRequest):
 
 @app.post("/suggest-templates-descriptive")
 async def suggest_templates_descriptive(request: TemplateRequest):
-    suggestions = enhance_prompt_with_groq(request.prompt, summary=request.summary)
+    suggestions = await speculation.claim("descriptive", request.prompt, request.session_id, request.summary)
+    if suggestions is None:
+        suggestions = await enhance_prompt_with_groq(request.prompt, summary=request.summary, session_id=request.session_id)
     return {"templates": suggestions}
 
+# Same as above, streamed as NDJSON: {"delta"} chunks as the provider emits
+# them, {"reset"} if it broke off and the fallback starts over, then
+# {"templates"} with the full text (or {"error"}).
+@app.post("/suggest-templates-descriptive/stream")
+async def suggest_templates_descriptive_stream(request: TemplateRequest):
+    async def lines():
+        speculated = await speculation.claim("descriptive", request.prompt, request.session_id, request.summary)
+        if speculated is not None:
+            yield json.dumps({"delta": speculated}) + "\n"
+            yield json.dumps({"templates": speculated}) + "\n"
+            return
+        async for event in stream_enhanced_prompt(request.prompt, summary=request.summary, session_id=request.session_id):
+            yield json.dumps(event) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
 @app.post("/summary-gen")
 async def summary_gen(request: SummaryRequest):
-    summary = generate_summary(request.prompts)
+    with background():
+        if request.session_id and request.prompt:
+            summary = await update_session_summary(request.session_id, request.prompt)
+        else:
+            summary = await generate_summary(request.prompts)
     return {"summary": summary}
+
+@app.get("/scheduler/stats")
+async def get_scheduler_stats():
+    return scheduler_stats()
+
+@app.get("/speculation/stats")
+async def get_speculation_stats():
+    return speculation.speculation_stats()
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    return cache_stats()
+
+@app.get("/resilience/stats")
+async def get_resilience_stats():
+    return {**resilience_stats(), "routing": routing_stats()}
+
+def all_stats() -> dict:
+    return {
+        "cache": cache_stats(),
+        "flight": flight_stats(),
+        **resilience_stats(),
+        "routing": routing_stats(),
+        "local_scorer": local_scorer_stats(),
+        "near_duplicate": near_duplicate_stats(),
+        "score_batch": batch_scoring_stats(),
+        "classifier": classifier_stats(),
+        "cancellation": cancellation_stats(),
+        "scheduler": scheduler_stats(),
+        "speculation": speculation.speculation_stats(),
+        "detect_pii": pii_scan_stats(),
+        "live_session": live_session_stats(),
+    }
+
+# Each subsystem serves its counters on /<name>/stats; /stats has them all.
+@app.get("/stats")
+async def get_all_stats():
+    return all_stats()
+
+# Prometheus scrape target: request, stage and provider latency histograms,
+# retry/fallback/score counters, and every stats endpoint above as gauges.
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.render(all_stats()), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,243 @@
+# metrics.py
+import contextvars
+import json
+import os
+import re
+import time
+from contextlib import contextmanager
+
+NAMESPACE = "promptbuddy"
+
+# Latency buckets in seconds, from a regex scan up to a provider timeout.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0)
+
+# Requests slower than this are logged with their stage breakdown.
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_MS", "2000")) / 1000
+
+_metrics = {}
+_trace = contextvars.ContextVar("trace", default=None)
+
+
+class Counter:
+    """
+    A monotonically increasing count per label combination.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[label]) for label in self.labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name, dict(zip(self.labels, key)), value
+
+
+class Histogram:
+    """
+    Cumulative bucket counts, sum and count of observations per label combination.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[label]) for label in self.labels)
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+        counts = entry[0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def samples(self):
+        for key, (counts, total, count) in self.values.items():
+            labels = dict(zip(self.labels, key))
+            for bound, bucket_count in zip(self.buckets, counts):
+                yield f"{self.name}_bucket", {**labels, "le": repr(bound)}, bucket_count
+            yield f"{self.name}_bucket", {**labels, "le": "+Inf"}, count
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+def _register(metric):
+    _metrics[metric.name] = metric
+    return metric
+
+
+def counter(name: str, help: str, labels: tuple = ()) -> Counter:
+    return _register(Counter(f"{NAMESPACE}_{name}", help, labels))
+
+
+def histogram(name: str, help: str, labels: tuple = ()) -> Histogram:
+    return _register(Histogram(f"{NAMESPACE}_{name}", help, labels))
+
+
+REQUEST_SECONDS = histogram(
+    "http_request_duration_seconds", "Time to serve an HTTP request, including streamed bodies.",
+    ("endpoint", "method", "status"),
+)
+STAGE_SECONDS = histogram("stage_duration_seconds", "Time spent in one stage of a request.", ("stage",))
+PROVIDER_SECONDS = histogram(
+    "provider_attempt_duration_seconds", "Duration of one provider call attempt.",
+    ("provider", "model", "outcome"),
+)
+PROVIDER_RETRIES = counter("provider_retries_total", "Provider attempts that failed and were retried.", ("provider", "model"))
+FALLBACKS = counter("fallbacks_total", "Calls that started their fallback, after a failure or as a hedge.", ("call", "reason"))
+SCORES = counter("prompt_scores_total", "Prompt quality verdicts, including unknown.", ("score", "source"))
+SLOW_REQUESTS = counter("slow_requests_total", "Requests slower than SLOW_REQUEST_MS.", ("endpoint",))
+
+
+class Trace:
+    """
+    Stage timings of one request, shared by every task the request starts.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = []
+
+    def add(self, name: str, started: float, seconds: float, **extra):
+        self.stages.append({
+            "stage": name,
+            "at_ms": round((started - self.started) * 1000, 1),
+            "ms": round(seconds * 1000, 1),
+            **extra,
+        })
+
+
+def record_stage(name: str, started: float, seconds: float, **extra):
+    """
+    Record a stage that began at ``started`` (time.perf_counter) and took ``seconds``.
+    """
+    STAGE_SECONDS.observe(seconds, stage=name)
+    trace = _trace.get()
+    if trace is not None:
+        trace.add(name, started, seconds, **extra)
+
+
+@contextmanager
+def stage(name: str, **extra):
+    """
+    Time the block as stage ``name`` of the current request.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, started, time.perf_counter() - started, **extra)
+
+
+async def timed(name: str, fn):
+    """
+    Await ``fn()`` as stage ``name``.
+    """
+    with stage(name):
+        return await fn()
+
+
+def observe_attempt(provider: str, model: str, started: float, outcome: str, attempt: int):
+    seconds = time.perf_counter() - started
+    PROVIDER_SECONDS.observe(seconds, provider=provider, model=model, outcome=outcome)
+    record_stage(f"provider:{provider}", started, seconds, model=model, attempt=attempt, outcome=outcome)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that times every HTTP request per endpoint, collects its
+    stage timings and logs the breakdown of slow requests.
+    """
+
+    def __init__(self, app, slow_seconds: float = SLOW_REQUEST_SECONDS):
+        self.app = app
+        self.slow_seconds = slow_seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        trace = Trace()
+        token = _trace.set(trace)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _trace.reset(token)
+            seconds = time.perf_counter() - trace.started
+            # The route template, so unknown paths cannot grow the label set.
+            route = scope.get("route")
+            endpoint = getattr(route, "path", "unmatched")
+            REQUEST_SECONDS.observe(seconds, endpoint=endpoint, method=scope["method"], status=status)
+            if seconds >= self.slow_seconds:
+                SLOW_REQUESTS.inc(endpoint=endpoint)
+                print("Slow request: " + json.dumps({
+                    "endpoint": endpoint,
+                    "method": scope["method"],
+                    "status": status,
+                    "ms": round(seconds * 1000, 1),
+                    "stages": trace.stages,
+                }))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format(name: str, labels: dict, value) -> str:
+    if labels:
+        rendered = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+        return f"{name}{{{rendered}}} {value}"
+    return f"{name} {value}"
+
+
+def _flatten(prefix: str, value, out: dict):
+    prefix = re.sub(r"[^a-zA-Z0-9_]", "_", prefix)
+    if isinstance(value, bool):
+        out[prefix] = int(value)
+    elif isinstance(value, (int, float)):
+        out[prefix] = value
+    elif isinstance(value, dict):
+        for key, child in value.items():
+            _flatten(f"{prefix}_{key}", child, out)
+
+
+def render(stats: dict = None) -> str:
+    """
+    Prometheus text exposition of every metric, plus the numeric leaves of
+    ``stats`` (component name -> stats dict) as gauges.
+    """
+    lines = []
+    for metric in _metrics.values():
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(_format(*sample) for sample in metric.samples())
+    gauges = {}
+    for component, values in (stats or {}).items():
+        _flatten(f"{NAMESPACE}_{component}", values, gauges)
+    for name, value in gauges.items():
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(_format(name, {}, value))
+    return "\n".join(lines) + "\n"
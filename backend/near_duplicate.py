@@ -0,0 +1,169 @@
+# near_duplicate.py
+import hashlib
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Optional
+
+# Debounced keystrokes send the same prompt with a word added or fixed, which
+# misses the exact-key cache. Within a session, a prompt whose SimHash is at
+# least NEAR_DUP_THRESHOLD similar to one scored earlier reuses that score.
+NEAR_DUP_ENABLED = os.getenv("NEAR_DUP_CACHE_DISABLED", "") == ""
+NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", "0.9"))
+# Fingerprints of very short prompts swing too much per word to compare.
+NEAR_DUP_MIN_WORDS = int(os.getenv("NEAR_DUP_MIN_WORDS", "6"))
+NEAR_DUP_SESSION_ENTRIES = int(os.getenv("NEAR_DUP_SESSION_ENTRIES", "16"))
+NEAR_DUP_MAX_SESSIONS = int(os.getenv("NEAR_DUP_MAX_SESSIONS", "1024"))
+NEAR_DUP_TTL = float(os.getenv("NEAR_DUP_TTL", "600"))
+# Share of reused scores that are also scored fresh in the background to
+# measure how often the reused verdict is wrong.
+NEAR_DUP_AUDIT_SHARE = float(os.getenv("NEAR_DUP_AUDIT_SHARE", "0.05"))
+
+BITS = 64
+MAX_DISTANCE = int((1 - NEAR_DUP_THRESHOLD) * BITS)
+
+_WORD = re.compile(r"\w+")
+
+_sessions = OrderedDict()
+stats = {"lookups": 0, "reused": 0, "stored": 0, "audited": 0, "agreed": 0}
+
+
+def _words(text: str) -> list:
+    return _WORD.findall(text.lower())
+
+
+def simhash(text: str) -> int:
+    """
+    64-bit SimHash over the words and word pairs of ``text``. Texts sharing
+    most features differ in few bits.
+    """
+    words = _words(text)
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    if not features:
+        return 0
+    hashes = [
+        format(int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "big"), "064b")
+        for feature in features
+    ]
+    half = len(hashes) / 2
+    return int("".join("1" if column.count("1") > half else "0" for column in zip(*hashes)), 2)
+
+
+def similarity(a: int, b: int) -> float:
+    return 1 - bin(a ^ b).count("1") / BITS
+
+
+class SimHashIndex:
+    """
+    Verdicts of recently scored prompts by fingerprint, bounded to
+    ``max_entries`` with a per-entry TTL. Fingerprints are split into
+    ``max_distance + 1`` bands: two fingerprints at most ``max_distance``
+    bits apart agree exactly on at least one band, so a lookup only compares
+    entries that share a band with it.
+    """
+
+    def __init__(self, max_distance: int, max_entries: int, ttl: float):
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.ttl = ttl
+        bands = max_distance + 1
+        self._bounds = [BITS * i // bands for i in range(bands + 1)]
+        self._entries = OrderedDict()  # fingerprint -> (expires, verdict)
+        self._bands = {}  # (band, bits) -> fingerprints
+
+    def _band_keys(self, fingerprint: int):
+        for band, (low, high) in enumerate(zip(self._bounds, self._bounds[1:])):
+            yield band, (fingerprint >> low) & ((1 << (high - low)) - 1)
+
+    def _remove(self, fingerprint: int):
+        del self._entries[fingerprint]
+        for key in self._band_keys(fingerprint):
+            members = self._bands[key]
+            members.discard(fingerprint)
+            if not members:
+                del self._bands[key]
+
+    def _expire(self):
+        # Entries are kept in write order and share one TTL.
+        now = time.monotonic()
+        while self._entries:
+            fingerprint, (expires, _) = next(iter(self._entries.items()))
+            if expires >= now:
+                break
+            self._remove(fingerprint)
+
+    def find(self, fingerprint: int) -> Optional[str]:
+        """
+        The verdict of the closest entry within ``max_distance`` bits, or None.
+        """
+        self._expire()
+        best, best_distance = None, self.max_distance + 1
+        for key in self._band_keys(fingerprint):
+            for candidate in self._bands.get(key, ()):
+                distance = bin(candidate ^ fingerprint).count("1")
+                if distance < best_distance:
+                    best, best_distance = candidate, distance
+        return None if best is None else self._entries[best][1]
+
+    def add(self, fingerprint: int, verdict: str):
+        self._expire()
+        if fingerprint not in self._entries:
+            for key in self._band_keys(fingerprint):
+                self._bands.setdefault(key, set()).add(fingerprint)
+        self._entries[fingerprint] = (time.monotonic() + self.ttl, verdict)
+        self._entries.move_to_end(fingerprint)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _eligible(session_id: Optional[str], text: str) -> bool:
+    return NEAR_DUP_ENABLED and bool(session_id) and len(_words(text)) >= NEAR_DUP_MIN_WORDS
+
+
+def lookup(session_id: Optional[str], text: str) -> Optional[str]:
+    """
+    The score of a near-duplicate of ``text`` scored earlier in ``session_id``, or None.
+    """
+    if not _eligible(session_id, text):
+        return None
+    stats["lookups"] += 1
+    index = _sessions.get(session_id)
+    if index is None:
+        return None
+    _sessions.move_to_end(session_id)
+    verdict = index.find(simhash(text))
+    if verdict is not None:
+        stats["reused"] += 1
+    return verdict
+
+
+def store(session_id: Optional[str], text: str, verdict: str):
+    """
+    Remember ``verdict`` for ``text`` in ``session_id``. Least recently used
+    sessions are dropped beyond NEAR_DUP_MAX_SESSIONS.
+    """
+    if not _eligible(session_id, text):
+        return
+    index = _sessions.get(session_id)
+    if index is None:
+        index = _sessions[session_id] = SimHashIndex(MAX_DISTANCE, NEAR_DUP_SESSION_ENTRIES, NEAR_DUP_TTL)
+        while len(_sessions) > NEAR_DUP_MAX_SESSIONS:
+            _sessions.popitem(last=False)
+    _sessions.move_to_end(session_id)
+    index.add(simhash(text), verdict)
+    stats["stored"] += 1
+
+
+def near_duplicate_stats() -> dict:
+    return {
+        **stats,
+        "threshold": NEAR_DUP_THRESHOLD,
+        "sessions": len(_sessions),
+        "entries": sum(len(index) for index in _sessions.values()),
+        "reuse_rate": stats["reused"] / stats["lookups"] if stats["lookups"] else 0.0,
+        "disagreement_rate": 1 - stats["agreed"] / stats["audited"] if stats["audited"] else None,
+    }
@@ -1,18 +1,30 @@
 # prompt_classifier.py
 
 from typing import List, Dict
-import openai
-import os
 import json
-from dotenv import load_dotenv
+from cache import get_cache
+from local_classifier import MIN_SHARE, classify_locally
+from metrics import stage
+from providers import complete
 
-load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
+CLASSIFIER_MODEL = "gpt-4o-mini"
+CLASSIFIER_PROMPT_VERSION = 1
 
-def classify_llm_for_prompts(prompts: List[str]) -> Dict[str, str]:
+_classifier_cache = get_cache("classifier")
+
+stats = {"local": 0, "llm": 0}
+
+async def classify_llm_for_prompts(prompts: List[str]) -> Dict[str, str]:
     """
     Analyze list of recent prompts and return suggested LLM with reason.
+    The local keyword heuristic answers when one label clearly dominates;
+    otherwise the LLM is asked.
     """
+    local = classify_locally(prompts)
+    if local["share"] >= MIN_SHARE:
+        stats["local"] += 1
+        return {"suggested_llm": local["suggested_llm"], "reason": local["reason"]}
+    stats["llm"] += 1
 
     system_message = """
         You are an intelligent classifier agent that helps users choose the best large language model (LLM) based on their recent prompt behavior.
@@ -42,10 +54,16 @@ def classify_llm_for_prompts(prompts: List[str]) -> Dict[str, str]:
 
     joined_prompts = "\n".join([f"{i+1}. {p}" for i, p in enumerate(prompts)])
 
+    key = _classifier_cache.make_key(CLASSIFIER_MODEL, CLASSIFIER_PROMPT_VERSION, joined_prompts)
+    cached = await _classifier_cache.get(key)
+    if cached is not None:
+        return cached
+
     try:
-        response = openai.ChatCompletion.create(
-            model="gpt-4o-mini",
-            messages=[
+        response = await complete(
+            "openai",
+            CLASSIFIER_MODEL,
+            [
                 {"role": "system", "content": system_message},
                 {"role": "user", "content": f"Recent user prompts:\n{joined_prompts}"}
             ],
@@ -53,10 +71,12 @@ def classify_llm_for_prompts(prompts: List[str]) -> Dict[str, str]:
             max_tokens=400
         )
 
-        raw_output = response['choices'][0]['message']['content'].strip()
+        raw_output = response.strip()
 
         try:
-            parsed = json.loads(raw_output)
+            with stage("parse"):
+                parsed = json.loads(raw_output)
+            await _classifier_cache.set(key, parsed)
             return parsed
         except json.JSONDecodeError:
             return {
@@ -71,3 +91,6 @@ def classify_llm_for_prompts(prompts: List[str]) -> Dict[str, str]:
             "reason": str(e)
         }
 
+
+def classifier_stats() -> dict:
+    return dict(stats)
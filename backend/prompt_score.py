@@ -1,31 +1,77 @@
-from google import genai
+import asyncio
+import json
 import os
+import random
+import re
+from typing import List, Optional
+from cache import get_cache
 from detect_pii import mask_pii
-import time
-import openai
-
-
-_gemini_client = None
-_openai_initialized = False
-
-def get_gemini_client():
-    global _gemini_client
-    if _gemini_client is None:
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
-            raise RuntimeError("Missing GEMINI_API_KEY environment variable.")
-        _gemini_client = genai.Client(api_key=api_key)
-    return _gemini_client
-
-def get_openai_client():
-    global _openai_initialized
-    if not _openai_initialized:
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise RuntimeError("Missing OPENAI_API_KEY environment variable.")
-        openai.api_key = api_key
-        _openai_initialized = True
-    return openai
+from metrics import FALLBACKS, SCORES, stage
+import near_duplicate
+from providers import complete
+from resilience import REQUEST_DEADLINE, deadline, hedged
+from routing import order
+from scheduler import background
+from singleflight import get_flight
+
+SCORING_MODEL = "gemini-2.0-flash-lite"
+FALLBACK_MODEL = "gpt-4o-mini"
+# Bump when build_scoring_prompt changes so cached scores are not reused.
+SCORING_PROMPT_VERSION = 1
+
+_score_cache = get_cache("prompt_score")
+_score_flight = get_flight("prompt_score")
+
+# Local pre-scorer: prompts that are obviously low or high are answered without
+# an LLM call. LOCAL_AUDIT_SHARE of those are still sent to the LLM in the
+# background to measure how often the local verdict agrees.
+LOCAL_SCORER_ENABLED = os.getenv("LOCAL_SCORER_DISABLED", "") == ""
+LOCAL_LOW_MAX_POINTS = int(os.getenv("LOCAL_LOW_MAX_POINTS", "1"))
+LOCAL_HIGH_MIN_POINTS = int(os.getenv("LOCAL_HIGH_MIN_POINTS", "8"))
+LOCAL_AUDIT_SHARE = float(os.getenv("LOCAL_AUDIT_SHARE", "0.05"))
+
+_FORMAT = re.compile(
+    r"\b(?:tables?|json|csv|yaml|markdown|bullet(?:s| points?)?|list|outline|steps?|code|snippet|essay|"
+    r"paragraphs?|email|report|format|template|diagram|examples?)\b",
+    re.IGNORECASE,
+)
+_CONSTRAINT = re.compile(
+    r"\b(?:must|should|only|exactly|at least|at most|no more than|under|within|limit|avoid|do not|don't|"
+    r"without|words|sentences|characters|tone|audience|style|concise|detailed)\b|\b\d+\b",
+    re.IGNORECASE,
+)
+_ROLE = re.compile(r"\b(?:you are|act as|as an? (?:expert|senior|professional)|pretend|your role)\b", re.IGNORECASE)
+_CONTEXT = re.compile(
+    r"\b(?:because|context|background|goal|so that|in order to|for (?:my|our)|i am|i'm|we are|we're)\b",
+    re.IGNORECASE,
+)
+_STRUCTURE = re.compile(r"^\s*(?:[-*\u2022]|\d+[.)]|#+)\s|\n\s*\n|:\s*$", re.MULTILINE)
+_QUESTION = re.compile(r"^\s*(?:what|why|how|who|when|where|which)\b|\?\s*$", re.IGNORECASE)
+
+# Batch scoring: prompts are packed into provider requests of at most
+# BATCH_MAX_PROMPTS prompts and BATCH_MAX_CHARS characters; BATCH_CONCURRENCY
+# requests (or single-prompt retries) run at a time.
+BATCH_MAX_PROMPTS = int(os.getenv("SCORE_BATCH_MAX_PROMPTS", "50"))
+BATCH_MAX_CHARS = int(os.getenv("SCORE_BATCH_MAX_CHARS", "60000"))
+BATCH_CONCURRENCY = int(os.getenv("SCORE_BATCH_CONCURRENCY", "4"))
+# Most prompts one /prompt-score/batch request may carry.
+BATCH_MAX_REQUEST_PROMPTS = int(os.getenv("SCORE_BATCH_MAX_REQUEST_PROMPTS", "1000"))
+# Bump when build_batch_scoring_prompt changes.
+BATCH_SCORING_PROMPT_VERSION = 1
+
+_local_stats = {"low": 0, "high": 0, "ambiguous": 0, "audited": 0, "agreed": 0}
+_batch_stats = {"prompts": 0, "local": 0, "cached": 0, "requests": 0, "batched": 0, "failed_requests": 0, "single": 0}
+_audit_tasks = set()
+
+
+# Shared by single and batch scoring prompts.
+_SCORING_CRITERIA = (
+    "1. Clarity: Is the prompt clear, structured, unambiguous, and easy to understand?\n"
+    "2. Specificity: Does the prompt include sufficient details and precise instructions?\n"
+    "3. Usefulness: Would the prompt likely lead to a high-quality, relevant response from LLM's?\n"
+    "4. Creativity: Does the prompt encourage innovative and thoughtful answers? (Remember, even concise prompts can be high quality if they are well-crafted.)\n\n"
+    "Important: Please ignore any occurrence of 'XXXX' in the prompt. These placeholders represent redacted sensitive information and should not be considered when judging the prompt's clarity, detail, usefulness, or creativity.\n\n"
+)
 
 def build_scoring_prompt(safe_prompt: str) -> str:
     """
@@ -33,65 +79,344 @@ def build_scoring_prompt(safe_prompt: str) -> str:
     """
     return (
         "You are an expert AI prompt evaluator. Your task is to assess the quality of a given prompt based on the following criteria:\n"
-        "1. Clarity: Is the prompt clear, structured, unambiguous, and easy to understand?\n"
-        "2. Specificity: Does the prompt include sufficient details and precise instructions?\n"
-        "3. Usefulness: Would the prompt likely lead to a high-quality, relevant response from LLM's?\n"
-        "4. Creativity: Does the prompt encourage innovative and thoughtful answers? (Remember, even concise prompts can be high quality if they are well-crafted.)\n\n"
-        "Important: Please ignore any occurrence of 'XXXX' in the prompt. These placeholders represent redacted sensitive information and should not be considered when judging the prompt's clarity, detail, usefulness, or creativity.\n\n"
-        "After evaluating the prompt on these dimensions, assign it a rating of 'low', 'medium', or 'high'. Be a little strict. "
+        + _SCORING_CRITERIA
+        + "After evaluating the prompt on these dimensions, assign it a rating of 'low', 'medium', or 'high'. Be a little strict. "
         "Respond with only one word, without any additional commentary.\n\n"
         f"Prompt: {safe_prompt}"
     )
 
-def fallback_rate_prompt_quality(prompt: str, safe_prompt: str) -> dict:
+def build_batch_scoring_prompt(safe_prompts: List[str]) -> str:
+    """
+    One scoring request for several prompts, answered with a JSON array of verdicts.
+    """
+    return (
+        f"You are an expert AI prompt evaluator. You are given {len(safe_prompts)} prompts as a JSON array of strings. "
+        "Assess the quality of each prompt on its own, based on the following criteria:\n"
+        + _SCORING_CRITERIA
+        + "Rate each prompt 'low', 'medium', or 'high'. Be a little strict. "
+        f"Respond with only a strict JSON array of exactly {len(safe_prompts)} strings, one rating per prompt "
+        "in the same order, without any additional commentary.\n\n"
+        f"Prompts: {json.dumps(safe_prompts, ensure_ascii=False)}"
+    )
+
+def local_prompt_points(prompt: str) -> int:
+    """
+    Cheap quality signal: points for length, an explicit output format,
+    constraints, a role, background context and visible structure.
+    """
+    words = len(prompt.split())
+    points = 0
+    if words >= 12:
+        points += 1
+    if words >= 30:
+        points += 1
+    if words >= 60:
+        points += 1
+    if _FORMAT.search(prompt):
+        points += 2
+    if len(_CONSTRAINT.findall(prompt)) >= 2:
+        points += 2
+    if _ROLE.search(prompt):
+        points += 1
+    if _CONTEXT.search(prompt):
+        points += 1
+    if _STRUCTURE.search(prompt):
+        points += 1
+    # A bare question with nothing else is the classic vague prompt.
+    if points <= 1 and _QUESTION.search(prompt):
+        points -= 1
+    return points
+
+def local_score(prompt: str):
+    """
+    Return 'low' or 'high' when the heuristics are confident, otherwise None.
+    """
+    words = len(prompt.split())
+    if words < 4:
+        return "low"
+    points = local_prompt_points(prompt)
+    if words < 10 and points <= LOCAL_LOW_MAX_POINTS:
+        return "low"
+    if words >= 30 and points >= LOCAL_HIGH_MIN_POINTS:
+        return "high"
+    return None
+
+def local_scorer_stats() -> dict:
+    decided = _local_stats["low"] + _local_stats["high"]
+    total = decided + _local_stats["ambiguous"]
+    return {
+        **_local_stats,
+        "local_share": decided / total if total else 0.0,
+        "agreement_rate": _local_stats["agreed"] / _local_stats["audited"] if _local_stats["audited"] else None,
+    }
+
+def parse_score(text: str) -> str:
+    score = text.strip().lower()
+    if score not in {"low", "medium", "high"}:
+        score = "unknown"
+    return score
+
+async def fallback_rate_prompt_quality(prompt: str, safe_prompt: str) -> dict:
     """
     Fall back to OpenAI's GPT-4o-mini for prompt quality evaluation.
+    Raises ProviderError if OpenAI fails too.
     """
-    # Ensure OpenAI client is initialized
-    get_openai_client()
-    scoring_prompt = build_scoring_prompt(safe_prompt)
-    
-    try:
-        response = openai.ChatCompletion.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": scoring_prompt}],
-            max_tokens=100,
-            temperature=0.7
+    with stage("prompt_build"):
+        scoring_prompt = build_scoring_prompt(safe_prompt)
+    text = await complete(
+        "openai",
+        FALLBACK_MODEL,
+        [{"role": "user", "content": scoring_prompt}],
+        max_tokens=100,
+        temperature=0.7,
+    )
+    with stage("parse"):
+        score = parse_score(text)
+    return {"score": score, "masked_prompt": safe_prompt}
+
+async def _score_with_providers(prompt: str, safe_prompt: str) -> dict:
+    with stage("prompt_build"):
+        scoring_prompt = build_scoring_prompt(safe_prompt)
+
+    async def score_with_gemini():
+        text = await complete(
+            "gemini",
+            SCORING_MODEL,
+            [{"role": "user", "content": scoring_prompt}],
+            retries=2,
+            retry_delay=0.3,
         )
-        score = response['choices'][0]['message']['content'].strip().lower()
-        if score not in {"low", "medium", "high"}:
-            score = "unknown"
+        with stage("parse"):
+            score = parse_score(text)
         return {"score": score, "masked_prompt": safe_prompt}
+
+    calls = {
+        ("gemini", SCORING_MODEL): score_with_gemini,
+        ("openai", FALLBACK_MODEL): lambda: fallback_rate_prompt_quality(prompt, safe_prompt),
+    }
+    # Gemini is preferred, but the router leads with whichever is currently faster.
+    first, second = order("prompt_score", list(calls))
+    try:
+        return await hedged(f"prompt_score:{first[0]}", calls[first], calls[second])
     except Exception as e:
-        print(f"OpenAI fallback error in rate_prompt_quality: {e}")
+        print(f"Gemini and GPT-4o-mini both failed in rate_prompt_quality: {e}")
         return {"score": "unknown", "masked_prompt": safe_prompt}
 
-def rate_prompt_quality(prompt: str) -> dict:
+async def _llm_score(prompt: str, safe_prompt: str) -> dict:
+    # The providers only ever see the masked prompt, so it is also the cache key.
+    key = _score_cache.make_key(SCORING_MODEL, SCORING_PROMPT_VERSION, safe_prompt)
+    cached = await _score_cache.get(key)
+    if cached is not None:
+        return {"score": cached["score"], "masked_prompt": safe_prompt}
+
+    async def score_and_store():
+        result = await _score_with_providers(prompt, safe_prompt)
+        if result["score"] != "unknown":
+            await _score_cache.set(key, result)
+        return result
+
+    # Identical prompts already being scored share that provider call.
+    result = await _score_flight.do(key, score_and_store)
+    return {"score": result["score"], "masked_prompt": safe_prompt}
+
+async def _audit_score(prompt: str, safe_prompt: str, verdict: str, stats: dict):
+    """
+    Score the prompt with the LLM and count in ``stats`` whether ``verdict`` agreed.
+    Returns the LLM's score, or None if it has none.
+    """
+    try:
+        result = await _llm_score(prompt, safe_prompt)
+    except Exception as e:
+        print(f"Score audit failed: {e}")
+        return None
+    if result["score"] == "unknown":
+        return None
+    stats["audited"] += 1
+    if result["score"] == verdict:
+        stats["agreed"] += 1
+    return result["score"]
+
+async def _audit_near_duplicate(prompt: str, safe_prompt: str, verdict: str, session_id: str):
+    fresh = await _audit_score(prompt, safe_prompt, verdict, near_duplicate.stats)
+    if fresh is not None:
+        near_duplicate.store(session_id, safe_prompt, fresh)
+
+def _spawn_audit(coro):
+    with background():
+        task = asyncio.ensure_future(coro)
+    _audit_tasks.add(task)
+    task.add_done_callback(_audit_tasks.discard)
+
+async def rate_prompt_quality(prompt: str, spans: list = None, session_id: str = None) -> dict:
     """
     Evaluate the prompt's quality using Gemini. If Gemini fails after retries, fallback to OpenAI GPT-4o-mini.
+    Obviously low or high prompts are scored locally without an LLM call, and
+    near-duplicates of a prompt scored earlier in ``session_id`` reuse its score.
+    ``spans`` may carry the result of an earlier scan_pii call on the same prompt.
     """
-    client = get_gemini_client()
     # Mask any PII from the input prompt.
-    safe_prompt = mask_pii(prompt)
-    scoring_prompt = build_scoring_prompt(safe_prompt)
-    
-    max_retries = 2
-    retry_delay = 0.3
-    for attempt in range(max_retries):
+    with stage("pii_mask"):
+        safe_prompt = mask_pii(prompt, spans)
+
+    if LOCAL_SCORER_ENABLED:
+        with stage("local_score"):
+            verdict = local_score(safe_prompt)
+        if verdict is not None:
+            _local_stats[verdict] += 1
+            SCORES.inc(score=verdict, source="local")
+            if random.random() < LOCAL_AUDIT_SHARE:
+                _spawn_audit(_audit_score(prompt, safe_prompt, verdict, _local_stats))
+            return {"score": verdict, "masked_prompt": safe_prompt}
+        _local_stats["ambiguous"] += 1
+
+    with stage("near_duplicate"):
+        verdict = near_duplicate.lookup(session_id, safe_prompt)
+    if verdict is not None:
+        SCORES.inc(score=verdict, source="near_duplicate")
+        if random.random() < near_duplicate.NEAR_DUP_AUDIT_SHARE:
+            _spawn_audit(_audit_near_duplicate(prompt, safe_prompt, verdict, session_id))
+        return {"score": verdict, "masked_prompt": safe_prompt}
+
+    result = await _llm_score(prompt, safe_prompt)
+    SCORES.inc(score=result["score"], source="llm")
+    if result["score"] != "unknown":
+        near_duplicate.store(session_id, safe_prompt, result["score"])
+    return result
+
+def parse_batch_scores(text: str, count: int) -> Optional[List[str]]:
+    """
+    The ``count`` verdicts in a batch reply, "unknown" for any that are not a
+    rating; None when the reply is not a JSON array of that length.
+    """
+    start, end = text.find("["), text.rfind("]")
+    if start < 0 or end < start:
+        return None
+    try:
+        verdicts = json.loads(text[start:end + 1])
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(verdicts, list) or len(verdicts) != count:
+        return None
+    return [parse_score(v) if isinstance(v, str) else "unknown" for v in verdicts]
+
+def _pack(safe_prompts: List[str]) -> List[List[str]]:
+    batches, batch, chars = [], [], 0
+    for safe_prompt in safe_prompts:
+        if batch and (len(batch) >= BATCH_MAX_PROMPTS or chars + len(safe_prompt) > BATCH_MAX_CHARS):
+            batches.append(batch)
+            batch, chars = [], 0
+        batch.append(safe_prompt)
+        chars += len(safe_prompt)
+    if batch:
+        batches.append(batch)
+    return batches
+
+async def _score_batch_with_providers(safe_prompts: List[str]) -> List[str]:
+    with stage("prompt_build"):
+        scoring_prompt = build_batch_scoring_prompt(safe_prompts)
+
+    async def score(provider: str, model: str) -> List[str]:
+        text = await complete(
+            provider,
+            model,
+            [{"role": "user", "content": scoring_prompt}],
+            max_tokens=8 * len(safe_prompts) + 50,
+            route="prompt_score_batch",
+        )
+        with stage("parse"):
+            verdicts = parse_batch_scores(text, len(safe_prompts))
+        if verdicts is None:
+            raise ValueError(f"malformed batch reply from {provider}")
+        return verdicts
+
+    # Not hedged: a batch reply takes many times a single score's p95, so a
+    # hedge would send nearly every batch to both providers. The second
+    # provider is only asked when the first fails. Batches keep latency
+    # estimates of their own, so single scores are not ranked on them.
+    error = None
+    for i, (provider, model) in enumerate(order("prompt_score_batch", [("gemini", SCORING_MODEL), ("openai", FALLBACK_MODEL)])):
+        if i:
+            FALLBACKS.inc(call="prompt_score_batch", reason="failure")
         try:
-            response = client.models.generate_content(
-                model="gemini-2.0-flash-lite",
-                contents=scoring_prompt
-            )
-            score = response.text.strip().lower()
-            if score not in {"low", "medium", "high"}:
-                score = "unknown"
-            return {"score": score, "masked_prompt": safe_prompt}
+            return await score(provider, model)
         except Exception as e:
-            print(f"Error from Gemini on attempt {attempt + 1}: {e}")
-            if attempt < max_retries - 1:
-                time.sleep(retry_delay)
-                retry_delay *= 2  # Exponential backoff
-            else:
-                print("Gemini API unavailable after retries. Falling back to GPT-4o-mini...")
-                return fallback_rate_prompt_quality(prompt, safe_prompt)
\ No newline at end of file
+            print(f"{provider} failed batch scoring: {e}")
+            error = e
+    raise error
+
+async def rate_prompt_quality_batch(prompts: List[str]) -> List[dict]:
+    """
+    Score many prompts at once, for bulk grading. Prompts are masked, scored
+    locally or from the cache where possible, and the rest are packed into a
+    few provider requests that share one instruction block and answer with a
+    JSON array of verdicts. Requests run BATCH_CONCURRENCY at a time as
+    background work; prompts of a failed request, and verdicts missing from
+    its reply, are scored one by one. Returns one rate_prompt_quality-style
+    result per prompt, in order.
+    """
+    _batch_stats["prompts"] += len(prompts)
+    with stage("pii_mask"):
+        # Thousands of prompts: keep the scan off the event loop.
+        safe_prompts = await asyncio.to_thread(lambda: [mask_pii(prompt) for prompt in prompts])
+    originals = dict(zip(safe_prompts, prompts))
+
+    scores = {}
+    pending = []
+    for safe_prompt in originals:
+        verdict = local_score(safe_prompt) if LOCAL_SCORER_ENABLED else None
+        if verdict is not None:
+            _batch_stats["local"] += 1
+            SCORES.inc(score=verdict, source="local")
+            scores[safe_prompt] = verdict
+            continue
+        for key in (
+            _score_cache.make_key(SCORING_MODEL, SCORING_PROMPT_VERSION, safe_prompt),
+            _score_cache.make_key(SCORING_MODEL, f"batch-{BATCH_SCORING_PROMPT_VERSION}", safe_prompt),
+        ):
+            cached = await _score_cache.get(key)
+            if cached is not None:
+                _batch_stats["cached"] += 1
+                scores[safe_prompt] = cached["score"]
+                break
+        else:
+            pending.append(safe_prompt)
+
+    slots = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def score_single(safe_prompt: str):
+        async with slots:
+            _batch_stats["single"] += 1
+            with deadline(REQUEST_DEADLINE):
+                result = await _llm_score(originals[safe_prompt], safe_prompt)
+        scores[safe_prompt] = result["score"]
+        SCORES.inc(score=result["score"], source="llm")
+
+    async def score_batch(batch: List[str]):
+        async with slots:
+            _batch_stats["requests"] += 1
+            try:
+                # Each request gets its own deadline; the whole batch may take minutes.
+                with deadline(REQUEST_DEADLINE):
+                    verdicts = await _score_batch_with_providers(batch)
+            except Exception as e:
+                print(f"Batch of {len(batch)} prompts failed, scoring them one by one: {e}")
+                _batch_stats["failed_requests"] += 1
+                verdicts = ["unknown"] * len(batch)
+        retry = []
+        for safe_prompt, verdict in zip(batch, verdicts):
+            if verdict == "unknown":
+                retry.append(safe_prompt)
+                continue
+            _batch_stats["batched"] += 1
+            scores[safe_prompt] = verdict
+            SCORES.inc(score=verdict, source="batch")
+            key = _score_cache.make_key(SCORING_MODEL, f"batch-{BATCH_SCORING_PROMPT_VERSION}", safe_prompt)
+            await _score_cache.set(key, {"score": verdict, "masked_prompt": safe_prompt})
+        await asyncio.gather(*(score_single(safe_prompt) for safe_prompt in retry))
+
+    with background():
+        await asyncio.gather(*(score_batch(batch) for batch in _pack(pending)))
+    return [{"score": scores[safe_prompt], "masked_prompt": safe_prompt} for safe_prompt in safe_prompts]
+
+def batch_scoring_stats() -> dict:
+    return dict(_batch_stats)
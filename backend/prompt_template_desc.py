@@ -1,39 +1,30 @@
-from groq import Groq
-import os
-import openai
-from dotenv import load_dotenv
-import time
-
-load_dotenv()
-_groq_client = None
-
-def get_groq_client():
-    global _groq_client
-    if _groq_client is None:
-        api_key = os.getenv("GROQ_API_KEY")
-        if not api_key:
-            raise RuntimeError("Missing GROQ_API_KEY environment variable.")
-        _groq_client = Groq(api_key=api_key)
-    return _groq_client
-
-_openai_initialized = False
-
-def get_openai_client():
-    global _openai_initialized
-    if not _openai_initialized:
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise RuntimeError("Missing OPENAI_API_KEY environment variable.")
-        openai.api_key = api_key
-        _openai_initialized = True
-    return openai
-
-def fallback_enhance_prompt(prompt: str, summary: str = "") -> str:
+from cache import get_cache
+from metrics import FALLBACKS, stage
+from providers import complete, stream
+from resilience import hedged
+from routing import order
+from singleflight import get_flight
+from summary_gen import get_session_summary
+
+ENHANCE_MODEL = "llama-3.3-70b-versatile"
+FALLBACK_MODEL = "gpt-4o-mini"
+ENHANCE_PROMPT_VERSION = 1
+
+_enhance_cache = get_cache("enhance_descriptive")
+_enhance_flight = get_flight("enhance_descriptive")
+
+GROQ_FORMAT_ERROR = "Unexpected response format from Groq."
+OPENAI_FORMAT_ERROR = "Unexpected response format from OpenAI fallback."
+UNAVAILABLE_MESSAGE = "Service currently unavailable. Please try again later."
+
+# Output cap per provider when streaming, matching the non-streaming calls.
+STREAM_MAX_TOKENS = {"openai": 800}
+
+async def fallback_enhance_prompt(prompt: str, summary: str = "") -> str:
     """
     Fall back to OpenAI's GPT-4o-mini for prompt enhancement.
+    Raises ProviderError if OpenAI fails too.
     """
-    get_openai_client()  
-
 
     messages = [
         {
@@ -64,25 +55,40 @@ def fallback_enhance_prompt(prompt: str, summary: str = "") -> str:
         }
     ]
 
-    try:
-        response = openai.ChatCompletion.create(
-            model="gpt-4o-mini",
-            messages=messages,
-            max_tokens=800,
-            temperature=0.7
-        )
-
-        if response['choices'] and response['choices'][0]['message']:
-            return response['choices'][0]['message']['content'].strip()
-        else:
-            return "Unexpected response format from OpenAI fallback."
-    except Exception as e:
-        print(f"OpenAI fallback error: {e}")
-        return "Service currently unavailable. Please try again later."
-
-def enhance_prompt_with_groq(prompt: str, summary: str = ""):
-    client = get_groq_client()
-    messages = [
+    text = await complete(
+        "openai",
+        FALLBACK_MODEL,
+        messages,
+        max_tokens=800,
+        temperature=0.7
+    )
+    if text:
+        return text.strip()
+    else:
+        return OPENAI_FORMAT_ERROR
+
+async def enhance_prompt_with_groq(prompt: str, summary: str = "", session_id: str = None):
+    if session_id:
+        # The server-side rolling summary is the freshest context we have.
+        summary = get_session_summary(session_id) or summary
+    key = _enhance_cache.make_key(ENHANCE_MODEL, ENHANCE_PROMPT_VERSION, prompt, summary)
+    cached = await _enhance_cache.get(key)
+    if cached is not None:
+        return cached
+
+    async def enhance_and_store():
+        result = await _enhance_with_providers(prompt, summary)
+        if not _is_error_text(result):
+            await _enhance_cache.set(key, result)
+        return result
+
+    return await _enhance_flight.do(key, enhance_and_store)
+
+def _is_error_text(text: str) -> bool:
+    return text in {GROQ_FORMAT_ERROR, OPENAI_FORMAT_ERROR, UNAVAILABLE_MESSAGE}
+
+def _enhance_messages(prompt: str, summary: str = "") -> list:
+    return [
         {
             "role": "system",
 
@@ -111,26 +117,69 @@ def enhance_prompt_with_groq(prompt: str, summary: str = ""):
         }
     ]
 
-    max_retries = 3
-    retry_delay = 0.5  
-    for attempt in range(max_retries):
-        try:
-            response = client.chat.completions.create(
-                model="llama-3.3-70b-versatile",   
-                messages=messages,
-                temperature=0.7
-            )
-            if response.choices and response.choices[0].message:
-                return response.choices[0].message.content
-            else:
-                return "Unexpected response format from Groq."
-        except Exception as e:
-            print(f"Groq API error on attempt {attempt + 1}: {e}")
-            if attempt < max_retries - 1:
-                time.sleep(retry_delay)
-                retry_delay *= 2  
-            else:
-                # Fallback to the OpenAI model.
-                print("Groq API unavailable after retries. Falling back to GPT-4o-mini...")
-                return fallback_enhance_prompt(prompt, summary)
+async def _enhance_with_providers(prompt: str, summary: str = "") -> str:
+    with stage("prompt_build"):
+        messages = _enhance_messages(prompt, summary)
+
+    async def enhance_with_groq():
+        text = await complete(
+            "groq",
+            ENHANCE_MODEL,
+            messages,
+            temperature=0.7,
+            retries=3,
+            retry_delay=0.5
+        )
+        if text:
+            return text
+        else:
+            return GROQ_FORMAT_ERROR
 
+    calls = {
+        ("groq", ENHANCE_MODEL): enhance_with_groq,
+        ("openai", FALLBACK_MODEL): lambda: fallback_enhance_prompt(prompt, summary),
+    }
+    first, second = order("enhance_descriptive", list(calls))
+    try:
+        return await hedged(f"enhance_descriptive:{first[0]}", calls[first], calls[second])
+    except Exception as e:
+        print(f"Groq and GPT-4o-mini both failed in prompt enhancement: {e}")
+        return UNAVAILABLE_MESSAGE
+
+async def stream_enhanced_prompt(prompt: str, summary: str = "", session_id: str = None):
+    """
+    Stream the enhanced prompt as it is generated. Yields events:
+    {"delta": text} for each chunk, {"reset": True} when a provider broke off
+    part-way and the next one starts over, then {"templates": full_text}, or
+    {"error": message} if every provider failed.
+    """
+    if session_id:
+        summary = get_session_summary(session_id) or summary
+    key = _enhance_cache.make_key(ENHANCE_MODEL, ENHANCE_PROMPT_VERSION, prompt, summary)
+    cached = await _enhance_cache.get(key)
+    if cached is not None:
+        yield {"delta": cached}
+        yield {"templates": cached}
+        return
+
+    with stage("prompt_build"):
+        messages = _enhance_messages(prompt, summary)
+    for i, (provider, model) in enumerate(order("enhance_descriptive", [("groq", ENHANCE_MODEL), ("openai", FALLBACK_MODEL)])):
+        if i:
+            FALLBACKS.inc(call="enhance_descriptive_stream", reason="failure")
+        parts = []
+        try:
+            async for text in stream(provider, model, messages, max_tokens=STREAM_MAX_TOKENS.get(provider), temperature=0.7):
+                parts.append(text)
+                yield {"delta": text}
+        except Exception:
+            # ``stream`` has already logged the failure.
+            if parts:
+                yield {"reset": True}
+            continue
+        result = "".join(parts).strip()
+        if result:
+            await _enhance_cache.set(key, result)
+            yield {"templates": result}
+            return
+    yield {"error": UNAVAILABLE_MESSAGE}
@@ -1,23 +1,20 @@
 from typing import List
-import openai
-import os
+from cache import get_cache, normalize_prompt
+from metrics import stage
+from prompt_score import local_prompt_points
+from providers import complete_choices
 
-_openai_initialized = False
+TEMPLATE_MODEL = "gpt-4o-mini"
+TEMPLATE_PROMPT_VERSION = 2
 
-def get_openai_client():
-    global _openai_initialized
-    if not _openai_initialized:
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise RuntimeError("Missing OPENAI_API_KEY environment variable.")
-        openai.api_key = api_key
-        _openai_initialized = True
-    return openai
+DEFAULT_NUM_TEMPLATES = 3
+MAX_TEMPLATES = 8
+# Extra requests allowed to replace duplicate candidates.
+MAX_TOP_UPS = 2
 
-def suggest_prompt_templates(user_prompt: str, num_templates: int = 3) -> List[str]:
-    openai = get_openai_client()
+_template_cache = get_cache("templates_short")
 
-    system_message = """
+SYSTEM_MESSAGE = """
         'As an expert AI prompt engineer who knows how to interpret an average humans prompt and rewrite it in a '
         'way that increases the probability of the model generating the most useful possible response to any specific '
         'human prompt. In response to the user prompts, you do not respond as an AI assistant. You only respond with an '
@@ -28,18 +25,61 @@ def suggest_prompt_templates(user_prompt: str, num_templates: int = 3) -> List[s
         'the optimized prompt with no headers or explanations of the optimized prompt.'
         """
 
-    formatted_system_message = system_message.format(num_templates=num_templates)
-
-    response = openai.ChatCompletion.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": formatted_system_message},
-            {"role": "user", "content": f"User's original prompt: '{user_prompt}'"}
-        ],
-        max_tokens=800,
-        temperature=0.6
-    )
-
-    suggestions = response['choices'][0]['message']['content']
-    templates = [template.strip() for template in suggestions.strip().split("\n\n") if template.strip()]
-    return templates
+
+def rank_templates(templates: List[str]) -> List[str]:
+    """
+    Order templates by the local scorer's quality points, best first.
+    """
+    return sorted(templates, key=local_prompt_points, reverse=True)
+
+
+async def suggest_prompt_templates(user_prompt: str, num_templates: int = DEFAULT_NUM_TEMPLATES, rank: bool = False) -> List[str]:
+    """
+    Return ``num_templates`` distinct rewrites of ``user_prompt``. Each one is
+    a separate choice of a single completion request (the ``n`` parameter);
+    duplicates are dropped and replaced by a smaller follow-up request.
+    Fewer are returned only if the provider keeps repeating itself.
+    """
+    num_templates = max(1, min(num_templates, MAX_TEMPLATES))
+
+    key = _template_cache.make_key(TEMPLATE_MODEL, TEMPLATE_PROMPT_VERSION, str(num_templates), user_prompt)
+    cached = await _template_cache.get(key)
+    if cached is None:
+        with stage("prompt_build"):
+            messages = [
+                {"role": "system", "content": SYSTEM_MESSAGE},
+                {"role": "user", "content": f"User's original prompt: '{user_prompt}'"}
+            ]
+        templates = []
+        seen = set()
+        for _ in range(1 + MAX_TOP_UPS):
+            try:
+                choices = await complete_choices(
+                    "openai",
+                    TEMPLATE_MODEL,
+                    messages,
+                    num_templates - len(templates),
+                    max_tokens=800,
+                    temperature=0.6
+                )
+            except Exception:
+                # A failed top-up still leaves the distinct templates we have.
+                if not templates:
+                    raise
+                break
+            with stage("parse"):
+                for choice in choices:
+                    template = choice.strip()
+                    fingerprint = normalize_prompt(template).lower()
+                    if template and fingerprint not in seen:
+                        seen.add(fingerprint)
+                        templates.append(template)
+            if len(templates) >= num_templates:
+                break
+        templates = templates[:num_templates]
+        if templates:
+            await _template_cache.set(key, templates)
+    else:
+        templates = cached
+
+    return rank_templates(templates) if rank else templates
@@ -0,0 +1,394 @@
+# providers.py
+import asyncio
+import logging
+import os
+import time
+
+import httpx
+from dotenv import load_dotenv
+
+from resilience import DeadlineExceeded, bounded, get_breaker
+import metrics
+import routing
+import scheduler
+from scheduler import Overloaded
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Per-call timeout (seconds) applied to every provider request.
+DEFAULT_TIMEOUT = float(os.getenv("PROVIDER_TIMEOUT", "20"))
+
+# Connection pool shared by the OpenAI and Groq clients. Keep-alive connections
+# let back-to-back keystroke requests skip the TCP/TLS handshake.
+MAX_CONNECTIONS = int(os.getenv("PROVIDER_MAX_CONNECTIONS", "200"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("PROVIDER_MAX_KEEPALIVE", "50"))
+KEEPALIVE_EXPIRY = 30.0
+
+# Providers to connect to in the background at startup, e.g. "groq,openai"
+# or "all". Empty (the default) leaves everything to the first request.
+WARMUP_PROVIDERS = os.getenv("PROVIDER_WARMUP", "")
+
+API_KEY_ENV = {
+    "openai": "OPENAI_API_KEY",
+    "groq": "GROQ_API_KEY",
+    "gemini": "GEMINI_API_KEY",
+}
+
+_http_client = None
+_clients = {}
+
+
+class ProviderError(RuntimeError):
+    """Raised when a provider call still fails after all retries."""
+
+
+def get_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(DEFAULT_TIMEOUT, connect=5.0),
+        )
+    return _http_client
+
+
+def _api_key(provider: str) -> str:
+    env_var = API_KEY_ENV[provider]
+    api_key = os.getenv(env_var)
+    if not api_key:
+        raise RuntimeError(f"Missing {env_var} environment variable.")
+    return api_key
+
+
+def get_client(provider: str):
+    """
+    Return the shared async client for ``provider``, creating it on first use.
+    The provider's SDK is imported here rather than at module load, so
+    startup only pays for the SDKs that are actually used.
+    """
+    if provider not in _clients:
+        api_key = _api_key(provider)
+        if provider == "openai":
+            from openai import AsyncOpenAI
+            # Retries are handled by ``complete`` so the SDK must not add its own.
+            _clients[provider] = AsyncOpenAI(api_key=api_key, http_client=get_http_client(), max_retries=0)
+        elif provider == "groq":
+            from groq import AsyncGroq
+            _clients[provider] = AsyncGroq(api_key=api_key, http_client=get_http_client(), max_retries=0)
+        elif provider == "gemini":
+            from google import genai
+            from google.genai import types
+            _clients[provider] = genai.Client(
+                api_key=api_key,
+                http_options=types.HttpOptions(httpx_async_client=get_http_client()),
+            )
+        else:
+            raise ValueError(f"Unknown provider: {provider}")
+    return _clients[provider]
+
+
+async def _chat_openai_compatible(client, model: str, messages: list, max_tokens, temperature, n) -> list:
+    kwargs = {}
+    if max_tokens is not None:
+        kwargs["max_tokens"] = max_tokens
+    if temperature is not None:
+        kwargs["temperature"] = temperature
+    if n > 1:
+        kwargs["n"] = n
+    response = await client.chat.completions.create(model=model, messages=messages, **kwargs)
+    return [choice.message.content or "" for choice in response.choices or [] if choice.message]
+
+
+async def _chat_gemini(client, model: str, messages: list, max_tokens, temperature, n) -> list:
+    system = "\n\n".join(m["content"] for m in messages if m["role"] == "system")
+    contents = "\n\n".join(m["content"] for m in messages if m["role"] != "system")
+    config = {}
+    if system:
+        config["system_instruction"] = system
+    if max_tokens is not None:
+        config["max_output_tokens"] = max_tokens
+    if temperature is not None:
+        config["temperature"] = temperature
+    if n > 1:
+        config["candidate_count"] = n
+    response = await client.aio.models.generate_content(model=model, contents=contents, config=config or None)
+    if n == 1:
+        return [response.text or ""]
+    return [
+        "".join(part.text or "" for part in candidate.content.parts)
+        for candidate in response.candidates or []
+        if candidate.content and candidate.content.parts
+    ]
+
+
+_CHAT = {
+    "openai": _chat_openai_compatible,
+    "groq": _chat_openai_compatible,
+    "gemini": _chat_gemini,
+}
+
+
+async def _stream_openai_compatible(client, model: str, messages: list, max_tokens, temperature):
+    kwargs = {}
+    if max_tokens is not None:
+        kwargs["max_tokens"] = max_tokens
+    if temperature is not None:
+        kwargs["temperature"] = temperature
+    response = await client.chat.completions.create(model=model, messages=messages, stream=True, **kwargs)
+    async for chunk in response:
+        if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+async def _stream_gemini(client, model: str, messages: list, max_tokens, temperature):
+    system = "\n\n".join(m["content"] for m in messages if m["role"] == "system")
+    contents = "\n\n".join(m["content"] for m in messages if m["role"] != "system")
+    config = {}
+    if system:
+        config["system_instruction"] = system
+    if max_tokens is not None:
+        config["max_output_tokens"] = max_tokens
+    if temperature is not None:
+        config["temperature"] = temperature
+    response = await client.aio.models.generate_content_stream(model=model, contents=contents, config=config or None)
+    async for chunk in response:
+        if chunk.text:
+            yield chunk.text
+
+
+_STREAM = {
+    "openai": _stream_openai_compatible,
+    "groq": _stream_openai_compatible,
+    "gemini": _stream_gemini,
+}
+
+
+async def complete(
+    provider: str,
+    model: str,
+    messages: list,
+    max_tokens: int = None,
+    temperature: float = None,
+    retries: int = 1,
+    retry_delay: float = 0.5,
+    timeout: float = DEFAULT_TIMEOUT,
+    route: str = None,
+) -> str:
+    """
+    Run a chat completion against ``provider`` and return the response text.
+    See ``complete_choices`` for retries, timeouts and scheduling.
+    """
+    choices = await complete_choices(
+        provider, model, messages, 1, max_tokens, temperature, retries, retry_delay, timeout, route
+    )
+    return choices[0] if choices else ""
+
+
+async def complete_choices(
+    provider: str,
+    model: str,
+    messages: list,
+    n: int,
+    max_tokens: int = None,
+    temperature: float = None,
+    retries: int = 1,
+    retry_delay: float = 0.5,
+    timeout: float = DEFAULT_TIMEOUT,
+    route: str = None,
+) -> list:
+    """
+    Ask ``provider`` for ``n`` independent completions in a single request
+    and return their texts (possibly fewer than ``n`` if the provider
+    returns fewer choices).
+
+    Each attempt first waits for a scheduler slot on the provider, is bounded
+    by ``timeout`` seconds (and by the request deadline, if one is set) and
+    failed attempts back off with ``asyncio.sleep`` so the event loop keeps
+    serving other requests. While the provider's circuit breaker is open no
+    attempt is made at all. Latencies go to the router under ``route``
+    (see routing.observe).
+    Raises ProviderError once all ``retries`` attempts have failed.
+    """
+    client = get_client(provider)
+    breaker = get_breaker(provider)
+    for attempt in range(retries):
+        try:
+            await scheduler.acquire(provider)
+        except DeadlineExceeded as e:
+            raise ProviderError(f"{provider} skipped: request deadline exceeded") from e
+        except Overloaded as e:
+            raise ProviderError(f"{provider} skipped: {e}") from e
+        try:
+            attempt_timeout = bounded(timeout)
+            if not breaker.allow():
+                raise ProviderError(f"{provider} circuit breaker is open")
+            started = time.monotonic()
+            attempt_started = time.perf_counter()
+            try:
+                choices = await asyncio.wait_for(
+                    _CHAT[provider](client, model, messages, max_tokens, temperature, n),
+                    attempt_timeout,
+                )
+                breaker.record_success()
+                routing.observe(provider, model, time.monotonic() - started, ok=True, route=route)
+                metrics.observe_attempt(provider, model, attempt_started, "ok", attempt + 1)
+                return choices
+            except asyncio.CancelledError:
+                breaker.record_cancelled()
+                routing.observe(provider, model, time.monotonic() - started, ok=None, route=route)
+                metrics.observe_attempt(provider, model, attempt_started, "cancelled", attempt + 1)
+                raise
+            except Exception as e:
+                timed_out = isinstance(e, asyncio.TimeoutError)
+                if timed_out and attempt_timeout < timeout:
+                    # Cut short by the request deadline, not a provider fault.
+                    breaker.record_cancelled()
+                    metrics.observe_attempt(provider, model, attempt_started, "deadline", attempt + 1)
+                    raise ProviderError(f"{provider} timed out: request deadline exceeded") from e
+                breaker.record_failure()
+                metrics.observe_attempt(provider, model, attempt_started, "timeout" if timed_out else "error", attempt + 1)
+                # A timeout still tells the router how slow the provider was.
+                elapsed = time.monotonic() - started if timed_out else None
+                routing.observe(provider, model, elapsed, ok=False, route=route)
+                if attempt == retries - 1:
+                    raise ProviderError(f"{provider} unavailable after {retries} attempts") from e
+                # Counted, and logged below the default level: the caller
+                # reports the call as a whole if every attempt fails.
+                metrics.PROVIDER_RETRIES.inc(provider=provider, model=model)
+                logger.info("%s (%s) attempt %d failed, retrying: %s", provider, model, attempt + 1, e)
+                error = e
+        except DeadlineExceeded as e:
+            raise ProviderError(f"{provider} skipped: request deadline exceeded") from e
+        finally:
+            # The slot is not held while backing off.
+            scheduler.release(provider)
+        try:
+            await asyncio.sleep(bounded(retry_delay))
+        except DeadlineExceeded:
+            raise ProviderError(f"{provider} unavailable: request deadline exceeded") from error
+        retry_delay *= 2  # Exponential backoff
+
+
+async def stream(
+    provider: str,
+    model: str,
+    messages: list,
+    max_tokens: int = None,
+    temperature: float = None,
+    timeout: float = DEFAULT_TIMEOUT,
+):
+    """
+    Stream a chat completion from ``provider``, yielding text chunks as they
+    arrive. ``timeout`` bounds the wait for each chunk (and the request
+    deadline still applies). There are no retries: once text has been
+    yielded the caller decides how to recover.
+    Raises ProviderError if the stream cannot start or breaks off.
+    """
+    client = get_client(provider)
+    breaker = get_breaker(provider)
+    try:
+        await scheduler.acquire(provider)
+    except DeadlineExceeded as e:
+        raise ProviderError(f"{provider} skipped: request deadline exceeded") from e
+    except Overloaded as e:
+        raise ProviderError(f"{provider} skipped: {e}") from e
+    if not breaker.allow():
+        scheduler.release(provider)
+        raise ProviderError(f"{provider} circuit breaker is open")
+    started = time.monotonic()
+    attempt_started = time.perf_counter()
+    outcome = "error"
+    chunks = _STREAM[provider](client, model, messages, max_tokens, temperature)
+    try:
+        while True:
+            try:
+                chunk_timeout = bounded(timeout)
+            except DeadlineExceeded as e:
+                breaker.record_cancelled()
+                raise ProviderError(f"{provider} stream stopped: request deadline exceeded") from e
+            try:
+                text = await asyncio.wait_for(chunks.__anext__(), chunk_timeout)
+            except StopAsyncIteration:
+                break
+            yield text
+    except (asyncio.CancelledError, GeneratorExit):
+        breaker.record_cancelled()
+        routing.observe(provider, model, time.monotonic() - started, ok=None)
+        outcome = "cancelled"
+        raise
+    except ProviderError:
+        outcome = "deadline"
+        raise
+    except Exception as e:
+        if isinstance(e, asyncio.TimeoutError) and chunk_timeout < timeout:
+            breaker.record_cancelled()
+            outcome = "deadline"
+            raise ProviderError(f"{provider} stream timed out: request deadline exceeded") from e
+        breaker.record_failure()
+        outcome = "timeout" if isinstance(e, asyncio.TimeoutError) else "error"
+        elapsed = time.monotonic() - started if isinstance(e, asyncio.TimeoutError) else None
+        routing.observe(provider, model, elapsed, ok=False)
+        logger.warning("%s (%s) stream failed: %s", provider, model, e)
+        raise ProviderError(f"{provider} stream failed") from e
+    else:
+        outcome = "ok"
+    finally:
+        scheduler.release(provider)
+        metrics.observe_attempt(provider, model, attempt_started, outcome, 1)
+        await chunks.aclose()
+    breaker.record_success()
+    routing.observe(provider, model, time.monotonic() - started, ok=True)
+
+
+def warmup_providers() -> list:
+    """
+    Providers named by PROVIDER_WARMUP that have an API key configured.
+    """
+    names = [name.strip() for name in WARMUP_PROVIDERS.split(",") if name.strip()]
+    if "all" in names:
+        names = list(API_KEY_ENV)
+    return [name for name in names if name in API_KEY_ENV and os.getenv(API_KEY_ENV[name])]
+
+
+async def warm_up(names: list = None):
+    """
+    Import the SDKs of ``names`` (default: ``warmup_providers()``), create
+    their clients and open a pooled connection to each, so the first real
+    request skips the import and the TCP/TLS handshake. Failures are logged
+    and otherwise ignored; the request path creates clients as before.
+    """
+    for provider in warmup_providers() if names is None else names:
+        started = time.perf_counter()
+        try:
+            # The SDK import is blocking; keep it off the event loop.
+            client = await asyncio.to_thread(get_client, provider)
+            base_url = getattr(client, "base_url", None)
+            if base_url is not None:
+                # Any response will do: the connection stays in the keep-alive pool.
+                await get_http_client().head(str(base_url))
+            logger.info("Warmed up %s in %.0f ms", provider, (time.perf_counter() - started) * 1000)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Warm-up of %s failed: %s", provider, e)
+
+
+async def aclose():
+    """
+    Close the pooled HTTP connections. Called on application shutdown.
+    """
+    global _http_client
+    for client in _clients.values():
+        aio = getattr(client, "aio", None)
+        if aio is not None and hasattr(aio, "aclose"):
+            await aio.aclose()
+    _clients.clear()
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
@@ -0,0 +1,250 @@
+# resilience.py
+import asyncio
+import contextvars
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import metrics
+
+# A breaker opens after this many consecutive failed attempts and lets one
+# trial request through after BREAKER_RESET_TIMEOUT seconds.
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+
+# Hedging starts the fallback once the primary has been slower than its recent
+# p95. Until enough samples exist HEDGE_DEFAULT_DELAY is used instead.
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "2.0"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.3"))
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+
+# Overall budget for one HTTP request, shared by every provider call it makes.
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "15"))
+
+_deadline = contextvars.ContextVar("deadline", default=None)
+_breakers = {}
+_hedges = {}
+
+
+class DeadlineExceeded(Exception):
+    """Raised when the request-wide deadline has passed."""
+
+
+class CircuitBreaker:
+    """
+    Closed -> open after repeated failures -> half-open after a cool-down,
+    where a single trial call decides whether to close again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._trial_running = False
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = "half_open"
+        if self.state == "half_open" and not self._trial_running:
+            self._trial_running = True
+            return True
+        return False
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self._trial_running = False
+
+    def record_cancelled(self):
+        # An abandoned call says nothing about the provider; free the trial slot.
+        self._trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_running = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.trips += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self.failures, "trips": self.trips}
+
+
+class HedgeStats:
+    """
+    Recent primary latencies plus counters of how calls ended. ``fallbacks``
+    counts primaries that failed outright; ``hedged`` counts slow primaries
+    that were raced against the fallback, split into primary/fallback wins.
+    A primary cancelled before it finished leaves a censored sample: its
+    elapsed time, a lower bound on its latency. Dropping those would keep
+    only the primaries fast enough to finish and pull p95 down.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.calls = 0
+        self.fallbacks = 0
+        self.hedged = 0
+        self.primary_wins = 0
+        self.fallback_wins = 0
+        self.failures = 0
+        self.censored = 0
+
+    def observe(self, seconds: float, censored: bool = False):
+        self.latencies.append(seconds)
+        if censored:
+            self.censored += 1
+
+    def hedge_delay(self) -> float:
+        if len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        ordered = sorted(self.latencies)
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        return max(HEDGE_MIN_DELAY, p95)
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "fallbacks": self.fallbacks,
+            "hedged": self.hedged,
+            "primary_wins": self.primary_wins,
+            "fallback_wins": self.fallback_wins,
+            "fallback_win_rate": self.fallback_wins / self.hedged if self.hedged else 0.0,
+            "failures": self.failures,
+            "censored_samples": self.censored,
+            "hedge_delay": round(self.hedge_delay(), 3),
+        }
+
+
+def get_breaker(provider: str) -> CircuitBreaker:
+    if provider not in _breakers:
+        _breakers[provider] = CircuitBreaker(provider)
+    return _breakers[provider]
+
+
+@contextmanager
+def deadline(seconds: float):
+    """
+    Bound everything awaited inside the block (and tasks it starts) to ``seconds``.
+    """
+    token = _deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> float:
+    """
+    Seconds left before the current deadline, or None when there is none.
+    """
+    expires = _deadline.get()
+    if expires is None:
+        return None
+    return expires - time.monotonic()
+
+
+def bounded(timeout: float) -> float:
+    """
+    Clamp ``timeout`` to the current deadline. Raises DeadlineExceeded if it has passed.
+    """
+    left = remaining()
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise DeadlineExceeded()
+    return min(timeout, left) if timeout is not None else left
+
+
+async def hedged(name: str, primary, fallback):
+    """
+    Await ``primary()`` and fall back to ``fallback()`` when it fails. If the
+    primary is still running after its recent p95 latency, the fallback is
+    started alongside it and the first successful result wins; the loser is
+    cancelled. Both are zero-argument coroutine functions that raise on
+    failure. The last error is re-raised if neither succeeds.
+    """
+    record = _hedges.setdefault(name, HedgeStats(name))
+    record.calls += 1
+    started = time.monotonic()
+    primary_task = asyncio.ensure_future(primary())
+    fallback_task = None
+    try:
+        done, _ = await asyncio.wait({primary_task}, timeout=bounded(record.hedge_delay()))
+        error = _task_error(primary_task) if done else None
+        if done and error is None:
+            record.observe(time.monotonic() - started)
+            return primary_task.result()
+
+        was_hedged = not done
+        if was_hedged:
+            record.hedged += 1
+        else:
+            record.fallbacks += 1
+        metrics.FALLBACKS.inc(call=name, reason="hedge" if was_hedged else "failure")
+        fallback_task = asyncio.ensure_future(metrics.timed("fallback", fallback))
+        pending = {primary_task, fallback_task} if was_hedged else {fallback_task}
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=bounded(None), return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                raise DeadlineExceeded()
+            for task in done:
+                task_error = _task_error(task)
+                if task_error is not None:
+                    error = task_error
+                    continue
+                if task is primary_task:
+                    record.observe(time.monotonic() - started)
+                    record.primary_wins += 1
+                elif was_hedged:
+                    record.fallback_wins += 1
+                return task.result()
+        record.failures += 1
+        raise error
+    finally:
+        if not primary_task.done():
+            primary_task.cancel()
+            record.observe(time.monotonic() - started, censored=True)
+        if fallback_task is not None and not fallback_task.done():
+            fallback_task.cancel()
+
+
+def _task_error(task: asyncio.Task):
+    if task.cancelled():
+        return RuntimeError("provider call was cancelled")
+    return task.exception()
+
+
+class DeadlineMiddleware:
+    """
+    ASGI middleware that gives every HTTP request a REQUEST_DEADLINE budget.
+    """
+
+    def __init__(self, app, seconds: float = REQUEST_DEADLINE):
+        self.app = app
+        self.seconds = seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        with deadline(self.seconds):
+            await self.app(scope, receive, send)
+
+
+def resilience_stats() -> dict:
+    return {
+        "breakers": {name: breaker.stats() for name, breaker in _breakers.items()},
+        "hedges": {name: record.stats() for name, record in _hedges.items()},
+    }
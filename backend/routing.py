@@ -0,0 +1,128 @@
+# routing.py
+import json
+import os
+import random
+from typing import Optional
+
+from resilience import get_breaker
+
+# Weight of the newest sample in the latency / error-rate moving averages.
+EWMA_ALPHA = float(os.getenv("ROUTING_EWMA_ALPHA", "0.2"))
+# Share of requests sent to a non-best healthy provider to keep its estimate fresh.
+PROBE_SHARE = float(os.getenv("ROUTING_PROBE_SHARE", "0.05"))
+# Providers whose recent error rate is above this are only used as a last resort.
+MAX_ERROR_RATE = float(os.getenv("ROUTING_MAX_ERROR_RATE", "0.5"))
+# Each step down the preference order adds this fraction to a provider's
+# latency, so a less preferred provider must be clearly faster to take over.
+PREFERENCE_PENALTY = float(os.getenv("ROUTING_PREFERENCE_PENALTY", "0.1"))
+
+# Optional per-task override of the preference order, e.g.
+# ROUTING_PREFERENCES='{"prompt_score": ["openai", "gemini"]}'
+PREFERENCES = json.loads(os.getenv("ROUTING_PREFERENCES", "{}"))
+
+_routes = {}
+_picks = {}
+
+
+class RouteStats:
+    """
+    Moving averages for one provider/model pair.
+    """
+
+    def __init__(self):
+        self.latency = None
+        self.error_rate = 0.0
+        self.samples = 0
+
+    def observe(self, seconds: Optional[float], ok: Optional[bool]):
+        self.samples += 1
+        if ok is None and self.latency is not None and seconds <= self.latency:
+            # A lower bound under the estimate says nothing new.
+            return
+        if seconds is not None:
+            self.latency = seconds if self.latency is None else EWMA_ALPHA * seconds + (1 - EWMA_ALPHA) * self.latency
+        if ok is not None:
+            self.error_rate = EWMA_ALPHA * (0.0 if ok else 1.0) + (1 - EWMA_ALPHA) * self.error_rate
+
+    def stats(self) -> dict:
+        return {
+            "latency_ewma": round(self.latency, 4) if self.latency is not None else None,
+            "error_rate_ewma": round(self.error_rate, 4),
+            "samples": self.samples,
+        }
+
+
+def _stats_for(provider: str, model: str, route: str = None) -> RouteStats:
+    key = f"{provider}:{model}" if route is None else f"{route}/{provider}:{model}"
+    if key not in _routes:
+        _routes[key] = RouteStats()
+    return _routes[key]
+
+
+def _estimate(task: str, provider: str, model: str) -> RouteStats:
+    # Tasks whose calls report under their own route are ranked on those
+    # samples once there are any, and on the shared ones until then.
+    return _routes.get(f"{task}/{provider}:{model}") or _stats_for(provider, model)
+
+
+def observe(provider: str, model: str, seconds: Optional[float], ok: Optional[bool], route: str = None):
+    """
+    Record one provider attempt. ``seconds`` may be None for failures that say
+    nothing about latency. ``ok`` is None for an attempt cancelled before it
+    finished (a lost hedge, a client gone away): ``seconds`` is then a lower
+    bound on its latency, which can only raise the estimate, and the error
+    rate is left alone. Calls much slower than a model's usual ones (batch
+    requests) pass the task as ``route`` to keep estimates of their own.
+    """
+    _stats_for(provider, model, route).observe(seconds, ok)
+
+
+def _healthy(task: str, provider: str, model: str) -> bool:
+    return get_breaker(provider).state != "open" and _estimate(task, provider, model).error_rate <= MAX_ERROR_RATE
+
+
+def _preferred(task: str, candidates: list) -> list:
+    preference = PREFERENCES.get(task)
+    if not preference:
+        return list(candidates)
+    rank = {name: i for i, name in enumerate(preference)}
+    return sorted(candidates, key=lambda c: rank.get(c[0], len(rank)))
+
+
+def order(task: str, candidates: list) -> list:
+    """
+    Return ``candidates`` ((provider, model) pairs, most preferred first) sorted
+    best first: healthy providers by preference-weighted latency, then the
+    rest. A small share of requests promotes another provider to first
+    place so its estimates stay current.
+    """
+    ranked = _preferred(task, candidates)
+
+    def cost(item):
+        rank, (provider, model) = item
+        latency = _estimate(task, provider, model).latency
+        # Unmeasured providers keep their preference position behind measured ones.
+        return (latency is None, (latency or 0.0) * (1 + PREFERENCE_PENALTY * rank), rank)
+
+    healthy = [c for c in enumerate(ranked) if _healthy(task, *c[1])]
+    unhealthy = [c for c in enumerate(ranked) if not _healthy(task, *c[1])]
+    result = [c for _, c in sorted(healthy, key=cost)] + [c for _, c in unhealthy]
+    # Probes may also go to providers with a high error rate (but a closed
+    # breaker); otherwise their estimate could never recover.
+    probes = [c for c in result[1:] if get_breaker(c[0]).state != "open"]
+    if probes and random.random() < PROBE_SHARE:
+        probe = random.choice(probes)
+        result.remove(probe)
+        result.insert(0, probe)
+
+    picks = _picks.setdefault(task, {})
+    first = f"{result[0][0]}:{result[0][1]}"
+    picks[first] = picks.get(first, 0) + 1
+    return result
+
+
+def routing_stats() -> dict:
+    return {
+        "providers": {key: route.stats() for key, route in _routes.items()},
+        "picks": _picks,
+    }
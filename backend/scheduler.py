@@ -0,0 +1,169 @@
+# scheduler.py
+import asyncio
+import contextvars
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from resilience import DeadlineExceeded, bounded, remaining
+
+# Interactive work (keystroke scoring, template clicks) always goes first;
+# background work (summaries, classifier, speculation, audits) waits behind it.
+PRIORITIES = ("interactive", "background")
+
+# Concurrent calls allowed per provider, and how many of those slots only
+# interactive work may use, so background work can never fill a provider.
+CONCURRENCY = int(os.getenv("SCHEDULER_CONCURRENCY", "16"))
+INTERACTIVE_RESERVE = int(os.getenv("SCHEDULER_INTERACTIVE_RESERVE", "4"))
+
+# Load shedding: a call is rejected outright when its queue is this deep...
+MAX_QUEUE = {
+    "interactive": int(os.getenv("SCHEDULER_MAX_QUEUE", "64")),
+    "background": int(os.getenv("SCHEDULER_BACKGROUND_MAX_QUEUE", "16")),
+}
+# ...or dropped once it has waited this long (interactive work only ever
+# waits until its request deadline).
+MAX_WAIT = {
+    "interactive": None,
+    "background": float(os.getenv("SCHEDULER_BACKGROUND_MAX_WAIT", "5")),
+}
+WAIT_WINDOW = 500
+
+_priority = contextvars.ContextVar("priority", default="interactive")
+_queues = {}
+
+
+class Overloaded(Exception):
+    """Raised when a provider call is shed instead of queued."""
+
+
+@contextmanager
+def background():
+    """
+    Run everything awaited inside the block (and tasks it starts) as background work.
+    """
+    token = _priority.set("background")
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class QueueStats:
+    """
+    Wait times and shed count for one priority class of one provider.
+    """
+
+    def __init__(self):
+        self.waits = deque(maxlen=WAIT_WINDOW)
+        self.admitted = 0
+        self.shed = 0
+
+    def observe(self, seconds: float):
+        self.admitted += 1
+        self.waits.append(seconds)
+
+    def stats(self, depth: int) -> dict:
+        ordered = sorted(self.waits)
+        return {
+            "queued": depth,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "wait_mean": round(sum(ordered) / len(ordered), 4) if ordered else 0.0,
+            "wait_p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 4) if ordered else 0.0,
+            "wait_max": round(ordered[-1], 4) if ordered else 0.0,
+        }
+
+
+class ProviderQueue:
+    """
+    Bounded concurrency for one provider with a queue per priority class.
+    Freed slots go to the oldest interactive waiter first.
+    """
+
+    def __init__(self, name: str, limit: int = CONCURRENCY, reserve: int = INTERACTIVE_RESERVE):
+        self.name = name
+        self.limit = limit
+        self.reserve = min(reserve, limit - 1)
+        self.active = 0
+        self._waiters = {p: deque() for p in PRIORITIES}
+        self._stats = {p: QueueStats() for p in PRIORITIES}
+
+    def _has_room(self, priority: str) -> bool:
+        if priority == "interactive":
+            return self.active < self.limit
+        return self.active < self.limit - self.reserve and not self._waiters["interactive"]
+
+    async def acquire(self, priority: str):
+        stats = self._stats[priority]
+        waiters = self._waiters[priority]
+        if not waiters and self._has_room(priority):
+            self.active += 1
+            stats.observe(0.0)
+            return
+        if len(waiters) >= MAX_QUEUE[priority]:
+            stats.shed += 1
+            raise Overloaded(f"{self.name} {priority} queue is full")
+
+        timeout = bounded(MAX_WAIT[priority])
+        started = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        waiters.append(future)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as we gave up; pass it on.
+                self.release()
+            elif future in waiters:
+                waiters.remove(future)
+            if isinstance(e, asyncio.TimeoutError):
+                left = remaining()
+                if left is not None and left <= 0:
+                    raise DeadlineExceeded() from e
+                stats.shed += 1
+                raise Overloaded(f"{self.name} {priority} queue wait exceeded {timeout:.1f}s") from e
+            raise
+        stats.observe(time.monotonic() - started)
+
+    def release(self):
+        self.active -= 1
+        for priority in PRIORITIES:
+            waiters = self._waiters[priority]
+            while waiters and self._has_room(priority):
+                future = waiters.popleft()
+                if future.done():
+                    continue
+                self.active += 1
+                future.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            **{p: self._stats[p].stats(len(self._waiters[p])) for p in PRIORITIES},
+        }
+
+
+def get_queue(provider: str) -> ProviderQueue:
+    if provider not in _queues:
+        _queues[provider] = ProviderQueue(provider)
+    return _queues[provider]
+
+
+async def acquire(provider: str):
+    """
+    Wait for a slot on ``provider`` in the current priority class.
+    Raises Overloaded if the call is shed, DeadlineExceeded if the request
+    deadline passes while queued.
+    """
+    await get_queue(provider).acquire(_priority.get())
+
+
+def release(provider: str):
+    get_queue(provider).release()
+
+
+def scheduler_stats() -> dict:
+    return {name: queue.stats() for name, queue in _queues.items()}
@@ -0,0 +1,80 @@
+# singleflight.py
+import asyncio
+from functools import partial
+
+_groups = {}
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key onto one in-flight task.
+
+    Every caller awaits the same task through ``asyncio.shield``, so a caller
+    that is cancelled (e.g. the client disconnected) leaves the others
+    untouched. The shared task is only cancelled once its last waiter is gone.
+    Exceptions raised by the task are re-raised to every waiter.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls = {}
+        self.started = 0
+        self.joined = 0
+
+    async def do(self, key: str, fn):
+        """
+        Await ``fn()`` for ``key``, joining an identical call already in flight.
+        """
+        call = self._calls.get(key)
+        if call is None or call.task.done():
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(partial(self._finished, key, call))
+            self.started += 1
+        else:
+            self.joined += 1
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.task.done():
+                # Forget the call now rather than in ``_finished``, which runs
+                # a loop iteration later: a caller arriving in between must
+                # start a fresh task, not join the cancelled one.
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def _finished(self, key: str, call: _Call, task: asyncio.Task):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        # Mark the exception as retrieved when every waiter has already left.
+        if not task.cancelled():
+            task.exception()
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    def stats(self) -> dict:
+        return {"started": self.started, "joined": self.joined, "in_flight": self.in_flight()}
+
+
+def get_flight(name: str) -> SingleFlight:
+    if name not in _groups:
+        _groups[name] = SingleFlight(name)
+    return _groups[name]
+
+
+def flight_stats() -> dict:
+    return {name: group.stats() for name, group in _groups.items()}
@@ -0,0 +1,224 @@
+# speculation.py
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict, deque
+
+from detect_pii import mask_pii
+from prompt_template_desc import _is_error_text, enhance_prompt_with_groq
+from prompt_templates_short import suggest_prompt_templates
+from resilience import deadline, get_breaker
+from scheduler import background
+from summary_gen import get_session_summary
+
+# Server-side switch; clients additionally opt in per request.
+SPECULATION_ENABLED = os.getenv("SPECULATION_DISABLED", "") == ""
+# How long a scored prompt must stay unedited before generation starts.
+SPECULATION_DELAY = float(os.getenv("SPECULATION_DELAY_MS", "800")) / 1000
+# At most this many speculative generations may start per minute...
+SPECULATION_BUDGET_PER_MINUTE = int(os.getenv("SPECULATION_BUDGET_PER_MINUTE", "30"))
+# ...and at most this many may run at once.
+SPECULATION_MAX_INFLIGHT = int(os.getenv("SPECULATION_MAX_INFLIGHT", "4"))
+SPECULATION_MAX_ENTRIES = int(os.getenv("SPECULATION_MAX_ENTRIES", "512"))
+SPECULATION_TTL = float(os.getenv("SPECULATION_TTL", "300"))
+# Time limit for one background generation (it is not bound by any request deadline).
+SPECULATION_TIMEOUT = 30.0
+
+# Short templates are speculated at the count the extension asks for.
+SHORT_NUM_TEMPLATES = 1
+
+KINDS = ("short", "descriptive")
+_PROVIDERS = {"short": ("openai",), "descriptive": ("groq", "openai")}
+
+stats = {
+    "scheduled": 0,
+    "started": 0,
+    "cancelled": 0,
+    "skipped_budget": 0,
+    "skipped_unhealthy": 0,
+    "failed": 0,
+    "hits": 0,
+    "inflight_hits": 0,
+    "misses": 0,
+    "used": 0,
+    "wasted": 0,
+}
+
+_entries = OrderedDict()
+_pending = {}
+_started = deque()
+_inflight = 0
+
+
+class Speculation:
+    """
+    One background template generation for a prompt. ``digest`` covers the
+    raw prompt and context, so prompts that only mask to the same text never
+    share a result.
+    """
+
+    def __init__(self, digest: str):
+        self.digest = digest
+        self.expires = time.monotonic() + SPECULATION_TTL
+        self.task = None
+        self.claimed = False
+
+
+def _digest(prompt: str, summary: str) -> str:
+    return hashlib.sha256(f"{prompt}\x00{summary}".encode("utf-8")).hexdigest()
+
+
+def _store_key(kind: str, masked_prompt: str) -> str:
+    return f"{kind}:{masked_prompt}"
+
+
+def _summary_for(kind: str, session_id: str, summary: str = "") -> str:
+    if kind != "descriptive":
+        return ""
+    return (get_session_summary(session_id) if session_id else "") or summary
+
+
+def _evict(key: str):
+    entry = _entries.pop(key)
+    if not entry.claimed:
+        stats["wasted"] += 1
+    if entry.task is not None and not entry.task.done():
+        entry.task.cancel()
+
+
+def _prune():
+    now = time.monotonic()
+    for key in [k for k, e in _entries.items() if e.expires < now]:
+        _evict(key)
+    while len(_entries) > SPECULATION_MAX_ENTRIES:
+        _evict(next(iter(_entries)))
+
+
+def _within_budget() -> bool:
+    now = time.monotonic()
+    while _started and now - _started[0] > 60:
+        _started.popleft()
+    return len(_started) < SPECULATION_BUDGET_PER_MINUTE and _inflight < SPECULATION_MAX_INFLIGHT
+
+
+def _healthy(kind: str) -> bool:
+    # Background work must not add load to a provider that is already struggling.
+    return all(get_breaker(p).state == "closed" for p in _PROVIDERS[kind])
+
+
+async def _generate(kind: str, prompt: str, session_id: str):
+    if kind == "short":
+        templates = await suggest_prompt_templates(prompt, SHORT_NUM_TEMPLATES)
+        if not templates:
+            raise RuntimeError("no templates generated")
+        return templates
+    templates = await enhance_prompt_with_groq(prompt, session_id=session_id)
+    if _is_error_text(templates):
+        raise RuntimeError(templates)
+    return templates
+
+
+async def _speculate(kind: str, prompt: str, masked_prompt: str, summary_session_id: str):
+    global _inflight
+    await asyncio.sleep(SPECULATION_DELAY)
+    # The prompt stayed unedited for the whole delay; decide whether to spend budget on it.
+    if not _within_budget():
+        stats["skipped_budget"] += 1
+        return
+    if not _healthy(kind):
+        stats["skipped_unhealthy"] += 1
+        return
+    key = _store_key(kind, masked_prompt)
+    digest = _digest(prompt, _summary_for(kind, summary_session_id))
+    existing = _entries.get(key)
+    if existing is not None and existing.digest == digest:
+        return
+    _prune()
+    entry = Speculation(digest)
+    _started.append(time.monotonic())
+    _inflight += 1
+    stats["started"] += 1
+    with deadline(SPECULATION_TIMEOUT), background():
+        entry.task = asyncio.ensure_future(_generate(kind, prompt, summary_session_id))
+    entry.task.add_done_callback(_finished)
+    if key in _entries:
+        _evict(key)
+    _entries[key] = entry
+
+
+def _finished(task: asyncio.Task):
+    global _inflight
+    _inflight -= 1
+    if task.cancelled():
+        return
+    if task.exception() is not None:
+        stats["failed"] += 1
+        print(f"Speculative template generation failed: {task.exception()}")
+
+
+def on_score(kind: str, prompt: str, score: dict, session_id: str = None, summary_session_id: str = None):
+    """
+    Called after a prompt was scored for a client that opted into speculation.
+    Any pending speculation of the session's previous text is dropped; a low
+    or medium score schedules template generation once the prompt has stayed
+    unedited for SPECULATION_DELAY seconds.
+
+    ``session_id`` is the scoring session; ``summary_session_id`` is the chat
+    whose rolling summary the descriptive request will be made with, so the
+    speculated result is generated, and its digest taken, with that summary.
+    """
+    if not SPECULATION_ENABLED or kind not in KINDS:
+        return
+    if session_id in _pending:
+        previous = _pending.pop(session_id)
+        if not previous.done():
+            previous.cancel()
+            stats["cancelled"] += 1
+    if score.get("score") not in ("low", "medium"):
+        return
+    stats["scheduled"] += 1
+    task = asyncio.ensure_future(_speculate(kind, prompt, score["masked_prompt"], summary_session_id))
+    if session_id is not None:
+        _pending[session_id] = task
+        task.add_done_callback(lambda t: _pending.pop(session_id, None) if _pending.get(session_id) is t else None)
+
+
+async def claim(kind: str, prompt: str, session_id: str = None, summary: str = ""):
+    """
+    Return the speculated templates for ``prompt``, waiting for a generation
+    that is still running, or None if there is nothing usable.
+    """
+    if not SPECULATION_ENABLED or not _entries:
+        return None
+    key = _store_key(kind, mask_pii(prompt))
+    entry = _entries.get(key)
+    if entry is None or entry.expires < time.monotonic() or entry.digest != _digest(prompt, _summary_for(kind, session_id, summary)):
+        stats["misses"] += 1
+        return None
+    running = not entry.task.done()
+    try:
+        result = await asyncio.shield(entry.task)
+    except asyncio.CancelledError:
+        if not entry.task.cancelled():
+            raise
+        stats["misses"] += 1
+        return None
+    except Exception:
+        stats["misses"] += 1
+        return None
+    if not entry.claimed:
+        entry.claimed = True
+        stats["used"] += 1
+    stats["inflight_hits" if running else "hits"] += 1
+    return result
+
+
+def speculation_stats() -> dict:
+    return {
+        **stats,
+        "enabled": SPECULATION_ENABLED,
+        "entries": len(_entries),
+        "inflight": _inflight,
+        "hit_rate": stats["used"] / stats["started"] if stats["started"] else 0.0,
+    }
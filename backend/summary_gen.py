@@ -1,104 +1,163 @@
 # summary_gen.py
-from groq import Groq
+import asyncio
 import os
-from dotenv import load_dotenv
-import time
-import openai
-
-_groq_client = None
-
-def get_groq_client():
-    global _groq_client
-    if _groq_client is None:
-        api_key = os.getenv("GROQ_API_KEY")
-        if not api_key:
-            raise RuntimeError("Missing GROQ_API_KEY environment variable.")
-        _groq_client = Groq(api_key=api_key)
-    return _groq_client
-
-# --- OpenAI Client Setup (for fallback) ---
-_openai_initialized = False
-
-def get_openai_client():
-    global _openai_initialized
-    if not _openai_initialized:
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise RuntimeError("Missing OPENAI_API_KEY environment variable.")
-        openai.api_key = api_key
-        _openai_initialized = True
-    return openai
-
-
-def fallback_generate_summary(prompt_text: str, messages: list) -> str:
+
+from cache import MemoryTier, get_cache
+from providers import complete
+from resilience import hedged
+from routing import order
+
+SUMMARY_MODEL = "llama-3.3-70b-versatile"
+FALLBACK_MODEL = "gpt-4o-mini"
+SUMMARY_PROMPT_VERSION = 1
+
+_summary_cache = get_cache("summary")
+
+# Rolling per-session summaries, so each turn only sends the newest prompt.
+# Sessions idle for longer than SESSION_SUMMARY_TTL seconds are dropped.
+SESSION_SUMMARY_TTL = float(os.getenv("SESSION_SUMMARY_TTL", "1800"))
+MAX_SUMMARY_SESSIONS = int(os.getenv("MAX_SUMMARY_SESSIONS", "10000"))
+
+_session_summaries = MemoryTier(MAX_SUMMARY_SESSIONS, SESSION_SUMMARY_TTL)
+
+SYSTEM_MESSAGE = (
+    "You are an expert prompt summarizer. Your task is to review several user prompts that form a continuous chain of thought "
+    "and generate a concise, objective summary in 1-2 sentences. This summary will help another LLM retain context. "
+    "Do not add any interpretation or commentary beyond what is provided."
+)
+
+
+class SessionSummary:
+    """
+    Summary of one chat session so far. The lock keeps concurrent turns of
+    the same session from overwriting each other's update.
+    """
+
+    def __init__(self):
+        self.summary = ""
+        self.last_prompt = None
+        self.turns = 0
+        self.lock = asyncio.Lock()
+
+
+async def fallback_generate_summary(prompt_text: str, messages: list) -> str:
     """
     Fall back to OpenAI's GPT-4o-mini for summary generation.
+    Raises ProviderError if OpenAI fails too.
     """
-    get_openai_client()  # Ensure OpenAI is initialized
-    try:
-        response = openai.ChatCompletion.create(
-            model="gpt-4o-mini",
-            messages=messages,
-            max_tokens=150,
-            temperature=0.7
-        )
-        if response['choices'] and response['choices'][0]['message']:
-            return response['choices'][0]['message']['content'].strip()
-        else:
-            return ""
-    except Exception as e:
-        print(f"OpenAI fallback error in summary generation: {e}")
-        return ""
+    text = await complete(
+        "openai",
+        FALLBACK_MODEL,
+        messages,
+        max_tokens=150,
+        temperature=0.7
+    )
+    return text.strip()
 
 
-def generate_summary(prompts: list[str]) -> str:
+async def generate_summary(prompts: list[str]) -> str:
     """
     Generate a concise 1-2 sentence summary of the provided prompts.
     If the API call fails, return an empty string.
     """
-    client = get_groq_client()
-
     prompt_text = "\n".join(prompts)
 
+    key = _summary_cache.make_key(SUMMARY_MODEL, SUMMARY_PROMPT_VERSION, prompt_text)
+    cached = await _summary_cache.get(key)
+    if cached is not None:
+        return cached
+
     messages = [
-    {
-        "role": "system",
-        "content": (
-            "You are an expert prompt summarizer. Your task is to review several user prompts that form a continuous chain of thought "
-            "and generate a concise, objective summary in 1-2 sentences. This summary will help another LLM retain context. "
-            "Do not add any interpretation or commentary beyond what is provided."
-        )
-    },
-    {
-        "role": "user",
-        "content": (
-            "Generate a concise 1-1.5 sentence summary that captures the key ideas and objectives of the following user prompts without altering their original goal.\n"
-            "Format your response exactly as follows: 'The user was previously trying to [your summary].'\n"
-            "Do not include any extra text or commentary.\n\n"
-            f"User Prompts:\n{prompt_text}"
+        {"role": "system", "content": SYSTEM_MESSAGE},
+        {
+            "role": "user",
+            "content": (
+                "Generate a concise 1-1.5 sentence summary that captures the key ideas and objectives of the following user prompts without altering their original goal.\n"
+                "Format your response exactly as follows: 'The user was previously trying to [your summary].'\n"
+                "Do not include any extra text or commentary.\n\n"
+                f"User Prompts:\n{prompt_text}"
+            )
+        }
+    ]
+    summary = await _summarize(prompt_text, messages)
+    if summary:
+        await _summary_cache.set(key, summary)
+    return summary
+
+
+async def _summarize(prompt_text: str, messages: list) -> str:
+    """
+    Run ``messages`` against Groq, hedged with the OpenAI fallback.
+    Returns an empty string if both fail.
+    """
+    async def summarize_with_groq():
+        summary = await complete(
+            "groq",
+            SUMMARY_MODEL,
+            messages,
+            temperature=0.7,
+            retries=3,
+            retry_delay=0.5
         )
+        return summary.strip()
+
+    calls = {
+        ("groq", SUMMARY_MODEL): summarize_with_groq,
+        ("openai", FALLBACK_MODEL): lambda: fallback_generate_summary(prompt_text, messages),
     }
-    ]   
-
-    max_retries = 3
-    retry_delay = 0.5  
-    for attempt in range(max_retries):
-        try:
-            response = client.chat.completions.create(
-                model="llama-3.3-70b-versatile",
-                messages=messages,
-                temperature=0.7
-            )
-            if response.choices and response.choices[0].message:
-                summary = response.choices[0].message.content.strip()
-                return summary
-            else:
-                return ""
-        except Exception as e:
-            print(f"Groq API error in summary generation on attempt {attempt + 1}: {e}")
-            if attempt < max_retries - 1:
-                time.sleep(retry_delay)
-                retry_delay *= 2  # exponential backoff
-            else:
-                print("Groq API unavailable after retries. Falling back to GPT-4o-mini...")
-                return fallback_generate_summary(prompt_text, messages)
+    first, second = order("summary", list(calls))
+    try:
+        summary = await hedged(f"summary:{first[0]}", calls[first], calls[second])
+    except Exception as e:
+        print(f"Groq and GPT-4o-mini both failed in summary generation: {e}")
+        return ""
+    return summary
+
+
+def get_session_summary(session_id: str) -> str:
+    """
+    Current rolling summary for ``session_id``, or "" if there is none.
+    """
+    state = _session_summaries.get(session_id)
+    return state.summary if state is not None else ""
+
+
+async def update_session_summary(session_id: str, prompt: str) -> str:
+    """
+    Fold ``prompt`` into the session's rolling summary and return the result.
+    Only the previous summary and the new prompt are sent to the model. If
+    the update fails, the previous summary is kept.
+    """
+    state = _session_summaries.get(session_id)
+    if state is None:
+        state = SessionSummary()
+    # Refresh the TTL now so the session cannot expire mid-update.
+    _session_summaries.set(session_id, state)
+
+    async with state.lock:
+        if prompt == state.last_prompt:
+            return state.summary
+        if not state.summary:
+            summary = await generate_summary([prompt])
+        else:
+            messages = [
+                {"role": "system", "content": SYSTEM_MESSAGE},
+                {
+                    "role": "user",
+                    "content": (
+                        "Below is a running summary of the user's earlier prompts followed by their newest prompt. "
+                        "Update the summary so it captures the key ideas and objectives of the whole chain in 1-1.5 sentences, "
+                        "giving the newest prompt the most weight and dropping earlier details that no longer matter.\n"
+                        "Format your response exactly as follows: 'The user was previously trying to [your summary].'\n"
+                        "Do not include any extra text or commentary.\n\n"
+                        f"Running summary:\n{state.summary}\n\n"
+                        f"Newest prompt:\n{prompt}"
+                    )
+                }
+            ]
+            summary = await _summarize(prompt, messages)
+        if summary:
+            state.summary = summary
+            state.last_prompt = prompt
+            state.turns += 1
+        return state.summary
@@ -0,0 +1,57 @@
+"""
+Scan cost of detect_pii against prompt length.
+
+Compares the single-pass combined scanner with the old approach of searching
+and then substituting every pattern separately.
+
+    python benchmarks/bench_detect_pii.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from detect_pii import compiled_patterns, contains_pii, mask_pii, scan_pii  # noqa: E402
+
+SAMPLE = (
+    "Please review the onboarding doc for our new hire and rewrite the intro section. "
+    "Contact john.doe@example.com or call 555-123-4567 if anything is unclear. "
+    "The budget is $1,200.50 and the deadline is 12/05/2025. "
+)
+LENGTHS = [100, 1_000, 10_000, 100_000]
+
+
+def per_pattern_mask(text: str) -> str:
+    # Baseline: one search and one substitution pass per pattern.
+    for patterns in compiled_patterns.values():
+        for p in patterns:
+            p.search(text)
+    for patterns in compiled_patterns.values():
+        for p in patterns:
+            text = p.sub("XXXX", text)
+    return text
+
+
+def bench(fn, text: str) -> float:
+    number, _ = timeit.Timer(lambda: fn(text)).autorange()
+    best = min(timeit.repeat(lambda: fn(text), number=number, repeat=3))
+    return best / number * 1e6
+
+
+def main():
+    print(f"{'chars':>8} {'spans':>6} {'contains_pii':>14} {'mask_pii':>12} {'per-pattern':>13} {'speedup':>8}")
+    for length in LENGTHS:
+        text = (SAMPLE * (length // len(SAMPLE) + 1))[:length]
+        spans = len(scan_pii(text))
+        contains_us = bench(contains_pii, text)
+        mask_us = bench(mask_pii, text)
+        baseline_us = bench(per_pattern_mask, text)
+        print(
+            f"{length:>8} {spans:>6} {contains_us:>12.1f}us {mask_us:>10.1f}us "
+            f"{baseline_us:>11.1f}us {baseline_us / mask_us:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
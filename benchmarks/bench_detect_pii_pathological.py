@@ -0,0 +1,92 @@
+"""
+Worst-case scan cost of detect_pii on adversarial inputs.
+
+Each case repeats a short unit that makes a backtracking pattern fail late
+(long digit runs, label-only credentials, '@' without a domain, ...) and is
+timed at two lengths. A linear scan grows about as much as the input does;
+the script exits non-zero when any case grows more than MAX_GROWTH times
+for a FACTOR-times longer input, so a superlinear pattern fails CI. It also
+fails when the scan is more than MAX_SLOWDOWN times slower than masking the
+same input one pattern at a time, which catches a scan that is linear but
+redoes work per match (a chain of credential labels once took 3 s on 32 KB).
+
+    python benchmarks/bench_detect_pii_pathological.py [chars]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from detect_pii import ACTIVE_ENGINE, compiled_patterns, scan_pii  # noqa: E402
+
+CASES = {
+    "digits": "1",
+    "digit_groups": "1,111",
+    "dollar_digits": "$1",
+    "brace": "{1",
+    "dots": "a.",
+    "word": "a",
+    "at": "a@",
+    "at_dot": "a@a.",
+    "hyphens": "a-",
+    "spaces": " ",
+    "addr_commas": "1, a",
+    "addr_words": "1, a b, c d",
+    "newlines": "1,\n",
+    "password": "password ",
+    "colon": "password:",
+    "cred_label": "api key ",
+    "aws": "AKIA",
+    "mixed": "1a,.@ $-_:=",
+    "cred_chain": "user: secret_key: ",
+}
+CHARS = 20_000
+FACTOR = 4
+# Linear growth is FACTOR; the slack absorbs timer noise on small inputs.
+MAX_GROWTH = 2 * FACTOR
+MAX_SLOWDOWN = 10
+
+
+def per_pattern_mask(text: str) -> str:
+    for patterns in compiled_patterns.values():
+        for p in patterns:
+            text = p.sub("XXXX", text)
+    return text
+
+
+def bench(text: str, fn=scan_pii) -> float:
+    return min(timeit.repeat(lambda: fn(text), number=1, repeat=3))
+
+
+def main():
+    chars = int(sys.argv[1]) if len(sys.argv) > 1 else CHARS
+    print(f"engine: {ACTIVE_ENGINE}")
+    print(f"{'case':<14} {chars:>9} ch {chars * FACTOR:>9} ch {'growth':>7} {'per-pattern':>13} {'slowdown':>9}")
+    failed = []
+    for name, unit in CASES.items():
+        repeats = chars // len(unit)
+        small = bench(unit * repeats)
+        large = bench(unit * (repeats * FACTOR))
+        baseline = bench(unit * repeats, per_pattern_mask)
+        growth = large / small if small else 0.0
+        slowdown = small / baseline if baseline else 0.0
+        flag = "" if growth <= MAX_GROWTH else "  SUPERLINEAR"
+        if slowdown > MAX_SLOWDOWN:
+            flag += "  SLOW"
+        if flag:
+            failed.append(name)
+        print(
+            f"{name:<14} {small * 1000:>9.1f}ms {large * 1000:>9.1f}ms {growth:>6.1f}x "
+            f"{baseline * 1000:>11.1f}ms {slowdown:>8.1f}x{flag}"
+        )
+    if failed:
+        print(
+            f"\n{len(failed)} case(s) grew more than {MAX_GROWTH}x for {FACTOR}x input or ran more than "
+            f"{MAX_SLOWDOWN}x slower than per-pattern masking: {', '.join(failed)}"
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Cold-start cost of the REST app and the MCP server.
+
+Each target is started in a fresh interpreter RUNS times. For the REST app
+the script times the import of backend/main.py and the first in-process
+response; for mcp-server/server.py it times the import, which builds the
+FastMCP app. It also prints the imports with the most self time under
+``python -X importtime``, nested ones included.
+
+Provider SDKs (openai, groq, google.genai) are loaded on first use, so the
+script exits non-zero when an import pulls one in, or when the median
+import takes longer than --max-ms.
+
+    python benchmarks/bench_startup.py [--runs 5] [--max-ms 1500] [--target rest|mcp]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+BACKEND = os.path.join(ROOT, "backend")
+
+RUNS = 5
+TOP_IMPORTS = 10
+SDK_MODULES = ("openai", "groq", "google.genai")
+
+_PRELUDE = f"""
+import json, sys, time
+started = time.perf_counter()
+sys.path[:0] = [{ROOT!r}, {BACKEND!r}]
+"""
+
+_REPORT = f"""
+result["import_ms"] = (imported - started) * 1000
+result["sdks"] = [name for name in {SDK_MODULES!r} if name in sys.modules]
+print(json.dumps(result))
+"""
+
+TARGETS = {
+    "rest": _PRELUDE + """
+import main
+imported = time.perf_counter()
+import asyncio, httpx
+
+async def first_response():
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://startup") as client:
+        await client.get("/stats")
+
+asyncio.run(first_response())
+result = {"first_response_ms": (time.perf_counter() - started) * 1000}
+main.shutdown_pool()
+""" + _REPORT,
+    "mcp": _PRELUDE + """
+import importlib
+importlib.import_module("mcp-server.server")
+imported = time.perf_counter()
+result = {}
+""" + _REPORT,
+}
+
+
+def run_once(code: str) -> dict:
+    started = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "failed")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["process_ms"] = (time.perf_counter() - started) * 1000
+    return result
+
+
+def slowest_imports(code: str, top: int = TOP_IMPORTS) -> list:
+    """
+    (self ms, cumulative ms, module) of the slowest imports under -X importtime,
+    ranked by self time. Every module counts, however deeply nested, so an
+    SDK pulled in by one of the app modules shows up under its own name.
+    """
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT, capture_output=True, text=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((int(own) / 1000, int(cumulative) / 1000, name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start time of the REST app and the MCP server.")
+    parser.add_argument("--runs", type=int, default=RUNS)
+    parser.add_argument("--max-ms", type=float, help="fail when the median import takes longer")
+    parser.add_argument("--target", choices=sorted(TARGETS), action="append", help="default: all")
+    args = parser.parse_args()
+
+    failed = []
+    for name in args.target or sorted(TARGETS):
+        code = TARGETS[name]
+        try:
+            runs = [run_once(code) for _ in range(args.runs)]
+        except RuntimeError as e:
+            print(f"{name}: could not start: {e}")
+            failed.append(name)
+            continue
+        print(f"\n{name} ({args.runs} runs, median / min)")
+        for key in ("process_ms", "import_ms", "first_response_ms"):
+            values = [run[key] for run in runs if key in run]
+            if values:
+                print(f"  {key:<18} {statistics.median(values):>8.1f} {min(values):>8.1f}")
+        sdks = sorted({sdk for run in runs for sdk in run["sdks"]})
+        if sdks:
+            print(f"  provider SDKs imported at startup: {', '.join(sdks)}")
+            failed.append(name)
+        median_import = statistics.median(run["import_ms"] for run in runs)
+        if args.max_ms is not None and median_import > args.max_ms:
+            print(f"  import took {median_import:.1f} ms, over --max-ms {args.max_ms:.0f}")
+            failed.append(name)
+        print("  slowest imports (self / cumulative ms):")
+        for own_ms, cumulative_ms, module in slowest_imports(code):
+            print(f"    {own_ms:>8.1f} {cumulative_ms:>8.1f}  {module}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
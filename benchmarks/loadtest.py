@@ -0,0 +1,338 @@
+"""
+Load test of the backend with stub LLM providers, replaying extension traffic.
+
+    python benchmarks/loadtest.py --users 50 --duration 30
+    python benchmarks/loadtest.py --gemini "median=250,p99=1200,429=0.05" --errors 0.02
+    python benchmarks/loadtest.py --serve 8001                 # stubbed server only
+    python benchmarks/loadtest.py --url http://localhost:8001 --users 200
+
+Each virtual user types prompts from a fixed corpus in bursts. After each
+burst it waits out the extension's debounce and fires /prompt-score and
+/detect-pii without waiting for the answers, like the extension does. When a
+prompt is finished it presses Enter, which sends /summary-gen and
+/prompt_classifier. Requests reach the app in-process through httpx's ASGI
+transport, or a running server with --url.
+
+Reports requests/s, p50/p95/p99 latency, errors and superseded (409)
+responses per endpoint, plus this process's event-loop lag. Results are
+saved as JSON under benchmarks/results/. --compare prints the change against
+an earlier file and exits non-zero when an endpoint's p95 grew by more than
+--max-regression percent.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "backend"))
+sys.path.insert(0, BENCH_DIR)
+
+import httpx  # noqa: E402
+
+import stub_providers  # noqa: E402
+from stub_providers import StubProfile  # noqa: E402
+
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+# The extension waits this long after the last edit before sending anything.
+DEBOUNCE = 0.7
+LAG_INTERVAL = 0.05
+
+CORPUS = [
+    "write a python function that parses a csv file and returns the rows as dictionaries",
+    "explain the difference between a process and a thread to a junior developer, with examples",
+    "rewrite this email to my landlord so it sounds polite but firm about the broken heater",
+    "my email is jane.doe@example.com, draft a reply to the recruiter asking about salary range",
+    "summarize the main arguments for and against a four day work week in a table",
+    "you are a senior data engineer. design a pipeline that ingests clickstream events into a warehouse",
+    "help me plan a 5 day trip to Lisbon on a budget of $1,200 including flights",
+    "what is the time complexity of quicksort and when does it degrade",
+    "fix this error: TypeError: cannot read properties of undefined (reading 'map') in my react component",
+    "call me at 555-123-4567 tomorrow and remind me to send the invoice",
+    "generate 10 creative names for a coffee shop that also sells used books",
+    "write a cover letter for a product manager role at a fintech startup, keep it under 300 words",
+    "compare postgres and mongodb for a multi-tenant saas app with heavy reporting",
+    "translate the following paragraph into formal spanish and keep the technical terms in english",
+    "my api_key=sk-ABCDEFGHIJKLMNOPQRSTUV1234 stopped working, how do I rotate it safely",
+    "create a study plan for the AWS solutions architect exam over the next six weeks",
+]
+
+
+class Recorder:
+    """
+    Latencies and outcomes per endpoint.
+    """
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.superseded = {}
+        self.tasks = set()
+
+    def spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def post(self, client: httpx.AsyncClient, endpoint: str, payload: dict):
+        started = time.perf_counter()
+        try:
+            response = await client.post(endpoint, json=payload)
+            status = response.status_code
+        except Exception as e:
+            print(f"{endpoint} failed: {e}", file=sys.stderr)
+            status = None
+        elapsed = time.perf_counter() - started
+        if status == 409:
+            # A newer keystroke replaced this one; the extension drops it too.
+            self.superseded[endpoint] = self.superseded.get(endpoint, 0) + 1
+        elif status is None or status >= 400:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+        else:
+            self.latencies.setdefault(endpoint, []).append(elapsed)
+
+
+def percentile(ordered: list, q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+async def virtual_user(client, recorder: Recorder, rng: random.Random, args, stop_at: float):
+    session_id = uuid.uuid4().hex
+    summary_session = uuid.uuid4().hex
+    history = []
+    generation = 0
+    while time.monotonic() < stop_at:
+        prompt = rng.choice(CORPUS)
+        typed = 0
+        while typed < len(prompt) and time.monotonic() < stop_at:
+            typed = min(len(prompt), typed + rng.randint(4, 20))
+            # Typing the burst, then the debounce pause.
+            await asyncio.sleep((rng.uniform(0.3, 1.5) + DEBOUNCE) / args.speed)
+            text = prompt[:typed]
+            generation += 1
+            if args.traffic == "analyze":
+                recorder.spawn(recorder.post(client, "/analyze", {
+                    "prompt": text, "offsets": "utf16", "session_id": session_id, "generation": generation,
+                }))
+            else:
+                recorder.spawn(recorder.post(client, "/prompt-score", {
+                    "prompt": text, "session_id": session_id, "generation": generation,
+                }))
+                recorder.spawn(recorder.post(client, "/detect-pii", {
+                    "text": text, "spans": True, "offsets": "utf16",
+                }))
+        # Enter: the prompt goes into the history, the summary and the classifier.
+        await asyncio.sleep(rng.uniform(0.5, 2.0) / args.speed)
+        history = ([prompt] + history)[:5]
+        recorder.spawn(recorder.post(client, "/summary-gen", {"prompt": prompt, "session_id": summary_session}))
+        recorder.spawn(recorder.post(client, "/prompt_classifier", {"prompts": history}))
+        await asyncio.sleep(rng.uniform(1.0, 4.0) / args.speed)
+
+
+async def monitor_lag(samples: list, stop: asyncio.Event):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + LAG_INTERVAL
+        await asyncio.sleep(LAG_INTERVAL)
+        samples.append(max(0.0, loop.time() - expected))
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, capture_output=True, text=True, timeout=10
+        ).stdout.strip() or "unknown"
+    except Exception:
+        return "unknown"
+
+
+def summarize(recorder: Recorder, lag: list, elapsed: float) -> dict:
+    endpoints = {}
+    for endpoint in sorted(set(recorder.latencies) | set(recorder.errors) | set(recorder.superseded)):
+        ordered = sorted(recorder.latencies.get(endpoint, []))
+        completed = len(ordered)
+        endpoints[endpoint] = {
+            "requests": completed + recorder.errors.get(endpoint, 0) + recorder.superseded.get(endpoint, 0),
+            "rps": round(completed / elapsed, 2),
+            "p50_ms": round(percentile(ordered, 0.50) * 1000, 1),
+            "p95_ms": round(percentile(ordered, 0.95) * 1000, 1),
+            "p99_ms": round(percentile(ordered, 0.99) * 1000, 1),
+            "max_ms": round(ordered[-1] * 1000, 1) if ordered else 0.0,
+            "errors": recorder.errors.get(endpoint, 0),
+            "superseded": recorder.superseded.get(endpoint, 0),
+        }
+    ordered_lag = sorted(lag)
+    return {
+        "endpoints": endpoints,
+        "event_loop_lag_ms": {
+            "p50": round(percentile(ordered_lag, 0.50) * 1000, 2),
+            "p99": round(percentile(ordered_lag, 0.99) * 1000, 2),
+            "max": round(ordered_lag[-1] * 1000, 2) if ordered_lag else 0.0,
+        },
+    }
+
+
+def print_report(result: dict):
+    print(f"\n{'endpoint':<20} {'reqs':>6} {'rps':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'errors':>7} {'superseded':>10}")
+    for endpoint, row in result["endpoints"].items():
+        print(
+            f"{endpoint:<20} {row['requests']:>6} {row['rps']:>7.2f} {row['p50_ms']:>6.1f}ms "
+            f"{row['p95_ms']:>6.1f}ms {row['p99_ms']:>6.1f}ms {row['errors']:>7} {row['superseded']:>10}"
+        )
+    lag = result["event_loop_lag_ms"]
+    print(f"\nevent-loop lag: p50 {lag['p50']}ms  p99 {lag['p99']}ms  max {lag['max']}ms")
+    print(f"stub providers: {result['stub']}")
+
+
+def compare(result: dict, baseline_path: str, max_regression: float) -> bool:
+    """
+    Print p95 changes against ``baseline_path``; False if any grew more than ``max_regression`` percent.
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\np95 vs {os.path.basename(baseline_path)} ({baseline.get('commit', '?')}):")
+    ok = True
+    for endpoint, row in result["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(endpoint)
+        if not before or not before["p95_ms"]:
+            continue
+        change = (row["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100
+        flag = ""
+        if change > max_regression:
+            ok = False
+            flag = "  REGRESSION"
+        print(f"  {endpoint:<20} {before['p95_ms']:>8.1f}ms -> {row['p95_ms']:>8.1f}ms  {change:+6.1f}%{flag}")
+    return ok
+
+
+def build_profiles(args) -> tuple:
+    default = StubProfile(args.median_ms, args.p99_ms, args.errors, args.rate_limits)
+    profiles = {}
+    for provider in ("openai", "groq", "gemini"):
+        spec = getattr(args, provider)
+        if spec:
+            profiles[provider] = StubProfile.parse(spec, default)
+    return profiles, default
+
+
+async def run(args) -> dict:
+    recorder = Recorder()
+    lag = []
+    stop_lag = asyncio.Event()
+    lag_task = asyncio.ensure_future(monitor_lag(lag, stop_lag))
+
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=60.0)
+        app_module = None
+    else:
+        import main as app_module
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app_module.app), base_url="http://loadtest", timeout=60.0)
+
+    started = time.monotonic()
+    stop_at = started + args.duration
+    users = []
+    for i in range(args.users):
+        users.append(asyncio.ensure_future(
+            virtual_user(client, recorder, random.Random(args.seed + i), args, stop_at)
+        ))
+        await asyncio.sleep(args.ramp / max(args.users, 1))
+    await asyncio.gather(*users)
+    if recorder.tasks:
+        await asyncio.wait(set(recorder.tasks), timeout=60)
+    elapsed = time.monotonic() - started
+    stop_lag.set()
+    await lag_task
+
+    result = summarize(recorder, lag, elapsed)
+    try:
+        result["server_stats"] = (await client.get("/stats")).json()
+    except Exception:
+        result["server_stats"] = None
+    await client.aclose()
+    if app_module is not None:
+        app_module.shutdown_pool()
+    return result
+
+
+def serve(args):
+    import uvicorn
+
+    profiles, default = build_profiles(args)
+    stub_providers.install(profiles, default, args.seed)
+    import main
+    print(f"Serving the backend with stub providers on http://127.0.0.1:{args.serve}")
+    uvicorn.run(main.app, host="127.0.0.1", port=args.serve)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay extension traffic against stub LLM providers.")
+    parser.add_argument("--users", type=int, default=20, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of traffic")
+    parser.add_argument("--ramp", type=float, default=2.0, help="seconds over which users start")
+    parser.add_argument("--speed", type=float, default=1.0, help="divide typing and think time by this factor")
+    parser.add_argument("--traffic", choices=("split", "analyze"), default="split",
+                        help="split: /prompt-score + /detect-pii per pause; analyze: one /analyze call")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--median-ms", type=float, default=300.0, help="stub provider median latency")
+    parser.add_argument("--p99-ms", type=float, default=1500.0, help="stub provider p99 latency")
+    parser.add_argument("--errors", type=float, default=0.0, help="stub provider error rate")
+    parser.add_argument("--rate-limits", type=float, default=0.0, help="stub provider 429 rate")
+    for provider in ("openai", "groq", "gemini"):
+        parser.add_argument(f"--{provider}", help=f"override for {provider}, e.g. \"median=250,p99=1200,errors=0.01,429=0.05\"")
+    parser.add_argument("--url", help="drive a running server instead of the in-process app (its providers are not stubbed here)")
+    parser.add_argument("--serve", type=int, metavar="PORT", help="only run the backend with stub providers on this port")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/<time>-<commit>.json)")
+    parser.add_argument("--no-save", action="store_true")
+    parser.add_argument("--compare", help="earlier result file to compare p95 latencies against")
+    parser.add_argument("--max-regression", type=float, default=20.0, help="allowed p95 growth in percent with --compare")
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        serve(args)
+        return
+
+    profiles, default = build_profiles(args)
+    if not args.url:
+        stub_providers.install(profiles, default, args.seed)
+    result = asyncio.run(run(args))
+
+    commit = _commit()
+    result = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "config": {
+            "users": args.users,
+            "duration": args.duration,
+            "speed": args.speed,
+            "traffic": args.traffic,
+            "seed": args.seed,
+            "target": args.url or "in-process",
+            "stub_default": default.as_dict(),
+            "stub_overrides": {name: profile.as_dict() for name, profile in profiles.items()},
+        },
+        "stub": dict(stub_providers.stats),
+        **result,
+    }
+    print_report(result)
+
+    if not args.no_save:
+        path = args.output or os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{commit}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"\nSaved {path}")
+
+    if args.compare and not compare(result, args.compare, args.max_regression):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
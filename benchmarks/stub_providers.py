@@ -0,0 +1,144 @@
+"""
+Stand-in LLM providers for benchmarks: no network, no API keys, no quota.
+
+install() swaps the chat and streaming functions in backend/providers.py for
+stubs. Each stub sleeps for a latency drawn from a log-normal distribution
+and fails at the configured error and 429 rates. Replies are shaped like the
+real ones for each caller: a score word, a JSON array of scores, classifier
+JSON, a summary sentence or a rewritten prompt. Everything above the wire, including retries,
+breakers, hedging and the scheduler, runs unchanged.
+"""
+import asyncio
+import json
+import math
+import random
+import re
+
+import providers
+
+# z-score of the 99th percentile of a standard normal distribution.
+_Z99 = 2.326
+
+stats = {"calls": 0, "streams": 0, "errors": 0, "rate_limited": 0}
+
+
+class StubError(Exception):
+    """A simulated provider failure (HTTP 500)."""
+
+    status_code = 500
+
+
+class RateLimited(StubError):
+    """A simulated provider rate limit (HTTP 429)."""
+
+    status_code = 429
+
+
+class StubProfile:
+    """
+    Latency and failure behavior of one stub provider. Latency is log-normal
+    with the given median and 99th percentile.
+    """
+
+    def __init__(self, median_ms: float = 300.0, p99_ms: float = 1500.0, error_rate: float = 0.0, rate_limit_rate: float = 0.0):
+        self.median_ms = median_ms
+        self.p99_ms = max(p99_ms, median_ms)
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.sigma = math.log(self.p99_ms / median_ms) / _Z99 if median_ms > 0 else 0.0
+
+    @classmethod
+    def parse(cls, spec: str, base: "StubProfile" = None) -> "StubProfile":
+        """
+        Build a profile from "median=250,p99=1200,errors=0.01,429=0.05";
+        missing keys are taken from ``base``.
+        """
+        base = base or cls()
+        values = {
+            "median": base.median_ms,
+            "p99": base.p99_ms,
+            "errors": base.error_rate,
+            "429": base.rate_limit_rate,
+        }
+        for item in filter(None, spec.split(",")):
+            key, _, value = item.partition("=")
+            if key.strip() not in values:
+                raise ValueError(f"unknown stub setting {key!r}; expected one of {', '.join(values)}")
+            values[key.strip()] = float(value)
+        return cls(values["median"], values["p99"], values["errors"], values["429"])
+
+    def latency(self, rng: random.Random) -> float:
+        return self.median_ms * math.exp(self.sigma * rng.gauss(0.0, 1.0)) / 1000
+
+    def as_dict(self) -> dict:
+        return {
+            "median_ms": self.median_ms,
+            "p99_ms": self.p99_ms,
+            "error_rate": self.error_rate,
+            "rate_limit_rate": self.rate_limit_rate,
+        }
+
+
+def _reply(messages: list, rng: random.Random) -> str:
+    text = "\n".join(m["content"] for m in messages)
+    batch = re.search(r"JSON array of exactly (\d+) strings", text)
+    if batch:
+        return json.dumps([rng.choice(["low", "medium", "medium", "high"]) for _ in range(int(batch.group(1)))])
+    if "prompt evaluator" in text:
+        return rng.choice(["low", "medium", "medium", "high"])
+    if "strict JSON" in text:
+        return json.dumps({"suggested_llm": rng.choice(["ChatGPT", "Claude", "Gemini"]), "reason": "Stub classification."})
+    if "The user was previously trying to" in text:
+        return "The user was previously trying to get help with a task from their recent prompts."
+    return (
+        "Act as an experienced specialist. Rewrite the request below with a clear goal, the audience, "
+        "the expected format and any constraints, then answer it step by step. "
+        f"Variant {rng.randrange(10_000)}."
+    )
+
+
+def install(profiles: dict, default: StubProfile = None, seed: int = 0):
+    """
+    Replace every provider with a stub. ``profiles`` maps a provider name to
+    its StubProfile; providers without one use ``default``.
+    """
+    default = default or StubProfile()
+    rng = random.Random(seed)
+
+    def profile_for(provider: str) -> StubProfile:
+        return profiles.get(provider, default)
+
+    async def fail_or_wait(profile: StubProfile):
+        await asyncio.sleep(profile.latency(rng))
+        roll = rng.random()
+        if roll < profile.rate_limit_rate:
+            stats["rate_limited"] += 1
+            raise RateLimited("429 Too Many Requests (stub)")
+        if roll < profile.rate_limit_rate + profile.error_rate:
+            stats["errors"] += 1
+            raise StubError("500 Internal Server Error (stub)")
+
+    def make_chat(provider: str):
+        async def chat(client, model, messages, max_tokens, temperature, n):
+            stats["calls"] += 1
+            await fail_or_wait(profile_for(provider))
+            return [_reply(messages, rng) for _ in range(n)]
+        return chat
+
+    def make_stream(provider: str):
+        async def stream(client, model, messages, max_tokens, temperature):
+            stats["streams"] += 1
+            profile = profile_for(provider)
+            # Time to first token is the call latency; the rest trickles in.
+            await fail_or_wait(profile)
+            words = _reply(messages, rng).split(" ")
+            for i, word in enumerate(words):
+                if i:
+                    await asyncio.sleep(profile.median_ms / 1000 / len(words))
+                yield word if i == 0 else " " + word
+        return stream
+
+    for provider in list(providers._CHAT):
+        providers._CHAT[provider] = make_chat(provider)
+        providers._STREAM[provider] = make_stream(provider)
+    providers.get_client = lambda provider: None
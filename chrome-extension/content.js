@@ -11,12 +11,19 @@ let viewBeforeSettings = "llm";
 let currentTextbox = null;
 let isUIActive = false;
 let contextSummary = "";  // Store the summary of the last 5 prompts.
+// The backend keeps a rolling summary per chat; a new chat gets a new id.
+let summarySessionId = crypto.randomUUID();
+// Lets the backend cancel scoring for text that has since been edited.
+const SESSION_ID = crypto.randomUUID();
+let scoreGeneration = 0;
 
 
 // Global flags for detection settings and prompt type
 let scoreDetectionEnabled = true;
 let piiDetectionEnabled = true;
 let promptType = "short";  // "short" or "descriptive"
+// Opt-in: let the backend prepare templates while a low/medium score is on screen.
+let speculativeTemplates = false;
 
 
 function findActiveTextbox() {
@@ -132,10 +139,14 @@ function removeScorePipePopup() {
 
 
 /* ------------------ PII Detection Functions ------------------ */
-function showPIIPopup() {
+function showPIIPopup(categories = []) {
   const imgBtn = document.getElementById("smart-suggest-img");
   if (!imgBtn) return;
   imgBtn.style.position = "relative";
+  // List what was found, e.g. "Possible PII: email address, phone number"
+  imgBtn.title = categories.length
+    ? `Possible PII: ${categories.map(c => c.replace(/_/g, " ")).join(", ")}`
+    : "Possible PII detected";
   // Change the logo to the red version
   imgBtn.src = chrome.runtime.getURL("icons/logo_red.png");
   // Add an animation class for a pulse effect
@@ -149,11 +160,21 @@ function removePIIPopup() {
   if (!imgBtn) return;
   // Revert to the default logo
   imgBtn.src = chrome.runtime.getURL("icons/logo-128.png");
+  imgBtn.title = "";
   // Remove the animation class
   imgBtn.classList.remove("logo-red-animate");
 }
 
 
+function handlePIIResult(data) {
+  if (data.pii === true) {
+    const spans = data.spans || [];
+    showPIIPopup([...new Set(spans.map(s => s.category))]);
+  } else {
+    removePIIPopup();
+  }
+}
+
 function detectPII(prompt) {
   if (!piiDetectionEnabled) {
     removePIIPopup();
@@ -162,16 +183,10 @@ function detectPII(prompt) {
   fetch(`${BASE_URL}/detect-pii`, {
     method: "POST",
     headers: { "Content-Type": "application/json" },
-    body: JSON.stringify({ text: prompt })
+    body: JSON.stringify({ text: prompt, spans: true, offsets: "utf16" })
   })
     .then(res => res.json())
-    .then(data => {
-      if (data.pii === true) {
-        showPIIPopup();
-      } else {
-        removePIIPopup();
-      }
-    })
+    .then(handlePIIResult)
     .catch(err => {
       console.error("Error in detect-pii:", err);
     });
@@ -179,6 +194,21 @@ function detectPII(prompt) {
 
 /* ------------------ Score Prompt Function ------------------ */
 
+function handleScoreResult(scoreObj, cleaned) {
+  scoreObj = scoreObj || {};
+  const score = scoreObj.score || "unknown";
+  const displayedPrompt = scoreObj.masked_prompt || cleaned;
+
+  if (["low", "medium", "high"].includes(score)) {
+    scoreHistory.unshift({ prompt: displayedPrompt, score });
+    if (scoreHistory.length > MAX_HISTORY) scoreHistory.pop();
+    updateScoreHistoryUI();
+    showScorePipePopup(score);
+  } else {
+    removeScorePipePopup();
+  }
+}
+
 function scorePrompt(prompt) {
   if (!scoreDetectionEnabled) {
     removeScorePipePopup();
@@ -191,32 +221,165 @@ function scorePrompt(prompt) {
   const cleaned = prompt.trim();
   if (cleaned === lastScoredPrompt) return;
   lastScoredPrompt = cleaned;
+  const generation = ++scoreGeneration;
 
   fetch(`${BASE_URL}/prompt-score`, {
     method: "POST",
     headers: { "Content-Type": "application/json" },
-    body: JSON.stringify({ prompt: cleaned })
+    body: JSON.stringify({
+      prompt: cleaned,
+      session_id: SESSION_ID,
+      generation,
+      speculate: speculativeTemplates ? promptType : null,
+      summary_session_id: summarySessionId
+    })
   })
     .then(res => res.json())
     .then(data => {
-      const scoreObj = data.score || {}; 
-      const score = scoreObj.score || "unknown";
-      const displayedPrompt = scoreObj.masked_prompt || cleaned;
-      
-      if (["low", "medium", "high"].includes(score)) {
-        scoreHistory.unshift({ prompt: displayedPrompt, score });
-        if (scoreHistory.length > MAX_HISTORY) scoreHistory.pop();
-        updateScoreHistoryUI();
-        showScorePipePopup(score);
-      } else {
-        removeScorePipePopup();
-      }
+      // A newer request replaced this one; its own response will update the UI.
+      if (data.superseded || generation !== scoreGeneration) return;
+      handleScoreResult(data.score, cleaned);
     })
     .catch(err => {
       console.error("Scoring error:", err);
     });
 }
 
+/* ------------------ Combined Analyze Function ------------------ */
+
+// Read an NDJSON response line by line as it streams in.
+async function readNdjson(res, onMessage) {
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let newline;
+    while ((newline = buffer.indexOf("\n")) >= 0) {
+      const line = buffer.slice(0, newline).trim();
+      buffer = buffer.slice(newline + 1);
+      if (line) onMessage(JSON.parse(line));
+    }
+  }
+  if (buffer.trim()) onMessage(JSON.parse(buffer));
+}
+
+/* ------------------ Live Session (WebSocket) ------------------ */
+
+// While the socket is open, edits go to /ws/session as deltas: the backend
+// keeps the text and rescans only what changed. /analyze is the fallback.
+const LIVE_URL = `${BASE_URL.replace(/^http/, "ws")}/ws/session?offsets=utf16&session_id=${SESSION_ID}`;
+const LIVE_RETRY_MS = 5000;
+let liveSocket = null;
+let liveText = null;     // the text the backend holds; null until the next reset
+let liveLast = null;     // { text, options } of the latest edit
+let liveRetryAt = 0;
+
+function openLiveSocket() {
+  if (liveSocket || Date.now() < liveRetryAt || typeof WebSocket === "undefined") return;
+  const socket = new WebSocket(LIVE_URL);
+  liveSocket = socket;
+  liveText = null;
+  socket.onmessage = event => handleLiveMessage(JSON.parse(event.data));
+  socket.onerror = () => socket.close();
+  socket.onclose = () => {
+    if (liveSocket !== socket) return;
+    liveSocket = null;
+    liveText = null;
+    liveRetryAt = Date.now() + LIVE_RETRY_MS;
+  };
+}
+
+function liveSocketOpen() {
+  return liveSocket !== null && liveSocket.readyState === WebSocket.OPEN;
+}
+
+function sendLiveEdit(text, options) {
+  let message;
+  if (liveText === null) {
+    message = { type: "reset", text, ...options };
+  } else {
+    // Only the part between the common prefix and suffix is sent.
+    const max = Math.min(liveText.length, text.length);
+    let start = 0;
+    while (start < max && liveText[start] === text[start]) start++;
+    let suffix = 0;
+    while (suffix < max - start && liveText[liveText.length - 1 - suffix] === text[text.length - 1 - suffix]) suffix++;
+    // Never split a surrogate pair.
+    if (start > 0 && /[\uD800-\uDBFF]/.test(text[start - 1])) start--;
+    if (suffix > 0 && /[\uDC00-\uDFFF]/.test(text[text.length - suffix])) suffix--;
+    message = {
+      type: "delta",
+      start,
+      end: liveText.length - suffix,
+      text: text.slice(start, text.length - suffix),
+      length: text.length,
+      ...options
+    };
+  }
+  liveSocket.send(JSON.stringify(message));
+  liveText = text;
+  liveLast = { text, options };
+}
+
+function handleLiveMessage(msg) {
+  if (msg.generation !== scoreGeneration) return;
+  if (msg.resync) {
+    // The backend lost track of the text; send it whole.
+    liveText = null;
+    if (liveLast && liveSocketOpen()) sendLiveEdit(liveLast.text, liveLast.options);
+    return;
+  }
+  if ("pii" in msg && piiDetectionEnabled) handlePIIResult(msg);
+  if ("score" in msg && liveLast) handleScoreResult(msg.score, liveLast.text);
+}
+
+// One request per debounce: the PII result arrives first, the score follows.
+function analyzePrompt(prompt) {
+  const cleaned = prompt.trim();
+  const wantScore = scoreDetectionEnabled && cleaned !== lastScoredPrompt;
+  if (!scoreDetectionEnabled) removeScorePipePopup();
+  if (!piiDetectionEnabled) removePIIPopup();
+  if (!wantScore && !piiDetectionEnabled) return;
+  if (wantScore) lastScoredPrompt = cleaned;
+  const generation = ++scoreGeneration;
+
+  if (liveSocketOpen()) {
+    sendLiveEdit(cleaned, {
+      generation,
+      score: wantScore,
+      speculate: speculativeTemplates ? promptType : null,
+      summary_session_id: summarySessionId
+    });
+    return;
+  }
+  openLiveSocket();
+
+  fetch(`${BASE_URL}/analyze`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({
+      prompt: cleaned,
+      score: wantScore,
+      offsets: "utf16",
+      session_id: SESSION_ID,
+      generation,
+      speculate: speculativeTemplates ? promptType : null,
+      summary_session_id: summarySessionId
+    })
+  })
+    .then(res => readNdjson(res, msg => {
+      if (msg.superseded || generation !== scoreGeneration) return;
+      if ("pii" in msg && piiDetectionEnabled) handlePIIResult(msg);
+      if ("score" in msg) handleScoreResult(msg.score, cleaned);
+    }))
+    .catch(err => {
+      console.error("Analyze error:", err);
+    });
+}
+
 /* ------------------ LLM Suggestion Function ------------------ */
 function checkAndUpdateLLMSuggestion() {
   if (promptHistory.length === 0) return;
@@ -273,8 +436,7 @@ function observeInputBox() {
         removePIIPopup();
         return;
       }
-      scorePrompt(current);
-      detectPII(current);
+      analyzePrompt(current);
     }, 700);
   };
   
@@ -314,11 +476,11 @@ function observeInputBox() {
         // Existing call to prompt_classifier
         checkAndUpdateLLMSuggestion();
 
-        // New: Call the summary endpoint with the last 5 prompts
+        // Fold the new prompt into the backend's rolling summary for this chat
         fetch(`${BASE_URL}/summary-gen`, {
           method: "POST",
           headers: { "Content-Type": "application/json" },
-          body: JSON.stringify({ prompts: promptHistory.slice(0, MAX_HISTORY) })
+          body: JSON.stringify({ prompt: submitted, session_id: summarySessionId })
         })
           .then(res => res.json())
           .then(data => {
@@ -340,6 +502,7 @@ function checkForNewTextbox() {
 
     // Reset the summary when the chat screen changes.
     contextSummary = "";
+    summarySessionId = crypto.randomUUID();
     promptHistory = [];  // Clear old history
     // Clear popups from the previous screen
     removeScorePipePopup();
@@ -477,6 +640,14 @@ function createDropdownPanel() {
       </label>
     </div>
   
+    <div class="setting-row">
+      <span class="setting-label">Pre-generate templates</span>
+      <label class="switch">
+        <input type="checkbox" id="toggle-speculative-templates">
+        <span class="slider"></span>
+      </label>
+    </div>
+  
     <h4 class="settings-heading">Prompt Style</h4>
   
     <div class="setting-row">
@@ -592,6 +763,9 @@ function createDropdownPanel() {
       removePIIPopup();
     }
   });
+  document.getElementById("toggle-speculative-templates").addEventListener("change", function(){
+    speculativeTemplates = this.checked;
+  });
   document.querySelectorAll('input[name="promptType"]').forEach((elem) => {
     elem.addEventListener("change", function() {
       promptType = this.value;
@@ -761,9 +935,70 @@ function createFloatingButton() {
       : `${BASE_URL}/suggest-templates`;
   
     // Build the payload. For descriptive prompts, include the summary if available.
-    const payload = { prompt: original };
-    if (promptType === "descriptive" && contextSummary) {
-      payload.summary = contextSummary;
+    // Short mode fills the box with a single rewrite.
+    const payload = promptType === "descriptive" ? { prompt: original } : { prompt: original, num_templates: 1 };
+    if (promptType === "descriptive") {
+      payload.session_id = summarySessionId;
+      if (contextSummary) payload.summary = contextSummary;
+    }
+  
+    const setBoxText = (text) => {
+      if (isInputLike) {
+        // Use the native setter for INPUT or TEXTAREA
+        const proto = tag === "TEXTAREA"
+          ? window.HTMLTextAreaElement.prototype
+          : window.HTMLInputElement.prototype;
+        const setter = Object.getOwnPropertyDescriptor(proto, "value").set;
+        setter.call(inputBox, text);
+        // Dispatch events for frameworks like React
+        inputBox.dispatchEvent(new Event("input", { bubbles: true }));
+        inputBox.dispatchEvent(new Event("change", { bubbles: true }));
+      } else if (isEditable) {
+        inputBox.innerText = text;
+        inputBox.dispatchEvent(new InputEvent("input", { bubbles: true }));
+      } else {
+        console.warn("Unknown box type, can't set value:", inputBox);
+      }
+    };
+
+    const finish = (newPrompt) => {
+      inputBox.focus();
+      removeScorePipePopup();
+      scorePrompt(newPrompt);
+    };
+
+    // Descriptive templates are long, so stream them into the box as they arrive.
+    if (promptType === "descriptive") {
+      let streamed = "";
+      fetch(`${endpoint}/stream`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify(payload)
+      })
+        .then(res => readNdjson(res, msg => {
+          if ("delta" in msg) {
+            if (!streamed) hideLoadingDots();
+            streamed += msg.delta;
+            setBoxText(streamed);
+          } else if (msg.reset) {
+            // The provider broke off; the fallback starts again from scratch.
+            streamed = "";
+            setBoxText(original);
+          } else if ("templates" in msg) {
+            hideLoadingDots();
+            setBoxText(msg.templates);
+            finish(msg.templates);
+          } else if ("error" in msg) {
+            hideLoadingDots();
+            setBoxText(original);
+            console.error("Prompt suggestion unavailable:", msg.error);
+          }
+        }))
+        .catch(err => {
+          hideLoadingDots();
+          console.error("Error fetching prompt suggestion:", err);
+        });
+      return;
     }
   
     fetch(endpoint, {
@@ -782,26 +1017,8 @@ function createFloatingButton() {
           ? templates.join("\n\n")
           : templates;
   
-        if (isInputLike) {
-          // Use the native setter for INPUT or TEXTAREA
-          const proto = tag === "TEXTAREA"
-            ? window.HTMLTextAreaElement.prototype
-            : window.HTMLInputElement.prototype;
-          const setter = Object.getOwnPropertyDescriptor(proto, "value").set;
-          setter.call(inputBox, newPrompt);
-          // Dispatch events for frameworks like React
-          inputBox.dispatchEvent(new Event("input", { bubbles: true }));
-          inputBox.dispatchEvent(new Event("change", { bubbles: true }));
-        } else if (isEditable) {
-          inputBox.innerText = newPrompt;
-          inputBox.dispatchEvent(new InputEvent("input", { bubbles: true }));
-        } else {
-          console.warn("Unknown box type, can't set value:", inputBox);
-        }
-  
-        inputBox.focus();
-        removeScorePipePopup();
-        scorePrompt(newPrompt);
+        setBoxText(newPrompt);
+        finish(newPrompt);
       })
       .catch(err => console.error("Error fetching prompt suggestion:", err));
   });
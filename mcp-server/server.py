@@ -1,5 +1,5 @@
-from mcp.server.fastmcp import FastMCP
-from backend.prompt_template_desc import enhance_prompt_with_groq
+from mcp.server.fastmcp import Context, FastMCP
+from backend.prompt_template_desc import stream_enhanced_prompt
 from backend.prompt_templates_short import suggest_prompt_templates
 from dotenv import load_dotenv
 import os
@@ -9,18 +9,20 @@ port = int(os.environ.get("PORT", 8000))
 mcp = FastMCP('prompt-budd-mcp',host='0.0.0.0', port=port)
 
 @mcp.tool()
-def prompt_enhance(prompt: str):
+async def prompt_enhance(prompt: str, num_templates: int = 3, rank: bool = False):
     """ 
-    Generate a short, optimized prompt template.
+    Generate short, optimized prompt templates.
 
     Args:
         prompt (str): Raw input prompt.
+        num_templates (int): How many distinct templates to return (1-8).
+        rank (bool): Order the templates by estimated quality, best first.
 
     Returns:
         dict with key "templates": list[str]  
     """
     try:
-        templates = suggest_prompt_templates(prompt)
+        templates = await suggest_prompt_templates(prompt, num_templates, rank)
         if isinstance(templates, str):
             templates = [templates]
         return {"templates": templates}
@@ -29,10 +31,16 @@ def prompt_enhance(prompt: str):
         return {"error": str(e)}
 
 @mcp.tool()
-def prompt_enhance_descriptive(prompt: str):
+async def prompt_enhance_descriptive(prompt: str, ctx: Context):
     """
     Generate a descriptive, structured prompt template.
 
+    The text is streamed to the client as progress notifications while it
+    is generated; a notification with message "[reset]" means the provider
+    failed part-way and the text so far should be discarded. Progress counts
+    the characters streamed across every attempt, plus one per reset, so it
+    only ever increases.
+
     Args:
         prompt (str): Raw input prompt.
 
@@ -41,7 +49,22 @@ def prompt_enhance_descriptive(prompt: str):
           - "templates" (str): A descriptive template string 
     """
     try:
-        templates = enhance_prompt_with_groq(prompt, summary='')
+        progress = 0
+        templates = None
+        async for event in stream_enhanced_prompt(prompt, summary=''):
+            if "delta" in event:
+                if not event["delta"]:
+                    continue
+                progress += len(event["delta"])
+                await ctx.report_progress(progress, message=event["delta"])
+            elif event.get("reset"):
+                # Progress must increase with every notification, resets included.
+                progress += 1
+                await ctx.report_progress(progress, message="[reset]")
+            elif "error" in event:
+                return {"error": event["error"]}
+            else:
+                templates = event["templates"]
         if isinstance(templates, str):
             templates = [templates]
         return {"templates": templates}